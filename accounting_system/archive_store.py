@@ -0,0 +1,243 @@
+import os
+import gzip
+import shutil
+import sqlite3
+import hashlib
+import zlib
+import tempfile
+import threading
+from datetime import datetime
+
+CHUNK_SIZE = 1024 * 1024
+# Only keep the compressed copy if it saves at least this fraction of the size
+MIN_COMPRESSION_SAVING = 0.05
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    compression TEXT NOT NULL,
+    first_seen TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    hash TEXT NOT NULL REFERENCES objects(hash),
+    original_name TEXT NOT NULL,
+    category TEXT NOT NULL,
+    archived_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ledger_links (
+    hash TEXT NOT NULL REFERENCES objects(hash),
+    invoice_number TEXT NOT NULL,
+    PRIMARY KEY (hash, invoice_number)
+);
+CREATE INDEX IF NOT EXISTS idx_entries_hash ON entries(hash);
+CREATE INDEX IF NOT EXISTS idx_entries_name ON entries(original_name);
+CREATE INDEX IF NOT EXISTS idx_ledger_invoice ON ledger_links(invoice_number);
+"""
+
+
+class ArchiveStore:
+    """Content-addressed, deduplicating archive for processed originals.
+
+    Objects are stored once per unique SHA-256 under a two-level sharded
+    layout (objects/ab/cd/<hash>[.gz]) so no directory grows unbounded. A
+    SQLite index maps each hash to the original file names, categories
+    (analyzed, processed, failed), archive timestamps and ledger invoice
+    numbers.
+    """
+
+    def __init__(self, archive_dir, compress=True):
+        self.archive_dir = archive_dir
+        self.objects_dir = os.path.join(archive_dir, "objects")
+        self.index_file = os.path.join(archive_dir, "index.sqlite")
+        self.compress = compress
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.index_file, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+
+    def object_path(self, file_hash, compression="none"):
+        """Sharded path for an object"""
+        suffix = ".gz" if compression == "gzip" else ""
+        return os.path.join(self.objects_dir, file_hash[:2], file_hash[2:4], file_hash + suffix)
+
+    def hash_file(self, file_path):
+        """Hash a file in place, without copying it.
+
+        Whether to gzip is decided from the first chunk: already-compressed
+        formats (JPEG, PNG, most PDFs) barely shrink and are stored raw.
+        Returns (hash, size, compression).
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        compression = "none"
+        with open(file_path, 'rb') as src:
+            chunk = src.read(CHUNK_SIZE)
+            if self.compress and chunk:
+                sample_size = len(zlib.compress(chunk, 1))
+                if sample_size <= len(chunk) * (1 - MIN_COMPRESSION_SAVING):
+                    compression = "gzip"
+            while chunk:
+                hasher.update(chunk)
+                size += len(chunk)
+                chunk = src.read(CHUNK_SIZE)
+        return hasher.hexdigest(), size, compression
+
+    def stage(self, file_path, compression, move):
+        """Put a file's bytes in a staging file inside the archive.
+
+        A raw file that may be moved and sits on the same device is renamed,
+        so its bytes are never copied; otherwise it is copied (gzipped when
+        compression is "gzip"). Returns the staged path.
+        """
+        fd, staged_path = tempfile.mkstemp(dir=self.objects_dir, prefix=".staging_")
+        if move and compression == "none" and os.stat(file_path).st_dev == os.stat(self.objects_dir).st_dev:
+            os.close(fd)
+            os.replace(file_path, staged_path)
+            return staged_path
+
+        try:
+            with open(file_path, 'rb') as src, os.fdopen(fd, 'wb') as raw_out:
+                out = gzip.GzipFile(fileobj=raw_out, mode='wb', compresslevel=6, mtime=0) \
+                    if compression == "gzip" else raw_out
+                try:
+                    shutil.copyfileobj(src, out, CHUNK_SIZE)
+                finally:
+                    if out is not raw_out:
+                        out.close()
+        except Exception:
+            os.remove(staged_path)
+            raise
+        return staged_path
+
+    def store(self, file_path, category, invoice_numbers=None, remove_original=True):
+        """Archive a file, deduplicating identical bytes. Returns the content hash.
+
+        The file is hashed where it is first, so content already in the
+        archive is never copied.
+        """
+        file_hash, size, compression = self.hash_file(file_path)
+        now = datetime.now().isoformat()
+
+        staged_path = None
+        if not self.query("SELECT 1 FROM objects WHERE hash = ?", (file_hash,)):
+            staged_path = self.stage(file_path, compression, move=remove_original)
+
+        with self.lock:
+            existing = self.connection.execute(
+                "SELECT compression FROM objects WHERE hash = ?", (file_hash,)
+            ).fetchone()
+
+            if staged_path is not None and existing:
+                # Stored by another worker while this one was staging
+                os.remove(staged_path)
+            elif staged_path is not None:
+                destination = self.object_path(file_hash, compression)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                os.replace(staged_path, destination)
+                self.connection.execute(
+                    "INSERT INTO objects (hash, size, stored_size, compression, first_seen) VALUES (?, ?, ?, ?, ?)",
+                    (file_hash, size, os.path.getsize(destination), compression, now),
+                )
+
+            self.connection.execute(
+                "INSERT INTO entries (hash, original_name, category, archived_at) VALUES (?, ?, ?, ?)",
+                (file_hash, os.path.basename(file_path), category, now),
+            )
+            for invoice_number in invoice_numbers or []:
+                if invoice_number:
+                    self.connection.execute(
+                        "INSERT OR IGNORE INTO ledger_links (hash, invoice_number) VALUES (?, ?)",
+                        (file_hash, str(invoice_number)),
+                    )
+            self.connection.commit()
+
+        if remove_original and os.path.exists(file_path):
+            os.remove(file_path)
+
+        return file_hash
+
+    def link_invoices(self, file_hash, invoice_numbers):
+        """Attach ledger invoice numbers to an archived object"""
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO ledger_links (hash, invoice_number) VALUES (?, ?)",
+                [(file_hash, str(number)) for number in invoice_numbers if number],
+            )
+            self.connection.commit()
+
+    def query(self, sql, params=()):
+        """Run a read query against the index"""
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def retrieve(self, file_hash, destination):
+        """Restore an archived object to destination"""
+        rows = self.query("SELECT compression FROM objects WHERE hash = ?", (file_hash,))
+        if not rows:
+            raise KeyError(f"Unknown archive object: {file_hash}")
+
+        compression = rows[0][0]
+        source = self.object_path(file_hash, compression)
+        opener = gzip.open if compression == "gzip" else open
+        with opener(source, 'rb') as src, open(destination, 'wb') as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        return destination
+
+    def find_by_name(self, original_name):
+        """List archive entries recorded under an original file name"""
+        rows = self.query(
+            "SELECT hash, category, archived_at FROM entries WHERE original_name = ? ORDER BY id",
+            (original_name,),
+        )
+        return [{"hash": h, "category": c, "archived_at": a} for h, c, a in rows]
+
+    def find_by_invoice(self, invoice_number):
+        """List object hashes linked to a ledger invoice number"""
+        rows = self.query(
+            "SELECT hash FROM ledger_links WHERE invoice_number = ?", (str(invoice_number),)
+        )
+        return [row[0] for row in rows]
+
+    def describe(self, file_hash):
+        """Get names, timestamps and ledger rows recorded for an object"""
+        objects = self.query(
+            "SELECT size, stored_size, compression, first_seen FROM objects WHERE hash = ?", (file_hash,)
+        )
+        if not objects:
+            return None
+
+        obj = objects[0]
+        entries = self.query(
+            "SELECT original_name, category, archived_at FROM entries WHERE hash = ? ORDER BY id", (file_hash,)
+        )
+        invoices = self.query("SELECT invoice_number FROM ledger_links WHERE hash = ?", (file_hash,))
+        return {
+            "hash": file_hash,
+            "size": obj[0],
+            "stored_size": obj[1],
+            "compression": obj[2],
+            "first_seen": obj[3],
+            "entries": [{"original_name": n, "category": c, "archived_at": a} for n, c, a in entries],
+            "invoice_numbers": [row[0] for row in invoices],
+        }
+
+    def get_stats(self):
+        """Get archive statistics from the index (no directory listing)"""
+        objects, original_bytes, stored_bytes = self.query(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM objects"
+        )[0]
+        by_category = dict(self.query("SELECT category, COUNT(*) FROM entries GROUP BY category"))
+        entries = sum(by_category.values())
+        return {
+            "archived_files": entries,
+            "unique_objects": objects,
+            "duplicates_skipped": entries - objects,
+            "original_bytes": original_bytes,
+            "stored_bytes": stored_bytes,
+            "by_category": by_category,
+        }
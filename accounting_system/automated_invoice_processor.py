@@ -1,6 +1,7 @@
 import os
 import json
 import glob
+from types import SimpleNamespace
 from datetime import datetime
 from PIL import Image
 from dotenv import load_dotenv
@@ -8,6 +9,13 @@ from base64 import b64encode
 from anthropic import Anthropic
 import pandas as pd
 from excel_manager import ExcelManager
+from model_router import ModelRouter
+from archive_store import ArchiveStore
+from chunked_extraction import ChunkedExtractor
+from currency import DEFAULT_REPORTING_CURRENCY, normalize_currency
+from extraction_log import (
+    CURRENT_PROJECTION_VERSION, ExtractionLog, prompt_hash, reproject_history, usage_to_dict,
+)
 
 # Ensure UTF-8 encoding for Chinese characters
 import sys
@@ -71,21 +79,52 @@ TOOLS = [
     }
 ]
 
+def unique_destination(folder, filename):
+    """Destination path in folder that never overwrites an existing file"""
+    destination = os.path.join(folder, filename)
+    if os.path.exists(destination):
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        destination = os.path.join(folder, f"{timestamp}_{filename}")
+    return destination
+
+EXTRACTION_PROMPT = "Extract all invoice information from this Traditional Chinese invoice including invoice number (發票號碼), vendor details (供應商名稱、地址、電話、電子郵件), receiver details (收件人名稱、地址、電話、電子郵件), invoice date (發票日期), due date (到期日), tax amount (稅額), total amount (總金額), currency (幣別), and line items with description (項目描述), quantity (數量), unit price (單價), and amount (金額). Set payment_status to 'Pending' by default. Use the extract_invoice_data tool to return structured data. Please ensure all extracted text maintains Traditional Chinese characters where applicable."
+
 class InvoiceProcessor:
-    def __init__(self, input_folder=None, output_file="invoice_data.xlsx"):
+    def __init__(self, input_folder=None, output_file="invoice_data.xlsx", model_tiers=None,
+                 client=None, dataset_dir=None, partition_by_currency=False,
+                 archive_dir=None, extraction_log_dir=None, fx_rates_file=None,
+                 reporting_currency=DEFAULT_REPORTING_CURRENCY, thresholds=None,
+                 archive_compress=True):
         # Set default input folder to the invoice subdirectory in parent directory
         script_dir = os.path.dirname(os.path.abspath(__file__))
         parent_dir = os.path.dirname(script_dir)
         self.input_folder = input_folder or os.path.join(parent_dir, "invoice")
         self.output_file = os.path.join(parent_dir, output_file)
-        self.client = None
+        self.client = client
         self.processed_data = []
         
         # Initialize Excel manager
-        self.excel_manager = ExcelManager(self.output_file)
+        self.excel_manager = ExcelManager(self.output_file, dataset_dir, partition_by_currency,
+                                          fx_rates_file, reporting_currency)
+
+        # Route documents to a fast model first, escalating to larger ones on failure
+        self.model_router = ModelRouter(model_tiers, thresholds)
+
+        # Optional content-addressed archive replacing the flat analyzed/failed folders
+        self.archive = ArchiveStore(archive_dir, archive_compress) if archive_dir else None
+
+        # Raw extraction responses, kept so outputs can be rebuilt without API calls
+        self.extraction_log_dir = extraction_log_dir or os.path.join(parent_dir, "extraction_log")
+        self.extraction_log = ExtractionLog(self.extraction_log_dir)
+
+        # Optional budget-aware scheduler that paces every API call (see extraction_scheduler.py)
+        self.scheduler = None
         
     def initialize_api(self):
         """Initialize Anthropic API client"""
+        if self.client is not None:
+            # Already initialized (or an injected client such as FakeAnthropicClient)
+            return
         # Load .env from the parent directory
         script_dir = os.path.dirname(os.path.abspath(__file__))
         parent_dir = os.path.dirname(script_dir)
@@ -106,55 +145,146 @@ class InvoiceProcessor:
         extension = file_path.split('.')[-1].lower()
         return EXTENSION_TO_MEDIA_TYPE.get(extension, "image/jpeg")
     
-    def extract_invoice_data(self, image_path):
-        """Extract structured data from invoice image"""
+    def extract_invoice_data(self, image_path, page_count=1, source_file=None,
+                             page_number=None, total_pages=None):
+        """Extract structured data from invoice image, routing through model tiers"""
+        attempts = []
+        metadata = {
+            "processing_date": datetime.now().isoformat(),
+            "source_file": source_file or os.path.basename(image_path),
+            "confidence_score": 0.95,  # Default confidence
+        }
+        if page_number is not None:
+            metadata["page_number"] = page_number
+            metadata["total_pages"] = total_pages
+
         try:
             encoded_image = self.encode_image(image_path)
             media_type = self.get_media_type(image_path)
-            
-            message = self.client.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=2000,
-                temperature=0.1,
-                tools=TOOLS,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": media_type,
-                                    "data": encoded_image
-                                }
-                            },
-                            {
-                                "type": "text",
-                                "text": "Extract all invoice information from this Traditional Chinese invoice including invoice number (發票號碼), vendor details (供應商名稱、地址、電話、電子郵件), receiver details (收件人名稱、地址、電話、電子郵件), invoice date (發票日期), due date (到期日), tax amount (稅額), total amount (總金額), currency (幣別), and line items with description (項目描述), quantity (數量), unit price (單價), and amount (金額). Set payment_status to 'Pending' by default. Use the extract_invoice_data tool to return structured data. Please ensure all extracted text maintains Traditional Chinese characters where applicable."
-                            }
-                        ]
-                    }
-                ]
-            )
-            
-            # Extract tool use result
-            if message.content and len(message.content) > 0:
-                for content in message.content:
-                    if content.type == "tool_use" and content.name == "extract_invoice_data":
-                        invoice_data = content.input["invoice_data"]
-                        # Add metadata
-                        invoice_data["processing_date"] = datetime.now().isoformat()
-                        invoice_data["source_file"] = os.path.basename(image_path)
-                        invoice_data["confidence_score"] = 0.95  # Default confidence
-                        return invoice_data
-            
+
+            def call_model(tier):
+                invoice_data, usage = self.call_extraction_model(tier, encoded_image, media_type, attempts)
+                if attempts[-1]["stop_reason"] == "max_tokens":
+                    # A truncated tool_use block is never usable. A larger tier may
+                    # fit the whole response in one call, so only the last tier pages
+                    # through it.
+                    if not self.model_router.is_last_tier(tier):
+                        print(f"✂️  Output truncated at {tier['max_tokens']} tokens on {tier['name']}")
+                        return None, usage
+                    return self.extract_in_chunks(tier, encoded_image, media_type, attempts,
+                                                  invoice_data, usage)
+                return invoice_data, usage
+
+            invoice_data = self.model_router.extract(call_model, image_path, page_count)
+            self.log_extraction(metadata, attempts, invoice_data)
+
+            if invoice_data:
+                # Add metadata
+                invoice_data.update(metadata)
+                return invoice_data
+
             return None
-            
+
         except Exception as e:
             print(f"Error processing {image_path}: {str(e)}")
             return None
-    
+
+    def log_extraction(self, metadata, attempts, invoice_data):
+        """Append the raw responses of one extraction to the extraction log"""
+        if self.extraction_log is None:
+            return
+        try:
+            self.extraction_log.append({
+                "source_file": metadata["source_file"],
+                "processing_date": metadata["processing_date"],
+                "result_tier": invoice_data.get("model_tier") if invoice_data else None,
+                "attempts": attempts,
+                "metadata": metadata,
+            })
+        except Exception as e:
+            print(f"Could not write extraction log: {e}")
+
+    def extract_in_chunks(self, tier, encoded_image, media_type, attempts, partial_data, truncated_usage):
+        """Re-extract a truncated response as a header pass plus line item ranges.
+
+        Returns (invoice_data, usage) with usage summed over the truncated call
+        and every pass, so routing costs stay accurate.
+        """
+        print(f"✂️  Output truncated at {tier['max_tokens']} tokens on {tier['name']}, extracting in chunks")
+
+        def call_pass(prompt, tools, max_tokens, pass_info):
+            invoice_data, usage = self.call_extraction_model(tier, encoded_image, media_type, attempts,
+                                                             prompt, tools, max_tokens, pass_info)
+            return invoice_data, usage, attempts[-1]["stop_reason"]
+
+        invoice_data, usage = ChunkedExtractor(call_pass, tier["max_tokens"]).extract(partial_data)
+        return invoice_data, SimpleNamespace(
+            input_tokens=(getattr(truncated_usage, "input_tokens", 0) or 0) + usage.input_tokens,
+            output_tokens=(getattr(truncated_usage, "output_tokens", 0) or 0) + usage.output_tokens,
+            requests=1 + usage.requests,
+        )
+
+    def call_extraction_model(self, tier, encoded_image, media_type, attempts=None,
+                              prompt=EXTRACTION_PROMPT, tools=TOOLS, max_tokens=None, pass_info=None):
+        """Call a single model tier and return (invoice_data, usage).
+
+        prompt, tools and max_tokens default to a full single-pass extraction.
+        When attempts is a list, the raw tool_use input is appended to it along
+        with the pass, model, prompt hash, stop reason and token usage.
+        """
+        if self.scheduler is not None:
+            self.scheduler.pace()
+        message = self.client.messages.create(
+            model=tier["model"],
+            max_tokens=max_tokens or tier["max_tokens"],
+            temperature=0.1,
+            tools=tools,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": media_type,
+                                "data": encoded_image
+                            }
+                        },
+                        {
+                            "type": "text",
+                            "text": prompt
+                        }
+                    ]
+                }
+            ]
+        )
+
+        # Extract tool use result
+        tool_input = None
+        if message.content and len(message.content) > 0:
+            for content in message.content:
+                if content.type == "tool_use" and content.name == tools[0]["name"]:
+                    tool_input = content.input
+                    break
+
+        if attempts is not None:
+            attempts.append({
+                "tier": tier["name"],
+                **(pass_info or {"pass": "full"}),
+                "model": getattr(message, "model", None) or tier["model"],
+                # Chunk passes use their own prompts and tools, so each attempt records its own
+                "prompt_hash": prompt_hash(prompt, tools),
+                "stop_reason": getattr(message, "stop_reason", None),
+                "usage": usage_to_dict(message.usage),
+                # Snapshot before the router adds its own keys
+                "tool_input": json.loads(json.dumps(tool_input, default=str)) if tool_input else None,
+            })
+
+        if tool_input:
+            return tool_input.get("invoice_data"), message.usage
+        return None, message.usage
+
     def process_all_invoices(self):
         """Process all invoice images in the input folder"""
         if not self.client:
@@ -181,7 +311,7 @@ class InvoiceProcessor:
                 print(f"✓ Successfully processed: {os.path.basename(image_file)}")
                 
                 # Move analyzed invoice to analyzed_invoices folder
-                self.move_analyzed_invoice(image_file)
+                self.move_analyzed_invoice(image_file, invoice_data)
             else:
                 print(f"✗ Failed to process: {os.path.basename(image_file)}")
                 failed_files.append(image_file)
@@ -220,7 +350,7 @@ class InvoiceProcessor:
             if invoice_data:
                 self.processed_data.append(invoice_data)
                 print(f"✅ Retry successful: {os.path.basename(image_file)}")
-                self.move_analyzed_invoice(image_file)
+                self.move_analyzed_invoice(image_file, invoice_data)
                 retry_success += 1
             else:
                 print(f"❌ Retry failed: {os.path.basename(image_file)}")
@@ -245,19 +375,33 @@ class InvoiceProcessor:
             
             for image_file in failed_files:
                 filename = os.path.basename(image_file)
-                destination = os.path.join(failed_dir, filename)
+
+                if self.archive is not None:
+                    file_hash = self.archive.store(image_file, "failed")
+                    print(f"❌ Archived as failed: {filename} ({file_hash[:12]})")
+                    continue
+
+                destination = unique_destination(failed_dir, filename)
                 
                 # Move file to failed folder
                 import shutil
                 shutil.move(image_file, destination)
-                print(f"❌ Moved to failed folder: {filename}")
+                print(f"❌ Moved to failed folder: {os.path.basename(destination)}")
                 
         except Exception as e:
             print(f"Warning: Could not move failed files: {e}")
     
-    def move_analyzed_invoice(self, image_file):
+    def move_analyzed_invoice(self, image_file, invoice_data=None):
         """Move successfully analyzed invoice to analyzed_invoices folder"""
         try:
+            filename = os.path.basename(image_file)
+
+            if self.archive is not None:
+                invoice_numbers = [invoice_data.get("invoice_number")] if invoice_data else []
+                file_hash = self.archive.store(image_file, "analyzed", invoice_numbers)
+                print(f"📁 Archived: {filename} ({file_hash[:12]})")
+                return
+
             script_dir = os.path.dirname(os.path.abspath(__file__))
             parent_dir = os.path.dirname(script_dir)
             analyzed_dir = os.path.join(parent_dir, "analyzed_invoices")
@@ -266,7 +410,6 @@ class InvoiceProcessor:
             os.makedirs(analyzed_dir, exist_ok=True)
             
             # Get filename and create destination path
-            filename = os.path.basename(image_file)
             destination = os.path.join(analyzed_dir, filename)
             
             # Move file to analyzed_invoices folder
@@ -296,8 +439,10 @@ class InvoiceProcessor:
                 "Due Date": invoice.get("due_date", ""),
                 "Tax Amount": invoice.get("tax_amount", 0),
                 "Total Amount": invoice.get("total_amount", 0),
-                "Currency": invoice.get("currency", "USD"),
+                "Currency": normalize_currency(invoice.get("currency")),
                 "Category": invoice.get("category", ""),
+                "Payment Status": invoice.get("payment_status") or "Pending",
+                "Payment Date": invoice.get("payment_date", ""),
                 "Processing Date": invoice.get("processing_date", ""),
                 "Source File": invoice.get("source_file", ""),
             }
@@ -330,11 +475,38 @@ class InvoiceProcessor:
         """Get invoice summary using ExcelManager"""
         return self.excel_manager.get_invoice_summary()
     
+    def update_payment_status(self, invoice_number, status, payment_date=None):
+        """Update payment status using ExcelManager"""
+        return self.excel_manager.update_payment_status(invoice_number, status, payment_date)
+
+    def mark_paid_from_bank_csv(self, csv_path, columns=None):
+        """Mark invoices paid from a bank statement CSV using ExcelManager"""
+        return self.excel_manager.mark_paid_from_bank_csv(csv_path, columns)
+
+    def refresh_overdue_status(self, as_of=None):
+        """Recompute overdue transitions using ExcelManager"""
+        return self.excel_manager.refresh_overdue_status(as_of)
+
+    def get_aging_report(self, as_of=None):
+        """Get payables aging report using ExcelManager"""
+        return self.excel_manager.get_aging_report(as_of)
+
+    def rebuild_outputs(self, projection_version=CURRENT_PROJECTION_VERSION, max_workers=None):
+        """Regenerate all outputs from the extraction log without calling the API"""
+        invoices = reproject_history(self.extraction_log_dir, projection_version, max_workers)
+        if not invoices:
+            print("No logged extractions to rebuild from")
+            return 0
+        self.excel_manager.rebuild_from_invoices(invoices)
+        print(f"✓ Rebuilt {len(invoices)} invoices from {self.extraction_log_dir}")
+        return len(invoices)
+
     def run(self):
         """Run the complete invoice processing workflow"""
         print("Starting automated invoice processing...")
         self.process_all_invoices()
         self.export_to_excel()
+        self.model_router.print_routing_report()
         print(f"Processing complete. {len(self.processed_data)} invoices processed.")
 
 if __name__ == "__main__":
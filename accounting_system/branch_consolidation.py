@@ -0,0 +1,241 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from extraction_log import source_document
+from payment_status import (
+    DEFAULT_PAYMENT_STATUS, ensure_payment_columns, normalize_invoice_number, parse_dates,
+)
+from search_index import vendor_key
+
+# Ledger columns in the order ExcelManager.flatten_invoice_data writes them
+LEDGER_COLUMNS = [
+    "Invoice Number", "Vendor Name", "Vendor Address", "Vendor Phone", "Vendor Email",
+    "Receiver Name", "Receiver Address", "Receiver Phone", "Receiver Email",
+    "Invoice Date", "Due Date", "Tax Amount", "Total Amount", "Currency", "Category",
+    "Payment Status", "Payment Date", "Processing Date", "Source File",
+    "Item Description", "Quantity", "Unit Price", "Amount",
+]
+NUMERIC_COLUMNS = ["Tax Amount", "Total Amount", "Quantity", "Unit Price", "Amount"]
+DATE_COLUMNS = ["Invoice Date", "Due Date", "Payment Date"]
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(path):
+    """SHA-256 of a file's bytes"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def normalize_ledger_schema(df):
+    """Bring a branch ledger to the current column set and types.
+
+    Older workbooks may lack columns added since (payment status, line item
+    fields, ...); those are added with defaults. Unknown extra columns are kept
+    after the standard ones. Text columns become strings and dates ISO strings
+    so every branch concatenates (and caches) with the same schema.
+    """
+    df = ensure_payment_columns(df.copy())
+    for column in LEDGER_COLUMNS:
+        if column not in df.columns:
+            df[column] = None
+    extra = [column for column in df.columns if column not in LEDGER_COLUMNS]
+    df = df[LEDGER_COLUMNS + extra]
+
+    for column in df.columns:
+        if column in NUMERIC_COLUMNS:
+            df[column] = pd.to_numeric(df[column], errors="coerce")
+        elif column in DATE_COLUMNS:
+            parsed = parse_dates(df[column])
+            original = df[column].fillna("").astype(str)
+            df[column] = parsed.dt.strftime("%Y-%m-%d").where(parsed.notna(), original)
+        else:
+            df[column] = df[column].fillna("").astype(str)
+    df["Payment Status"] = df["Payment Status"].replace("", DEFAULT_PAYMENT_STATUS)
+    return df
+
+
+def read_branch_workbook(args):
+    """Read and normalize one branch workbook (runs in a worker process)"""
+    branch, path = args
+    df = normalize_ledger_schema(pd.read_excel(path))
+    df.insert(0, "Branch", branch)
+    return df
+
+
+def invoice_identity(df):
+    """Identity of the invoice each row belongs to: vendor key plus normalized invoice number"""
+    return df["Vendor Name"].map(vendor_key) + "|" + normalize_invoice_number(df["Invoice Number"])
+
+
+def dedup_across_branches(df):
+    """Keep each invoice from the first branch (in input order) that has it.
+
+    All rows the owning branch has for the invoice are retained, including
+    every page of a multi-page document; copies of the same invoice from
+    other branches are dropped. Returns (deduped, dropped_invoices).
+    """
+    identity = invoice_identity(df)
+    copies = pd.DataFrame({
+        "identity": identity,
+        "branch": df["Branch"],
+        "document": df["Source File"].map(source_document),
+    })
+    # The first branch seen for each identity owns the invoice
+    owners = copies.drop_duplicates("identity")[["identity", "branch"]]
+    owned = copies.merge(owners, on=["identity", "branch"], how="left", indicator=True)
+    keep = (owned["_merge"] == "both").values | identity.str.endswith("|").values
+    dropped = len(copies[~keep].drop_duplicates(["identity", "branch", "document"]))
+    return df[keep], dropped
+
+
+class BranchConsolidator:
+    """Merges branch-office ledgers into one consolidated workbook.
+
+    Branch workbooks are read in parallel worker processes. Each normalized
+    branch is cached as Parquet with the file's mtime, size and SHA-256 in a
+    state file; on the next run a file whose mtime and size are unchanged is
+    not opened at all, and one whose bytes hash the same is only re-hashed,
+    so a nightly run only pays for branches that changed. When no branch
+    changed and the output still has the mtime and size recorded when it was
+    written, the output is not rewritten either.
+    """
+
+    def __init__(self, output_file, state_file=None, cache_dir=None):
+        self.output_file = output_file
+        base = os.path.splitext(output_file)[0]
+        self.state_file = state_file or base + "_consolidation.json"
+        self.cache_dir = cache_dir or base + "_branches"
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.state = {"branches": {}, "output": None}
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            # Older state files hold only the branch entries
+            self.state = state if "branches" in state else {"branches": state, "output": None}
+
+    def save_state(self):
+        """Persist change tracking state"""
+        with open(self.state_file, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+
+    def cache_path(self, branch):
+        """Cached normalized ledger for a branch"""
+        return os.path.join(self.cache_dir, hashlib.sha1(branch.encode("utf-8")).hexdigest()[:16] + ".parquet")
+
+    def is_unchanged(self, branch, path):
+        """Check a branch file against its tracked mtime/size, falling back to its hash"""
+        entry = self.state["branches"].get(branch)
+        if not entry or entry.get("path") != os.path.abspath(path) or not os.path.exists(self.cache_path(branch)):
+            return False
+        stat = os.stat(path)
+        if entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return True
+        if entry["sha256"] == file_hash(path):
+            # Touched or copied but not modified
+            entry["mtime_ns"], entry["size"] = stat.st_mtime_ns, stat.st_size
+            return True
+        return False
+
+    def output_is_current(self, branch_names):
+        """Check the output was written from these branches and not modified since"""
+        output = self.state.get("output")
+        if not output or output.get("branches") != branch_names or not os.path.exists(self.output_file):
+            return False
+        stat = os.stat(self.output_file)
+        return output["mtime_ns"] == stat.st_mtime_ns and output["size"] == stat.st_size
+
+    def consolidate(self, branch_files, max_workers=None):
+        """Consolidate {branch: workbook path} into the output workbook.
+
+        Earlier branches win when the same invoice appears in several. Returns
+        a report dict.
+        """
+        branches = list(branch_files.items())
+        missing = [branch for branch, path in branches if not os.path.exists(path)]
+        for branch in missing:
+            print(f"✗ Branch workbook not found: {branch} ({branch_files[branch]})")
+        branches = [(branch, path) for branch, path in branches if branch not in missing]
+
+        changed = [(branch, path) for branch, path in branches if not self.is_unchanged(branch, path)]
+        frames = {}
+        if changed:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                for (branch, path), df in zip(changed, executor.map(read_branch_workbook, changed)):
+                    df.to_parquet(self.cache_path(branch), index=False)
+                    stat = os.stat(path)
+                    self.state["branches"][branch] = {
+                        "path": os.path.abspath(path),
+                        "mtime_ns": stat.st_mtime_ns,
+                        "size": stat.st_size,
+                        "sha256": file_hash(path),
+                        "rows": len(df),
+                        "read_at": datetime.now().isoformat(),
+                    }
+                    frames[branch] = df
+                    print(f"📥 Read {branch}: {len(df)} rows")
+
+        if not branches:
+            self.save_state()
+            print("No branch workbooks to consolidate")
+            return None
+
+        report = {
+            "branches": len(branches),
+            "read": [branch for branch, _ in changed],
+            "reused": [branch for branch, _ in branches if branch not in dict(changed)],
+            "missing": missing,
+        }
+        branch_names = [branch for branch, _ in branches]
+        if not changed and self.output_is_current(branch_names):
+            self.save_state()
+            output = self.state["output"]
+            print(f"⏭️  No branch changed; {self.output_file} is up to date")
+            return {**report, "rows": output["rows"], "duplicates_dropped": output["duplicates_dropped"],
+                    "written": False}
+
+        for branch, path in branches:
+            if branch not in frames:
+                frames[branch] = pd.read_parquet(self.cache_path(branch))
+                print(f"⏭️  Unchanged {branch}: reused {len(frames[branch])} cached rows")
+
+        combined = pd.concat([frames[branch] for branch in branch_names], ignore_index=True)
+        consolidated, dropped = dedup_across_branches(combined)
+        consolidated.to_excel(self.output_file, index=False)
+        stat = os.stat(self.output_file)
+        self.state["output"] = {
+            "branches": branch_names,
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "rows": len(consolidated),
+            "duplicates_dropped": dropped,
+            "written_at": datetime.now().isoformat(),
+        }
+        self.save_state()
+        print(f"✓ Consolidated {len(branches)} branches into {self.output_file}: "
+              f"{len(consolidated)} rows, {dropped} cross-branch duplicate invoices dropped")
+
+        return {**report, "rows": len(consolidated), "duplicates_dropped": dropped, "written": True}
+
+
+def parse_branch_args(values):
+    """Turn 'name=path' or plain paths into {branch: path}; plain paths are named
+    after their folder (branch/invoice_data.xlsx) or, failing that, their file name"""
+    branch_files = {}
+    for value in values:
+        if "=" in value:
+            branch, path = value.split("=", 1)
+        else:
+            path = value
+            folder = os.path.basename(os.path.dirname(os.path.abspath(path)))
+            stem = os.path.splitext(os.path.basename(path))[0]
+            branch = folder if stem == "invoice_data" else stem
+        branch_files[branch.strip()] = path.strip()
+    return branch_files
@@ -0,0 +1,202 @@
+from types import SimpleNamespace
+
+# Output budget for the header pass (no line items)
+HEADER_MAX_TOKENS = 1024
+# Initial guess of output tokens per line item, refined from observed usage
+TOKENS_PER_LINE_ITEM = 45
+# Tool call framing per line item pass
+LINE_ITEM_OVERHEAD_TOKENS = 150
+# Head room on top of the estimated budget
+BUDGET_MARGIN = 1.25
+MAX_ITEMS_PER_PASS = 60
+# Stop paging through line items after this many, whatever the header says
+MAX_LINE_ITEMS = 1000
+
+LINE_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "description": {"type": "string"},
+        "quantity": {"type": "number"},
+        "unit_price": {"type": "number"},
+        "amount": {"type": "number"}
+    }
+}
+
+HEADER_TOOLS = [
+    {
+        "name": "extract_invoice_header",
+        "description": "Extract invoice header fields and count the line items",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "invoice_data": {
+                    "type": "object",
+                    "properties": {
+                        "invoice_number": {"type": "string"},
+                        "vendor_name": {"type": "string"},
+                        "vendor_address": {"type": "string"},
+                        "vendor_phone": {"type": "string"},
+                        "vendor_email": {"type": "string"},
+                        "receiver_name": {"type": "string"},
+                        "receiver_address": {"type": "string"},
+                        "receiver_phone": {"type": "string"},
+                        "receiver_email": {"type": "string"},
+                        "invoice_date": {"type": "string"},
+                        "due_date": {"type": "string"},
+                        "tax_amount": {"type": "number"},
+                        "total_amount": {"type": "number"},
+                        "currency": {"type": "string"},
+                        "category": {"type": "string"},
+                        "line_item_count": {"type": "integer"}
+                    },
+                    "required": ["invoice_number", "vendor_name", "total_amount", "line_item_count"]
+                }
+            },
+            "required": ["invoice_data"]
+        }
+    }
+]
+
+LINE_ITEM_TOOLS = [
+    {
+        "name": "extract_invoice_line_items",
+        "description": "Extract a range of invoice line items",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "invoice_data": {
+                    "type": "object",
+                    "properties": {
+                        "line_items": {"type": "array", "items": LINE_ITEM_SCHEMA}
+                    },
+                    "required": ["line_items"]
+                }
+            },
+            "required": ["invoice_data"]
+        }
+    }
+]
+
+HEADER_PROMPT = "Extract the header information from this Traditional Chinese invoice: invoice number (發票號碼), vendor details (供應商名稱、地址、電話、電子郵件), receiver details (收件人名稱、地址、電話、電子郵件), invoice date (發票日期), due date (到期日), tax amount (稅額), total amount (總金額), currency (幣別) and category. Do not list the line items; instead count them and return the count as line_item_count. Use the extract_invoice_header tool. Please ensure all extracted text maintains Traditional Chinese characters where applicable."
+
+LINE_ITEMS_PROMPT = "This Traditional Chinese invoice has many line items. Number the line items 1, 2, 3, ... in the order they are printed and extract only line items {start} through {end} with description (項目描述), quantity (數量), unit price (單價) and amount (金額). Return fewer items if the invoice ends earlier. Use the extract_invoice_line_items tool. Please ensure all extracted text maintains Traditional Chinese characters where applicable."
+
+
+def line_items_prompt(start, end):
+    """Prompt for the 1-based inclusive line item range start..end"""
+    return LINE_ITEMS_PROMPT.format(start=start, end=end)
+
+
+def merge_chunks(header, line_item_chunks):
+    """Merge a header pass and ordered line item passes into one invoice_data dict"""
+    invoice_data = {key: value for key, value in (header or {}).items() if key != "line_item_count"}
+    invoice_data["line_items"] = [item for chunk in line_item_chunks for item in (chunk or [])]
+    return invoice_data
+
+
+class ChunkedExtractor:
+    """Multi-pass extraction for invoices whose output does not fit one response.
+
+    Used after a full extraction on the last model tier stops with
+    stop_reason "max_tokens" (smaller tiers escalate instead). The
+    header is extracted first (with a line item count), then line items in
+    ranges. Each range's output budget comes from the tokens per item
+    observed so far, capped at the tier's max_tokens; a range that is still
+    truncated is split in half and retried.
+
+    call_pass(prompt, tools, max_tokens, pass_info) must return
+    (invoice_data, usage, stop_reason).
+    """
+
+    def __init__(self, call_pass, max_tokens, tokens_per_item=TOKENS_PER_LINE_ITEM):
+        self.call_pass = call_pass
+        self.max_tokens = max_tokens
+        self.tokens_per_item = tokens_per_item
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.requests = 0
+
+    def call(self, prompt, tools, max_tokens, pass_info):
+        """Run one pass and accumulate its usage"""
+        invoice_data, usage, stop_reason = self.call_pass(prompt, tools, max_tokens, pass_info)
+        self.input_tokens += getattr(usage, "input_tokens", 0) or 0
+        self.output_tokens += getattr(usage, "output_tokens", 0) or 0
+        self.requests += 1
+        return invoice_data, usage, stop_reason
+
+    def observe(self, items, usage):
+        """Refine the tokens-per-item estimate from a completed pass"""
+        output_tokens = getattr(usage, "output_tokens", 0) or 0
+        if items and output_tokens:
+            observed = max(1.0, (output_tokens - LINE_ITEM_OVERHEAD_TOKENS) / len(items))
+            self.tokens_per_item = max(observed, (self.tokens_per_item + observed) / 2)
+
+    def items_per_pass(self):
+        """How many line items fit in one response at the current estimate"""
+        room = (self.max_tokens - LINE_ITEM_OVERHEAD_TOKENS) / (self.tokens_per_item * BUDGET_MARGIN)
+        return max(1, min(MAX_ITEMS_PER_PASS, int(room)))
+
+    def budget(self, count):
+        """Output budget for a pass over count line items"""
+        needed = LINE_ITEM_OVERHEAD_TOKENS + count * self.tokens_per_item * BUDGET_MARGIN
+        return int(min(self.max_tokens, needed))
+
+    def extract_range(self, start, end):
+        """Extract line items start..end, splitting the range if it is truncated"""
+        invoice_data, usage, stop_reason = self.call(
+            line_items_prompt(start, end), LINE_ITEM_TOOLS, self.budget(end - start + 1),
+            {"pass": "line_items", "range": [start, end]},
+        )
+        if stop_reason == "max_tokens":
+            if start == end:
+                raise ValueError(f"line item {start} does not fit in {self.max_tokens} output tokens")
+            # The estimate was too low for this stretch of the invoice
+            self.tokens_per_item *= 2
+            middle = (start + end) // 2
+            return self.extract_range(start, middle) + self.extract_range(middle + 1, end)
+
+        items = list((invoice_data or {}).get("line_items") or [])[:end - start + 1]
+        self.observe(items, usage)
+        return items
+
+    def extract(self, partial_data=None):
+        """Run the header and line item passes. Returns (invoice_data, usage) or (None, usage)."""
+        # Line items that made it into the truncated response show how dense the invoice is
+        partial_items = (partial_data or {}).get("line_items") or []
+        if len(partial_items) > 1:
+            self.tokens_per_item = max(self.tokens_per_item, self.max_tokens / len(partial_items))
+
+        try:
+            header, _, stop_reason = self.call(HEADER_PROMPT, HEADER_TOOLS, min(HEADER_MAX_TOKENS, self.max_tokens),
+                                               {"pass": "header"})
+            if not header or stop_reason == "max_tokens":
+                print("✗ Chunked extraction: header pass failed")
+                return None, self.usage()
+
+            expected = header.get("line_item_count")
+            expected = int(expected) if isinstance(expected, (int, float)) and expected > 0 else None
+            limit = min(expected or MAX_LINE_ITEMS, MAX_LINE_ITEMS)
+
+            chunks = []
+            start = 1
+            while start <= limit:
+                end = min(limit, start + self.items_per_pass() - 1)
+                items = self.extract_range(start, end)
+                chunks.append(items)
+                if len(items) < end - start + 1:
+                    # The invoice ended before the requested range did
+                    break
+                start = end + 1
+        except Exception as e:
+            print(f"✗ Chunked extraction failed: {e}")
+            return None, self.usage()
+
+        invoice_data = merge_chunks(header, chunks)
+        print(f"✂️  Chunked extraction: {len(invoice_data['line_items'])} line items "
+              f"in {self.requests} passes")
+        return invoice_data, self.usage()
+
+    def usage(self):
+        """Token usage summed over all passes"""
+        return SimpleNamespace(input_tokens=self.input_tokens, output_tokens=self.output_tokens,
+                               requests=self.requests)
@@ -0,0 +1,143 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+
+DEFAULT_REPORTING_CURRENCY = "TWD"
+# Currency the FX rate file is quoted in
+DEFAULT_BASE_CURRENCY = "TWD"
+
+# Currency spellings seen on invoices, mapped to ISO 4217 codes
+CURRENCY_ALIASES = {
+    "NT$": "TWD", "NT": "TWD", "NTD": "TWD", "新台幣": "TWD", "新臺幣": "TWD", "台幣": "TWD", "臺幣": "TWD",
+    "US$": "USD", "美元": "USD", "美金": "USD",
+    "JP¥": "JPY", "円": "JPY", "日圓": "JPY", "日元": "JPY", "日幣": "JPY",
+    "RMB": "CNY", "CN¥": "CNY", "人民幣": "CNY",
+    "HK$": "HKD", "港幣": "HKD", "港元": "HKD",
+    "€": "EUR", "歐元": "EUR",
+}
+
+# Column names expected in the FX rate file
+DEFAULT_RATE_COLUMNS = {
+    "date": "Date",
+    "currency": "Currency",
+    "rate": "Rate",
+}
+
+
+def normalize_currency(value):
+    """ISO code for a currency as written on an invoice; unknown stays empty, never a guess"""
+    text = str(value or "").strip()
+    if not text or text.lower() == "nan":
+        return ""
+    return CURRENCY_ALIASES.get(text, CURRENCY_ALIASES.get(text.upper(), text.upper()))
+
+
+def normalize_currency_column(values):
+    """Vectorized normalize_currency over a column"""
+    uniques = pd.unique(values.astype(object))
+    mapping = {value: normalize_currency(value) for value in uniques}
+    return values.astype(object).map(mapping)
+
+
+class FXRateTable:
+    """Historical FX rates loaded from a local CSV with as-of-date lookup.
+
+    Each row gives the value of one unit of Currency in base_currency on Date
+    (e.g. 2025-01-02,USD,32.8 for a TWD base). Rates are kept per currency as
+    sorted date arrays so lookups are a binary search (np.searchsorted) for
+    the last rate on or before each invoice date. The version is a hash of
+    the file contents and base currency, used to key conversion caches.
+    """
+
+    def __init__(self, rates_file, base_currency=DEFAULT_BASE_CURRENCY, columns=None):
+        self.rates_file = rates_file
+        self.base_currency = normalize_currency(base_currency)
+        self.columns = {**DEFAULT_RATE_COLUMNS, **(columns or {})}
+        self.dates = {}
+        self.rates = {}
+
+        with open(rates_file, 'rb') as f:
+            content = f.read()
+        self.version = hashlib.sha256(content + self.base_currency.encode()).hexdigest()[:12]
+
+        df = pd.read_csv(rates_file)
+        df = pd.DataFrame({
+            "date": pd.to_datetime(df[self.columns["date"]], errors="coerce", format="mixed"),
+            "currency": normalize_currency_column(df[self.columns["currency"]]),
+            "rate": pd.to_numeric(df[self.columns["rate"]], errors="coerce"),
+        }).dropna()
+        df = df[df["rate"] > 0].sort_values(["currency", "date"], kind="stable")
+        # Later rows win when a date is listed twice
+        df = df.drop_duplicates(["currency", "date"], keep="last")
+
+        for currency, group in df.groupby("currency"):
+            self.dates[currency] = group["date"].values.astype("datetime64[D]")
+            self.rates[currency] = group["rate"].values
+
+    @property
+    def currencies(self):
+        return sorted(set(self.rates) | {self.base_currency})
+
+    def base_rates(self, currencies, dates):
+        """Vectorized as-of lookup of base-currency rates.
+
+        currencies and dates are aligned arrays; missing dates use the latest
+        rate. Returns NaN where no rate exists on or before the date.
+        """
+        currencies = np.asarray(currencies, dtype=object)
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        result = np.full(len(currencies), np.nan)
+        result[currencies == self.base_currency] = 1.0
+
+        for currency, rate_dates in self.dates.items():
+            mask = currencies == currency
+            if not mask.any():
+                continue
+            lookup = dates[mask]
+            positions = np.searchsorted(rate_dates, lookup, side="right") - 1
+            positions[np.isnat(lookup)] = len(rate_dates) - 1
+            found = positions >= 0
+            values = np.full(len(lookup), np.nan)
+            values[found] = self.rates[currency][positions[found]]
+            result[mask] = values
+        return result
+
+    def rate(self, from_currency, to_currency, as_of=None):
+        """Single conversion rate from one currency to another as of a date"""
+        as_of = np.datetime64(pd.Timestamp(as_of), "D") if as_of else np.datetime64("NaT")
+        rates = self.base_rates([normalize_currency(from_currency), normalize_currency(to_currency)],
+                                [as_of, as_of])
+        return rates[0] / rates[1]
+
+    def convert_frame(self, df, reporting_currency, amount_columns=("Total Amount", "Tax Amount")):
+        """Convert amount columns to the reporting currency in one vectorized pass.
+
+        Rates are taken as of each row's Invoice Date. Returns a DataFrame with
+        Reporting Currency, FX Rate and "<column> (<currency>)" columns aligned
+        to df's index; rows without a usable rate get NaN.
+        """
+        reporting_currency = normalize_currency(reporting_currency)
+        currencies = normalize_currency_column(df["Currency"]).values
+        dates = pd.to_datetime(df["Invoice Date"], errors="coerce", format="mixed").values
+
+        fx = self.base_rates(currencies, dates) / self.base_rates(
+            np.full(len(df), reporting_currency, dtype=object), dates
+        )
+        converted = pd.DataFrame({"Reporting Currency": reporting_currency, "FX Rate": fx}, index=df.index)
+        for column in amount_columns:
+            if column in df.columns:
+                converted[f"{column} ({reporting_currency})"] = \
+                    pd.to_numeric(df[column], errors="coerce").values * fx
+        return converted
+
+
+def load_fx_rates(rates_file, base_currency=DEFAULT_BASE_CURRENCY):
+    """Load an FX rate table, or None if the file is missing or unreadable"""
+    if not rates_file or not os.path.exists(rates_file):
+        return None
+    try:
+        return FXRateTable(rates_file, base_currency)
+    except Exception as e:
+        print(f"Error loading FX rates from {rates_file}: {e}")
+        return None
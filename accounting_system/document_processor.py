@@ -2,19 +2,22 @@ import os
 import time
 import glob
 import shutil
+import tempfile
 from datetime import datetime
 from pathlib import Path
 from PIL import Image
 import fitz  # PyMuPDF for PDF processing
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from automated_invoice_processor import InvoiceProcessor
+from automated_invoice_processor import InvoiceProcessor, unique_destination
 
 class DocumentProcessor:
     """Enhanced document processor with multi-document capabilities"""
     
     def __init__(self, watch_folder="./watch", processed_folder="./processed", 
-                 failed_folder="./failed", output_file="invoice_data.xlsx"):
+                 failed_folder="./failed", output_file="invoice_data.xlsx", client=None,
+                 dataset_dir=None, partition_by_currency=False, archive_dir=None,
+                 extraction_log_dir=None, thresholds=None, archive_compress=True):
         self.watch_folder = watch_folder
         self.processed_folder = processed_folder
         self.failed_folder = failed_folder
@@ -26,8 +29,17 @@ class DocumentProcessor:
         os.makedirs(failed_folder, exist_ok=True)
         
         # Initialize invoice processor
-        self.invoice_processor = InvoiceProcessor(output_file=output_file)
+        self.invoice_processor = InvoiceProcessor(output_file=output_file, client=client,
+                                                  dataset_dir=dataset_dir,
+                                                  partition_by_currency=partition_by_currency,
+                                                  archive_dir=archive_dir,
+                                                  extraction_log_dir=extraction_log_dir,
+                                                  thresholds=thresholds,
+                                                  archive_compress=archive_compress)
         
+        # Optional budget-aware scheduler (see extraction_scheduler.py)
+        self.scheduler = None
+
         # Supported file types
         self.supported_image_types = ['.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tiff']
         self.supported_pdf_types = ['.pdf']
@@ -55,7 +67,9 @@ class DocumentProcessor:
                 pix = page.get_pixmap(matrix=mat)
                 
                 # Save as temporary image
-                temp_image_path = f"temp_page_{page_num}_{int(time.time())}.png"
+                # Unique name so concurrent conversions never collide
+                fd, temp_image_path = tempfile.mkstemp(prefix=f"temp_page_{page_num}_", suffix=".png")
+                os.close(fd)
                 pix.save(temp_image_path)
                 images.append(temp_image_path)
             
@@ -80,62 +94,79 @@ class DocumentProcessor:
             print(f"Error processing document {file_path}: {e}")
             return False
     
-    def process_pdf_document(self, pdf_path):
-        """Process PDF document"""
-        try:
-            # Convert PDF to images
-            temp_images = self.convert_pdf_to_images(pdf_path)
-            
-            if not temp_images:
-                print(f"Failed to convert PDF: {pdf_path}")
-                return False
-            
-            # Process each page
-            processed_data = []
-            for i, temp_image in enumerate(temp_images):
-                print(f"Processing page {i+1}/{len(temp_images)}")
-                
-                # Extract data from image
-                invoice_data = self.invoice_processor.extract_invoice_data(temp_image)
-                
+    def extract_document(self, file_path):
+        """Extract invoice data from a document without touching shared state"""
+        if self.is_pdf(file_path):
+            return self.extract_pdf_document(file_path)
+        return self.extract_image_document(file_path)
+
+    def extract_pdf_document(self, pdf_path):
+        """Extract invoice data from every page of a PDF"""
+        # Convert PDF to images
+        temp_images = self.convert_pdf_to_images(pdf_path)
+
+        if not temp_images:
+            print(f"Failed to convert PDF: {pdf_path}")
+            return []
+
+        # Process each page
+        processed_data = []
+        for i, temp_image in enumerate(temp_images):
+            print(f"Processing page {i+1}/{len(temp_images)}")
+
+            try:
+                # Extract data from image, tagged with page information
+                invoice_data = self.invoice_processor.extract_invoice_data(
+                    temp_image, page_count=len(temp_images),
+                    source_file=f"{os.path.basename(pdf_path)}_page_{i+1}",
+                    page_number=i + 1, total_pages=len(temp_images))
+
                 if invoice_data:
-                    # Add page information
-                    invoice_data['source_file'] = f"{os.path.basename(pdf_path)}_page_{i+1}"
-                    invoice_data['page_number'] = i + 1
-                    invoice_data['total_pages'] = len(temp_images)
                     processed_data.append(invoice_data)
-                
+            finally:
                 # Clean up temp image
                 os.remove(temp_image)
-            
+
+        return processed_data
+
+    def extract_image_document(self, image_path):
+        """Extract invoice data from an image"""
+        invoice_data = self.invoice_processor.extract_invoice_data(image_path)
+        return [invoice_data] if invoice_data else []
+
+    def process_pdf_document(self, pdf_path):
+        """Process PDF document"""
+        try:
+            processed_data = self.extract_pdf_document(pdf_path)
+
             # Add processed data to invoice processor
             self.invoice_processor.processed_data.extend(processed_data)
-            
+
             print(f"Successfully processed {len(processed_data)} pages from PDF")
             return len(processed_data) > 0
-            
+
         except Exception as e:
             print(f"Error processing PDF {pdf_path}: {e}")
             return False
-    
+
     def process_image_document(self, image_path):
         """Process image document"""
         try:
             # Extract data from image
-            invoice_data = self.invoice_processor.extract_invoice_data(image_path)
-            
-            if invoice_data:
-                self.invoice_processor.processed_data.append(invoice_data)
+            processed_data = self.extract_image_document(image_path)
+
+            if processed_data:
+                self.invoice_processor.processed_data.extend(processed_data)
                 print(f"Successfully processed image: {os.path.basename(image_path)}")
                 return True
             else:
                 print(f"Failed to extract data from: {os.path.basename(image_path)}")
                 return False
-                
+
         except Exception as e:
             print(f"Error processing image {image_path}: {e}")
             return False
-    
+
     def classify_document(self, file_path):
         """Classify document type based on extracted data"""
         try:
@@ -160,19 +191,26 @@ class DocumentProcessor:
             print(f"Error classifying document {file_path}: {e}")
             return 'unknown'
     
-    def move_processed_file(self, file_path, success=True):
+    def move_processed_file(self, file_path, success=True, invoice_numbers=None):
         """Move file to processed or failed folder"""
         try:
             filename = os.path.basename(file_path)
-            
+
+            archive = self.invoice_processor.archive
+            if archive is not None:
+                category = "processed" if success else "failed"
+                file_hash = archive.store(file_path, category, invoice_numbers)
+                print(f"Archived {filename} as {category} ({file_hash[:12]})")
+                return
+
             if success:
                 # Move to processed folder with timestamp
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 new_name = f"{timestamp}_{filename}"
                 destination = os.path.join(self.processed_folder, new_name)
             else:
-                # Move to failed folder
-                destination = os.path.join(self.failed_folder, filename)
+                # Move to failed folder without overwriting earlier failures
+                destination = unique_destination(self.failed_folder, filename)
             
             shutil.move(file_path, destination)
             print(f"Moved {filename} to {destination}")
@@ -180,6 +218,11 @@ class DocumentProcessor:
         except Exception as e:
             print(f"Error moving file {file_path}: {e}")
     
+    def invoice_numbers_since(self, start_index):
+        """Invoice numbers added to processed_data since start_index"""
+        return [invoice.get("invoice_number")
+                for invoice in self.invoice_processor.processed_data[start_index:]]
+
     def process_batch(self, folder_path=None):
         """Process all documents in a folder"""
         if folder_path is None:
@@ -198,24 +241,46 @@ class DocumentProcessor:
             # Also check uppercase extensions
             pattern_upper = os.path.join(folder_path, f"*{file_type.upper()}")
             all_files.extend(glob.glob(pattern_upper))
+            # Branch subfolders are ordered by the scheduler's folder priority
+            if self.scheduler is not None:
+                all_files.extend(glob.glob(os.path.join(folder_path, "*", f"*{file_type}")))
+                all_files.extend(glob.glob(os.path.join(folder_path, "*", f"*{file_type.upper()}")))
         
         print(f"Found {len(all_files)} documents to process")
+
+        # Order by priority and estimate cost when a budget scheduler is configured
+        self.invoice_processor.scheduler = self.scheduler
+        if self.scheduler is not None:
+            jobs = self.scheduler.plan(f for f in all_files if self.is_supported_file(f))
+        else:
+            jobs = [{"file_path": f} for f in all_files]
         
         processed_count = 0
         failed_count = 0
         
-        for file_path in all_files:
+        for job in jobs:
+            file_path = job["file_path"]
             if self.is_supported_file(file_path):
+                # Stop cleanly once the budget is used up; remaining files stay in place
+                if self.scheduler is not None and not self.scheduler.acquire(job):
+                    continue
+                usage_before = self.invoice_processor.model_router.get_totals()
+
                 # Classify document
                 doc_type = self.classify_document(file_path)
                 print(f"Document type: {doc_type}")
                 
                 # Process document
+                processed_before = len(self.invoice_processor.processed_data)
                 success = self.process_single_document(file_path)
+
+                if self.scheduler is not None:
+                    self.scheduler.record(job, usage_before)
                 
                 if success:
                     processed_count += 1
-                    self.move_processed_file(file_path, success=True)
+                    self.move_processed_file(file_path, success=True,
+                                             invoice_numbers=self.invoice_numbers_since(processed_before))
                 else:
                     failed_count += 1
                     self.move_processed_file(file_path, success=False)
@@ -228,6 +293,10 @@ class DocumentProcessor:
         print(f"Batch processing complete:")
         print(f"  - Processed: {processed_count} documents")
         print(f"  - Failed: {failed_count} documents")
+        if self.scheduler is not None:
+            report = self.scheduler.get_report()
+            print(f"  - Deferred: {report['deferred']} documents (spent ${report['spent']:.4f})")
+        self.invoice_processor.model_router.print_routing_report()
         
         return processed_count, failed_count
     
@@ -243,6 +312,10 @@ class DocumentProcessor:
             'processed_files': len(os.listdir(self.processed_folder)),
             'failed_files': len(os.listdir(self.failed_folder))
         }
+
+        # Archive counts come from its index, not from listing millions of files
+        if self.invoice_processor.archive is not None:
+            stats['archive'] = self.invoice_processor.archive.get_stats()
         return stats
 
 class DocumentWatcher(FileSystemEventHandler):
@@ -265,19 +338,31 @@ class DocumentWatcher(FileSystemEventHandler):
                 
                 # Process the document
                 self.document_processor.invoice_processor.initialize_api()
+                processed_before = len(self.document_processor.invoice_processor.processed_data)
                 success = self.document_processor.process_single_document(file_path)
                 
                 if success:
                     self.document_processor.invoice_processor.export_to_excel()
-                    self.document_processor.move_processed_file(file_path, success=True)
+                    invoice_numbers = self.document_processor.invoice_numbers_since(processed_before)
+                    self.document_processor.move_processed_file(file_path, success=True,
+                                                                invoice_numbers=invoice_numbers)
                     print(f"✓ Auto-processed: {os.path.basename(file_path)}")
                 else:
                     self.document_processor.move_processed_file(file_path, success=False)
                     print(f"✗ Auto-processing failed: {os.path.basename(file_path)}")
 
-def start_document_watcher(watch_folder="./watch", output_file="invoice_data.xlsx"):
+def start_document_watcher(watch_folder="./watch", output_file="invoice_data.xlsx",
+                           dataset_dir=None, partition_by_currency=False, archive_dir=None,
+                           extraction_log_dir=None, client=None, thresholds=None,
+                           archive_compress=True):
     """Start automatic document watching"""
-    processor = DocumentProcessor(watch_folder=watch_folder, output_file=output_file)
+    processor = DocumentProcessor(watch_folder=watch_folder, output_file=output_file,
+                                  client=client, dataset_dir=dataset_dir,
+                                  partition_by_currency=partition_by_currency,
+                                  archive_dir=archive_dir,
+                                  extraction_log_dir=extraction_log_dir,
+                                  thresholds=thresholds,
+                                  archive_compress=archive_compress)
     event_handler = DocumentWatcher(processor)
     observer = Observer()
     observer.schedule(event_handler, watch_folder, recursive=False)
@@ -0,0 +1,212 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+import pandas as pd
+from payment_status import invoice_pages, parse_dates
+from extraction_log import source_document
+from search_index import vendor_key
+
+# Invoice dates this many days apart can still be the same bill
+DATE_WINDOW_DAYS = 3
+
+# Characters OCR commonly confuses in invoice numbers, folded to one form
+CONFUSABLE_CHARACTERS = str.maketrans({"O": "0", "I": "1", "L": "1"})
+
+REVIEW_COLUMNS = [
+    "Detected At", "Match Reason", "Invoice Number", "Source File",
+    "Matches Invoice Number", "Matches Source File", "Vendor Name",
+    "Total Amount", "Currency", "Invoice Date", "Matched Invoice Date",
+    "Days Apart", "Review Status",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    invoice_number TEXT NOT NULL,
+    source_file TEXT NOT NULL,
+    number_key TEXT,
+    amount_key TEXT,
+    day INTEGER,
+    UNIQUE (invoice_number, source_file)
+);
+CREATE TABLE IF NOT EXISTS pairs (
+    invoice_id INTEGER NOT NULL,
+    match_id INTEGER NOT NULL,
+    reason TEXT NOT NULL,
+    PRIMARY KEY (invoice_id, match_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_invoices_number ON invoices(number_key);
+CREATE INDEX IF NOT EXISTS idx_invoices_amount ON invoices(amount_key, day);
+"""
+
+
+def normalize_number_key(values):
+    """Vectorized invoice number key: case, whitespace, punctuation and O/0, I/1 folded"""
+    return (values.fillna("").astype(str).str.upper()
+            .str.replace(r"[\s\-_/.#:]+", "", regex=True)
+            .str.translate(CONFUSABLE_CHARACTERS))
+
+
+def blocking_keys(df):
+    """Compute blocking keys for invoice-level rows.
+
+    number_key groups invoices whose numbers differ only by formatting or
+    OCR confusion; amount_key groups the same vendor, currency and total, and
+    day (days since epoch) lets the lookup enforce the date window.
+    """
+    amounts = pd.to_numeric(df["Total Amount"], errors="coerce")
+    vendors = df["Vendor Name"].fillna("").astype(str).map(vendor_key)
+    currencies = df["Currency"].fillna("").astype(str) if "Currency" in df.columns else ""
+    dates = parse_dates(df["Invoice Date"])
+
+    amount_key = vendors + "|" + currencies + "|" + (amounts * 100).round().astype("Int64").astype(str)
+    usable = vendors.ne("") & amounts.notna()
+    return pd.DataFrame({
+        "invoice_number": df["Invoice Number"].fillna("").astype(str),
+        "source_file": df["Source File"].fillna("").astype(str) if "Source File" in df.columns else "",
+        "number_key": normalize_number_key(df["Invoice Number"]),
+        "amount_key": amount_key.where(usable, None),
+        "day": (dates - pd.Timestamp("1970-01-01")).dt.days.astype("Int64"),
+    }, index=df.index)
+
+
+class DuplicateDetector:
+    """Incremental ledger-wide duplicate invoice detection.
+
+    Every invoice is indexed in SQLite under two blocking keys: a normalized
+    invoice number, and vendor + currency + amount with its invoice date.
+    Each new invoice is only compared with invoices sharing a block (an
+    indexed lookup, with the amount block limited to the date window), so a
+    batch costs O(batch size) lookups instead of comparing all pairs. Pages
+    of the same original document are never paired.
+    """
+
+    def __init__(self, index_file, date_window_days=DATE_WINDOW_DAYS):
+        self.index_file = index_file
+        self.date_window_days = date_window_days
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(index_file, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+
+    def invoice_count(self):
+        """Number of indexed invoices"""
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+
+    def check_batch(self, df):
+        """Index a batch of ledger rows and return newly suspected duplicate pairs.
+
+        df may be one-row-per-line-item sheet data. Invoices already indexed
+        are skipped, and duplicates within the batch are found as well.
+        Returns a list of (invoice_number, source_file, match_number,
+        match_source_file, reason) tuples.
+        """
+        invoices = invoice_pages(df)
+        if len(invoices) == 0:
+            return []
+        keys = blocking_keys(invoices)
+
+        found = []
+        with self.lock:
+            cursor = self.connection.cursor()
+            for row in keys.itertuples(index=False):
+                day = None if pd.isna(row.day) else int(row.day)
+                cursor.execute(
+                    "INSERT OR IGNORE INTO invoices (invoice_number, source_file, number_key, amount_key, day) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (row.invoice_number, row.source_file, row.number_key or None, row.amount_key, day),
+                )
+                if cursor.rowcount == 0:
+                    continue
+                invoice_id = cursor.lastrowid
+
+                candidates = {}
+                matches = {}
+                if row.number_key:
+                    for match_id, match_number, match_source in cursor.execute(
+                        "SELECT id, invoice_number, source_file FROM invoices WHERE number_key = ? AND id != ?",
+                        (row.number_key, invoice_id),
+                    ).fetchall():
+                        candidates[match_id] = "invoice number"
+                        matches[match_id] = (match_number, match_source)
+                if row.amount_key and day is not None:
+                    for match_id, match_number, match_source in cursor.execute(
+                        "SELECT id, invoice_number, source_file FROM invoices "
+                        "WHERE amount_key = ? AND day BETWEEN ? AND ? AND id != ?",
+                        (row.amount_key, day - self.date_window_days, day + self.date_window_days, invoice_id),
+                    ).fetchall():
+                        candidates[match_id] = ("invoice number + vendor/amount/date"
+                                                if match_id in candidates else "vendor/amount/date")
+                        matches[match_id] = (match_number, match_source)
+
+                document = source_document(row.source_file)
+                for match_id, reason in candidates.items():
+                    match_number, match_source = matches[match_id]
+                    # Pages of one PDF repeat its header; they are not duplicates of each other
+                    if document and source_document(match_source) == document:
+                        continue
+                    cursor.execute(
+                        "INSERT OR IGNORE INTO pairs (invoice_id, match_id, reason) VALUES (?, ?, ?)",
+                        (invoice_id, match_id, reason),
+                    )
+                    found.append((row.invoice_number, row.source_file, match_number, match_source, reason))
+            self.connection.commit()
+        return found
+
+    def review_rows(self, pairs, ledger_df):
+        """Build review sheet rows for suspected pairs, with details from the ledger"""
+        invoices = invoice_pages(ledger_df)
+        details = {
+            (str(number), str(source)): row
+            for number, source, row in zip(invoices["Invoice Number"].astype(str),
+                                           invoices["Source File"].fillna("").astype(str),
+                                           invoices.to_dict("records"))
+        }
+        detected_at = datetime.now().isoformat(timespec="seconds")
+
+        rows = []
+        for number, source, match_number, match_source, reason in pairs:
+            invoice = details.get((number, source), {})
+            match = details.get((match_number, match_source), {})
+            invoice_date = parse_dates(pd.Series([invoice.get("Invoice Date")])).iloc[0]
+            match_date = parse_dates(pd.Series([match.get("Invoice Date")])).iloc[0]
+            rows.append({
+                "Detected At": detected_at,
+                "Match Reason": reason,
+                "Invoice Number": number,
+                "Source File": source,
+                "Matches Invoice Number": match_number,
+                "Matches Source File": match_source,
+                "Vendor Name": invoice.get("Vendor Name", ""),
+                "Total Amount": invoice.get("Total Amount"),
+                "Currency": invoice.get("Currency", ""),
+                "Invoice Date": invoice.get("Invoice Date", ""),
+                "Matched Invoice Date": match.get("Invoice Date", ""),
+                "Days Apart": abs((invoice_date - match_date).days)
+                if pd.notna(invoice_date) and pd.notna(match_date) else None,
+                "Review Status": "Open",
+            })
+        return pd.DataFrame(rows, columns=REVIEW_COLUMNS)
+
+    def close(self):
+        """Close the index database"""
+        with self.lock:
+            self.connection.close()
+
+
+def write_review_sheet(review_file, review_df):
+    """Append suspected duplicates to the review workbook, keeping earlier rows and their status.
+    Returns the number of rows in the sheet."""
+    if os.path.exists(review_file):
+        existing = pd.read_excel(review_file, sheet_name="Suspected Duplicates")
+        review_df = pd.concat([existing, review_df], ignore_index=True)
+        # Pairs flagged again (e.g. after a rebuild) keep their first row and review status
+        pair_columns = ["Invoice Number", "Source File", "Matches Invoice Number", "Matches Source File"]
+        review_df = review_df.drop_duplicates(
+            subset=pair_columns, keep="first", ignore_index=True
+        ) if len(review_df) else review_df
+    with pd.ExcelWriter(review_file) as writer:
+        review_df.to_excel(writer, sheet_name="Suspected Duplicates", index=False)
+    return len(review_df)
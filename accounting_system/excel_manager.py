@@ -1,6 +1,15 @@
 import os
 import pandas as pd
 from datetime import datetime
+from parquet_dataset import ParquetInvoiceDataset, date_range_bounds
+from search_index import InvoiceSearchIndex
+from duplicate_detector import DuplicateDetector, write_review_sheet
+from currency import DEFAULT_REPORTING_CURRENCY, load_fx_rates, normalize_currency
+from payment_status import (
+    DEFAULT_BANK_COLUMNS, DEFAULT_PAYMENT_STATUS, PAYMENT_STATUSES, DueDateIndex, aging_summary,
+    compute_aging, ensure_payment_columns, invoice_level, invoice_pages, match_bank_payments,
+    parse_dates,
+)
 
 # Ensure UTF-8 encoding for Chinese characters
 import sys
@@ -14,8 +23,28 @@ if sys.version_info[0] >= 3:
 class ExcelManager:
     """Handles Excel file operations for invoice data"""
     
-    def __init__(self, output_file="invoice_data.xlsx"):
+    def __init__(self, output_file="invoice_data.xlsx", dataset_dir=None, partition_by_currency=False,
+                 fx_rates_file=None, reporting_currency=DEFAULT_REPORTING_CURRENCY):
         self.output_file = output_file
+        self.due_index_file = os.path.splitext(output_file)[0] + "_due_index.json"
+        self.search_index_file = os.path.splitext(output_file)[0] + "_search.sqlite"
+        self.search_index = None
+        self.duplicate_index_file = os.path.splitext(output_file)[0] + "_duplicates.sqlite"
+        self.duplicate_review_file = os.path.splitext(output_file)[0] + "_duplicate_review.xlsx"
+        self.duplicate_detector = None
+
+        # Optional Parquet dataset written alongside the Excel file
+        self.dataset = None
+        if dataset_dir:
+            self.dataset = ParquetInvoiceDataset(dataset_dir, partition_by_currency)
+
+        # FX rates for reporting-currency totals, loaded on first use
+        self.fx_rates_file = fx_rates_file or os.path.join(os.path.dirname(output_file), "fx_rates.csv")
+        self.reporting_currency = normalize_currency(reporting_currency)
+        self.fx_rates = None
+        self.fx_rates_mtime = None
+        # Converted ledger columns keyed by (rate table version, currency, ledger file state)
+        self.fx_cache = {}
         
     def flatten_invoice_data(self, invoice_data_list):
         """Flatten invoice data for Excel export"""
@@ -36,8 +65,10 @@ class ExcelManager:
                 "Due Date": invoice.get("due_date", ""),
                 "Tax Amount": invoice.get("tax_amount", 0),
                 "Total Amount": invoice.get("total_amount", 0),
-                "Currency": invoice.get("currency", "USD"),
+                "Currency": normalize_currency(invoice.get("currency")),
                 "Category": invoice.get("category", ""),
+                "Payment Status": invoice.get("payment_status") or DEFAULT_PAYMENT_STATUS,
+                "Payment Date": invoice.get("payment_date", ""),
                 "Processing Date": invoice.get("processing_date", ""),
                 "Source File": invoice.get("source_file", ""),
             }
@@ -84,7 +115,10 @@ class ExcelManager:
                 if len(new_df_filtered) > 0:
                     # Append new data to existing data
                     combined_df = pd.concat([existing_df, new_df_filtered], ignore_index=True)
-                    combined_df.to_excel(self.output_file, index=False)
+                    self.write_ledger(combined_df)
+                    self.add_written_invoices(self.written_invoices(invoice_data_list, new_df_filtered))
+                    self.index_pending_invoices(new_df_filtered)
+                    self.flag_duplicates(new_df_filtered, combined_df, existing_df)
                     print(f"✓ Added {len(new_df_filtered)} new invoices to existing file: {self.output_file}")
                     return True
                 else:
@@ -93,15 +127,100 @@ class ExcelManager:
                     
             except Exception as e:
                 print(f"Error reading existing file, creating new one: {e}")
-                new_df.to_excel(self.output_file, index=False)
+                self.write_ledger(new_df)
+                self.add_written_invoices(invoice_data_list)
+                self.reset_due_index()
+                self.reset_duplicate_index()
+                self.flag_duplicates(new_df, new_df)
                 print(f"✓ Data exported to new file: {self.output_file}")
                 return True
         else:
             # Create new file or overwrite existing
-            new_df.to_excel(self.output_file, index=False)
+            self.write_ledger(new_df)
+            self.add_written_invoices(invoice_data_list)
+            self.reset_due_index()
+            self.reset_duplicate_index()
+            self.flag_duplicates(new_df, new_df)
             print(f"✓ Data exported to file: {self.output_file}")
             return True
     
+    def write_ledger(self, df):
+        """Write the ledger workbook, keeping the Parquet payment table in step"""
+        df.to_excel(self.output_file, index=False)
+        if self.dataset is not None:
+            try:
+                self.dataset.write_payments(ensure_payment_columns(df.copy()))
+            except Exception as e:
+                print(f"Warning: Could not update Parquet payment table: {e}")
+
+    def written_invoices(self, invoice_data_list, written_df):
+        """Invoices whose rows made it into the ledger"""
+        written_keys = set(zip(written_df["Invoice Number"].astype(str), written_df["Source File"].astype(str)))
+        return [
+            invoice for invoice in invoice_data_list
+            if (str(invoice.get("invoice_number", "")), str(invoice.get("source_file", ""))) in written_keys
+        ]
+
+    def add_written_invoices(self, invoice_data_list):
+        """Add invoices just written to the ledger to the Parquet dataset and search index"""
+        if self.dataset is not None:
+            self.export_to_parquet(invoice_data_list)
+
+        # Index is idempotent per (invoice number, source file), so re-exports are cheap
+        try:
+            self.get_search_index().add_invoices(invoice_data_list)
+        except Exception as e:
+            print(f"Warning: Could not update search index: {e}")
+
+    def rebuild_from_invoices(self, invoice_data_list):
+        """Replace the ledger, Parquet dataset and search index with freshly projected invoices.
+
+        Payment status and date are not part of the extraction history, so they
+        are carried over from the current ledger by invoice number.
+        """
+        if os.path.exists(self.output_file):
+            try:
+                previous = invoice_level(ensure_payment_columns(pd.read_excel(self.output_file)))
+                payments = {
+                    str(number): (status, date)
+                    for number, status, date in zip(previous["Invoice Number"],
+                                                    previous["Payment Status"],
+                                                    previous["Payment Date"].fillna(""))
+                }
+                for invoice in invoice_data_list:
+                    payment = payments.get(str(invoice.get("invoice_number", "")))
+                    if payment:
+                        invoice["payment_status"], invoice["payment_date"] = payment
+            except Exception as e:
+                print(f"Warning: Could not carry over payment status: {e}")
+
+        if self.dataset is not None:
+            self.dataset.clear()
+        if self.search_index is not None:
+            self.search_index.connection.close()
+            self.search_index = None
+        if os.path.exists(self.search_index_file):
+            os.remove(self.search_index_file)
+
+        return self.export_to_excel(invoice_data_list, append_mode=False)
+
+    def export_to_parquet(self, invoice_data_list):
+        """Append invoices to the partitioned Parquet dataset"""
+        if self.dataset is None:
+            print("No Parquet dataset configured")
+            return False
+
+        try:
+            written = self.dataset.append(invoice_data_list)
+            if written > 0:
+                print(f"✓ Added {written} new invoices to Parquet dataset: {self.dataset.dataset_dir}")
+                return True
+            print("No new invoices to add to Parquet dataset")
+            return False
+        except Exception as e:
+            print(f"Error writing Parquet dataset: {e}")
+            return False
+
     def read_excel_data(self):
         """Read existing Excel data"""
         if os.path.exists(self.output_file):
@@ -116,58 +235,381 @@ class ExcelManager:
             return None
     
     
-    def get_invoice_summary(self):
-        """Get summary of invoices in the Excel file"""
+    def get_fx_rates(self):
+        """Load the FX rate table, reloading it when the file changes"""
+        if not os.path.exists(self.fx_rates_file):
+            self.fx_rates = None
+            return None
+        mtime = os.path.getmtime(self.fx_rates_file)
+        if self.fx_rates is None or mtime != self.fx_rates_mtime:
+            self.fx_rates = load_fx_rates(self.fx_rates_file)
+            self.fx_rates_mtime = mtime
+        return self.fx_rates
+
+    def ledger_signature(self):
+        """File state identifying the current ledger contents"""
+        stat = os.stat(self.output_file)
+        return stat.st_mtime_ns, stat.st_size
+
+    def add_reporting_columns(self, df, reporting_currency=None, from_ledger=False):
+        """Add reporting-currency amounts next to the original ones.
+
+        With from_ledger=True, df must be (a row subset of) the ledger as read
+        from the output file; its converted columns are then served from a
+        cache kept per rate table version instead of being recomputed.
+        Returns df unchanged when no FX rate file is available.
+        """
+        fx_rates = self.get_fx_rates()
+        if fx_rates is None or df is None or len(df) == 0:
+            return df
+        reporting_currency = normalize_currency(reporting_currency or self.reporting_currency)
+
+        if not from_ledger:
+            return df.join(fx_rates.convert_frame(df, reporting_currency))
+
+        key = (fx_rates.version, reporting_currency, self.ledger_signature())
+        converted = self.fx_cache.get(key)
+        if converted is None:
+            converted = fx_rates.convert_frame(self.read_excel_data(), reporting_currency)
+            # Only the latest ledger state is worth keeping
+            self.fx_cache = {key: converted}
+        return df.join(converted.loc[df.index])
+
+    def get_invoice_summary(self, reporting_currency=None):
+        """Get summary of invoices in the Excel file.
+
+        Totals are reported per original currency; total_amount is in the
+        reporting currency when an FX rate file is available (otherwise only
+        when all invoices share one currency).
+        """
         df = self.read_excel_data()
         if df is None:
             return None
+
+        # The sheet has one row per line item; count and total each invoice once
+        invoices = invoice_level(ensure_payment_columns(df))
+        invoices = self.add_reporting_columns(invoices, reporting_currency, from_ledger=True)
+        amounts = pd.to_numeric(invoices["Total Amount"], errors="coerce").fillna(0)
+        currencies = invoices["Currency"].fillna("").astype(str)
+
+        reporting_currency = normalize_currency(reporting_currency or self.reporting_currency)
+        reporting_column = f"Total Amount ({reporting_currency})"
+        if reporting_column in invoices.columns:
+            converted = invoices[reporting_column]
+            total_amount = converted.sum()
+            unconverted = int(converted.isna().sum())
+        else:
+            total_amount = amounts.sum() if currencies.nunique() <= 1 else None
+            reporting_currency = currencies.iloc[0] if total_amount is not None and len(currencies) else None
+            unconverted = 0 if total_amount is not None else len(invoices)
             
         summary = {
-            "total_invoices": len(df),
-            "total_amount": df["Total Amount"].sum(),
-            "pending_payments": len(df[df["Payment Status"] == "Pending"]),
-            "paid_invoices": len(df[df["Payment Status"] == "Paid"]),
-            "overdue_invoices": len(df[df["Payment Status"] == "Overdue"]),
-            "currencies": df["Currency"].value_counts().to_dict(),
-            "vendors": df["Vendor Name"].value_counts().to_dict()
+            "total_invoices": len(invoices),
+            "total_amount": total_amount,
+            "reporting_currency": reporting_currency,
+            "unconverted_invoices": unconverted,
+            "total_amount_by_currency": amounts.groupby(currencies).sum().to_dict(),
+            "pending_payments": len(invoices[invoices["Payment Status"] == "Pending"]),
+            "paid_invoices": len(invoices[invoices["Payment Status"] == "Paid"]),
+            "overdue_invoices": len(invoices[invoices["Payment Status"] == "Overdue"]),
+            "currencies": invoices["Currency"].value_counts().to_dict(),
+            "vendors": invoices["Vendor Name"].value_counts().to_dict()
         }
         
         return summary
     
+    def uses_dataset(self, filter_criteria):
+        """Whether a filter can be answered from the Parquet dataset"""
+        return self.dataset is not None and self.dataset.exists()
+
     def filter_invoices(self, filter_criteria):
         """Filter invoices based on criteria"""
+        if self.uses_dataset(filter_criteria):
+            return self.filter_parquet_invoices(filter_criteria)
+
         df = self.read_excel_data()
         if df is None:
             return None
             
-        filtered_df = df.copy()
+        filtered_df = ensure_payment_columns(df.copy())
         
         # Apply filters
         if "vendor_name" in filter_criteria:
-            filtered_df = filtered_df[filtered_df["Vendor Name"].str.contains(filter_criteria["vendor_name"], case=False, na=False)]
+            matches = self.find_vendor_invoices(filter_criteria["vendor_name"], df)
+            filtered_df = filtered_df[filtered_df["Invoice Number"].astype(str).isin(matches)]
         
         if "payment_status" in filter_criteria:
             filtered_df = filtered_df[filtered_df["Payment Status"] == filter_criteria["payment_status"]]
         
         if "date_range" in filter_criteria:
-            start_date, end_date = filter_criteria["date_range"]
-            filtered_df = filtered_df[(filtered_df["Invoice Date"] >= start_date) & (filtered_df["Invoice Date"] <= end_date)]
+            # Same bounds as the Parquet scan, so both paths agree on formats and the end day
+            start_date, end_date = date_range_bounds(filter_criteria["date_range"])
+            invoice_dates = parse_dates(filtered_df["Invoice Date"])
+            filtered_df = filtered_df[(invoice_dates >= start_date) & (invoice_dates <= end_date)]
         
         if "currency" in filter_criteria:
-            filtered_df = filtered_df[filtered_df["Currency"] == filter_criteria["currency"]]
+            filtered_df = filtered_df[filtered_df["Currency"] == normalize_currency(filter_criteria["currency"])]
         
         return filtered_df
     
-    def export_filtered_data(self, filter_criteria, output_file=None):
-        """Export filtered data to a new Excel file"""
+    def get_search_index(self):
+        """Open the vendor / line item search index on first use"""
+        if self.search_index is None:
+            self.search_index = InvoiceSearchIndex(self.search_index_file)
+        return self.search_index
+
+    def find_vendor_invoices(self, vendor_name, df=None, min_match=0.75):
+        """Invoice numbers whose vendor matches vendor_name, tolerant of variant
+        characters, full/half width and company suffixes"""
+        index = self.get_search_index()
+
+        # Backfill ledgers written before the index existed (or edited by hand)
+        if df is not None and index.document_count() < len(invoice_pages(df)):
+            index.add_dataframe(df)
+
+        hits = index.search(vendor_name, fields=["vendor"], limit=None, min_match=min_match)
+        return {hit["invoice_number"] for hit in hits}
+
+    def search_invoices(self, query, limit=20):
+        """Ranked search over vendor names, addresses and line item descriptions"""
+        return self.get_search_index().search(query, limit=limit)
+
+    def canonicalize_vendor(self, vendor_name):
+        """Canonical spelling of a known vendor, or None"""
+        return self.get_search_index().canonicalize_vendor(vendor_name)
+
+    def get_duplicate_detector(self):
+        """Open the duplicate detection index on first use"""
+        if self.duplicate_detector is None:
+            self.duplicate_detector = DuplicateDetector(self.duplicate_index_file)
+        return self.duplicate_detector
+
+    def flag_duplicates(self, new_df, ledger_df, existing_df=None):
+        """Check newly written rows against the whole ledger and add suspected
+        duplicates to the review workbook. Returns the pairs found."""
+        try:
+            detector = self.get_duplicate_detector()
+            pairs = []
+            # Backfill ledgers written before the detector existed
+            if existing_df is not None and detector.invoice_count() < len(invoice_pages(existing_df)):
+                pairs.extend(detector.check_batch(existing_df))
+            pairs.extend(detector.check_batch(new_df))
+
+            if pairs:
+                write_review_sheet(self.duplicate_review_file, detector.review_rows(pairs, ledger_df))
+                print(f"⚠️  {len(pairs)} suspected duplicate invoices flagged for review: "
+                      f"{self.duplicate_review_file}")
+            return pairs
+        except Exception as e:
+            print(f"Warning: Could not check for duplicate invoices: {e}")
+            return []
+
+    def reset_duplicate_index(self):
+        """Drop the duplicate index so it is rebuilt from a freshly written ledger"""
+        if self.duplicate_detector is not None:
+            self.duplicate_detector.close()
+            self.duplicate_detector = None
+        if os.path.exists(self.duplicate_index_file):
+            os.remove(self.duplicate_index_file)
+
+    def filter_parquet_invoices(self, filter_criteria):
+        """Filter invoices from the Parquet dataset, pushing predicates down to the scan.
+
+        Vendor names are resolved through the search index, like the workbook
+        path, and pushed down as an invoice number filter.
+        """
+        if "vendor_name" in filter_criteria:
+            filter_criteria = dict(filter_criteria)
+            filter_criteria["invoice_numbers"] = self.find_vendor_invoices(filter_criteria.pop("vendor_name"))
+        # Datasets written before payment tracking have no payment table yet
+        if not os.path.exists(self.dataset.payments_file):
+            ledger_df = self.read_excel_data()
+            if ledger_df is not None:
+                self.dataset.write_payments(ensure_payment_columns(ledger_df))
+        try:
+            filtered_df = self.dataset.query_flat(filter_criteria)
+        except Exception as e:
+            print(f"Error querying Parquet dataset: {e}")
+            return None
+
+        # Payment status lives in the small payments table, so it is filtered after the scan
+        if "payment_status" in filter_criteria:
+            filtered_df = filtered_df[filtered_df["Payment Status"] == filter_criteria["payment_status"]]
+
+        return filtered_df
+
+    def export_filtered_data(self, filter_criteria, output_file=None, reporting_currency=None):
+        """Export filtered data to a new Excel file, with reporting-currency
+        amounts alongside the original ones when FX rates are available"""
         filtered_df = self.filter_invoices(filter_criteria)
         if filtered_df is None or len(filtered_df) == 0:
             print("No data matches the filter criteria")
             return False
+
+        from_ledger = not self.uses_dataset(filter_criteria)
+        filtered_df = self.add_reporting_columns(filtered_df, reporting_currency, from_ledger)
         
         if output_file is None:
             output_file = f"filtered_invoices_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
         
         filtered_df.to_excel(output_file, index=False)
         print(f"✓ Filtered data exported to: {output_file}")
-        return True
\ No newline at end of file
+        return True
+
+    def apply_status_updates(self, df, statuses, payment_dates=None):
+        """Set payment status (and optionally payment date) on every row of the given invoices.
+
+        statuses and payment_dates map invoice number -> value. Returns the
+        number of invoices updated.
+        """
+        df = ensure_payment_columns(df)
+        keys = df["Invoice Number"].astype(str)
+        mask = keys.isin(statuses.keys())
+        if not mask.any():
+            return 0
+
+        df.loc[mask, "Payment Status"] = keys[mask].map(statuses)
+        if payment_dates:
+            date_mask = keys.isin(payment_dates.keys())
+            df["Payment Date"] = df["Payment Date"].astype(object)
+            df.loc[date_mask, "Payment Date"] = keys[date_mask].map(payment_dates)
+        self.write_ledger(df)
+
+        # Keep the due-date index in step: only pending invoices are indexed
+        due_index = DueDateIndex(self.due_index_file)
+        if due_index.loaded:
+            due_index.remove(statuses.keys())
+            reopened = invoice_level(df[mask & (df["Payment Status"] == "Pending")])
+            for number, due_date in zip(reopened["Invoice Number"], reopened["Due Date"]):
+                due_index.add(number, due_date)
+            due_index.save()
+
+        return int(keys[mask].nunique())
+
+    def update_payment_status(self, invoice_number, status, payment_date=None):
+        """Update payment status of a single invoice"""
+        return self.update_payment_statuses([(invoice_number, status, payment_date)]) > 0
+
+    def update_payment_statuses(self, updates):
+        """Bulk update payment statuses from (invoice_number, status, payment_date) tuples"""
+        df = self.read_excel_data()
+        if df is None:
+            return 0
+
+        statuses = {}
+        payment_dates = {}
+        for invoice_number, status, payment_date in updates:
+            if status not in PAYMENT_STATUSES:
+                print(f"Invalid payment status for {invoice_number}: {status}")
+                continue
+            statuses[str(invoice_number)] = status
+            if payment_date:
+                payment_dates[str(invoice_number)] = payment_date
+
+        updated = self.apply_status_updates(df, statuses, payment_dates)
+        print(f"✓ Updated payment status for {updated} invoices")
+        return updated
+
+    def mark_paid_from_bank_csv(self, csv_path, columns=None):
+        """Mark invoices as paid from a bank statement CSV.
+
+        Rows are matched on normalized invoice number (the bank reference
+        column) and, when present, the paid amount.
+        """
+        df = self.read_excel_data()
+        if df is None:
+            return None
+
+        try:
+            bank_df = pd.read_csv(csv_path, dtype=str, encoding="utf-8-sig")
+        except Exception as e:
+            print(f"Error reading bank statement {csv_path}: {e}")
+            return None
+
+        # Amount and date columns are optional; without a reference nothing can be matched
+        reference_column = {**DEFAULT_BANK_COLUMNS, **(columns or {})}["reference"]
+        if reference_column not in bank_df.columns:
+            print(f"Error: bank statement {os.path.basename(csv_path)} has no '{reference_column}' column "
+                  f"(found: {', '.join(map(str, bank_df.columns))})")
+            return None
+
+        matches, unmatched = match_bank_payments(df, bank_df, columns)
+
+        statuses = {str(number): "Paid" for number in matches["Invoice Number"]}
+        payment_dates = dict(zip(matches["Invoice Number"].astype(str), matches["Payment Date"]))
+        updated = self.apply_status_updates(df, statuses, payment_dates) if statuses else 0
+
+        print(f"✓ Marked {updated} invoices as paid from {os.path.basename(csv_path)}")
+        if len(unmatched) > 0:
+            print(f"⚠️  {len(unmatched)} bank rows did not match an unpaid invoice")
+        return {"matched": updated, "unmatched": unmatched}
+
+    def index_pending_invoices(self, new_df):
+        """Add newly exported pending invoices to the due-date index"""
+        due_index = DueDateIndex(self.due_index_file)
+        if not due_index.loaded:
+            # Built from the whole ledger on the first overdue refresh
+            return
+        pending = invoice_level(ensure_payment_columns(new_df.copy()))
+        pending = pending[pending["Payment Status"] == "Pending"]
+        for number, due_date in zip(pending["Invoice Number"], pending["Due Date"]):
+            due_index.add(number, due_date)
+        due_index.save()
+
+    def reset_due_index(self):
+        """Drop the due-date index so it is rebuilt from a freshly written ledger"""
+        if os.path.exists(self.due_index_file):
+            os.remove(self.due_index_file)
+
+    def refresh_overdue_status(self, as_of=None):
+        """Mark pending invoices past their due date as overdue.
+
+        Uses the persistent due-date index so only invoices that fell due
+        since the last run are touched; the ledger is only rewritten when
+        something changed. Returns the number of invoices marked overdue.
+        """
+        as_of = pd.Timestamp(as_of or pd.Timestamp.now()).normalize()
+        due_index = DueDateIndex(self.due_index_file)
+
+        df = None
+        if not due_index.loaded:
+            df = self.read_excel_data()
+            if df is None:
+                return 0
+            due_index.rebuild(df)
+
+        due_now = due_index.pop_due_before(as_of)
+        updated = 0
+        if due_now:
+            if df is None:
+                df = self.read_excel_data()
+            if df is not None:
+                df = ensure_payment_columns(df)
+                keys = df["Invoice Number"].astype(str)
+                mask = keys.isin(due_now) & (df["Payment Status"] == "Pending")
+                if mask.any():
+                    df.loc[mask, "Payment Status"] = "Overdue"
+                    self.write_ledger(df)
+                    updated = int(keys[mask].nunique())
+
+        due_index.last_run = as_of.strftime("%Y-%m-%d")
+        due_index.save()
+        print(f"✓ Marked {updated} invoices as overdue (as of {due_index.last_run})")
+        return updated
+
+    def get_aging_report(self, as_of=None, reporting_currency=None):
+        """Get payables aging (Current/1-30/31-60/61-90/90+) per currency, with
+        reporting-currency totals when FX rates are available"""
+        df = self.read_excel_data()
+        if df is None:
+            return None
+        reporting_currency = normalize_currency(reporting_currency or self.reporting_currency)
+        df = self.add_reporting_columns(df, reporting_currency, from_ledger=True)
+        return aging_summary(df, as_of, f"Total Amount ({reporting_currency})")
+
+    def get_aged_invoices(self, as_of=None):
+        """Get unpaid invoices with days overdue and aging bucket"""
+        df = self.read_excel_data()
+        if df is None:
+            return None
+        return compute_aging(df, as_of)
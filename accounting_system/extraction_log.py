@@ -0,0 +1,207 @@
+import os
+import re
+import glob
+import gzip
+import json
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from chunked_extraction import merge_chunks
+
+# Records per segment before it is sealed and gzipped
+SEGMENT_MAX_RECORDS = 5000
+SEGMENT_PATTERN = "segment-*.jsonl*"
+
+# PDF pages are extracted as "<file>_page_<n>" (see DocumentProcessor)
+PAGE_SUFFIX = re.compile(r"_page_\d+$")
+
+
+def prompt_hash(prompt, tools):
+    """Stable hash of the prompt and tool schema used for an extraction"""
+    payload = json.dumps({"prompt": prompt, "tools": tools}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def source_document(source_file):
+    """Original document a source file came from, with any page suffix removed"""
+    return PAGE_SUFFIX.sub("", str(source_file or ""))
+
+
+def usage_to_dict(usage):
+    """Serializable token usage"""
+    if usage is None:
+        return None
+    return {
+        "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+        "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+    }
+
+
+class ExtractionLog:
+    """Append-only archive of raw extraction responses.
+
+    Records go to an open plain-JSONL segment; once it holds
+    SEGMENT_MAX_RECORDS records it is gzipped and a new segment is started.
+    Sealed segments are immutable, so a rebuild can read them in parallel.
+    """
+
+    def __init__(self, log_dir, segment_max_records=SEGMENT_MAX_RECORDS):
+        self.log_dir = log_dir
+        self.segment_max_records = segment_max_records
+        self.lock = threading.Lock()
+        os.makedirs(log_dir, exist_ok=True)
+
+        self.current_segment = None
+        self.current_records = 0
+        open_segments = sorted(glob.glob(os.path.join(log_dir, "segment-*.jsonl")))
+        if open_segments:
+            self.current_segment = open_segments[-1]
+            with open(self.current_segment, 'r', encoding='utf-8') as f:
+                self.current_records = sum(1 for _ in f)
+
+    def next_segment_path(self):
+        """Path for the next segment number"""
+        numbers = [
+            int(os.path.basename(path).split("-")[1].split(".")[0])
+            for path in glob.glob(os.path.join(self.log_dir, SEGMENT_PATTERN))
+        ]
+        return os.path.join(self.log_dir, f"segment-{max(numbers, default=0) + 1:06d}.jsonl")
+
+    def seal_current_segment(self):
+        """Gzip the open segment so it becomes immutable"""
+        if self.current_segment is None:
+            return
+        with open(self.current_segment, 'rb') as src, gzip.open(self.current_segment + ".gz", 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(self.current_segment)
+        self.current_segment = None
+        self.current_records = 0
+
+    def append(self, record):
+        """Append one extraction record"""
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self.lock:
+            if self.current_segment is None:
+                self.current_segment = self.next_segment_path()
+            with open(self.current_segment, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.current_records += 1
+            if self.current_records >= self.segment_max_records:
+                self.seal_current_segment()
+
+    def segments(self):
+        """All segment files in write order"""
+        return sorted(glob.glob(os.path.join(self.log_dir, SEGMENT_PATTERN)))
+
+
+def read_segment(path):
+    """Read every record from one segment"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def project_v1(record):
+    """Projection v1: accepted tool_use invoice_data plus extraction metadata"""
+    result_tier = record.get("result_tier")
+    if not result_tier:
+        return None
+
+    attempts = [a for a in record.get("attempts", [])
+                if a.get("tier") == result_tier and a.get("pass", "full") == "full" and a.get("tool_input")]
+    if not attempts:
+        return None
+
+    invoice_data = dict(attempts[-1]["tool_input"].get("invoice_data") or {})
+    invoice_data.update(record.get("metadata") or {})
+    invoice_data["model_tier"] = result_tier
+    return invoice_data
+
+
+def project_v2(record):
+    """Projection v2: like v1, but truncated extractions are merged from their
+    header and line item passes (see chunked_extraction.py)"""
+    result_tier = record.get("result_tier")
+    if not result_tier:
+        return None
+
+    tier_attempts = [a for a in record.get("attempts", []) if a.get("tier") == result_tier]
+    full_indexes = [i for i, a in enumerate(tier_attempts) if a.get("pass", "full") == "full"]
+    if not full_indexes:
+        return None
+    last_full = tier_attempts[full_indexes[-1]]
+    if last_full.get("stop_reason") != "max_tokens":
+        return project_v1(record)
+
+    header = None
+    chunks = []
+    for attempt in tier_attempts[full_indexes[-1] + 1:]:
+        if attempt.get("stop_reason") == "max_tokens" or not attempt.get("tool_input"):
+            continue
+        data = attempt["tool_input"].get("invoice_data") or {}
+        if attempt.get("pass") == "header":
+            header = data
+        elif attempt.get("pass") == "line_items":
+            start, end = attempt["range"]
+            chunks.append((start, list(data.get("line_items") or [])[:end - start + 1]))
+    if header is None:
+        return None
+
+    invoice_data = merge_chunks(header, [items for _, items in sorted(chunks, key=lambda c: c[0])])
+    invoice_data.update(record.get("metadata") or {})
+    invoice_data["model_tier"] = result_tier
+    return invoice_data
+
+
+# Versioned projections from raw extraction records to invoice dicts. Add a new
+# version instead of editing an old one so earlier outputs stay reproducible.
+PROJECTIONS = {
+    1: project_v1,
+    2: project_v2,
+}
+CURRENT_PROJECTION_VERSION = max(PROJECTIONS)
+
+
+def project_segment(args):
+    """Read and project one segment (runs in a worker process)"""
+    path, version = args
+    projection = PROJECTIONS[version]
+    invoices = []
+    for record in read_segment(path):
+        invoice_data = projection(record)
+        if invoice_data:
+            invoices.append(invoice_data)
+    return invoices
+
+
+def reproject_history(log_dir, projection_version=CURRENT_PROJECTION_VERSION, max_workers=None):
+    """Reproject every logged extraction into invoice dicts without API calls.
+
+    Segments are decoded and projected in parallel worker processes; results
+    keep log order. Duplicates are skipped the way incremental exports skip
+    them: an invoice number belongs to the first document that produced it,
+    so every page of that document keeps its row, while the same number from
+    another document, or a page extracted again, is dropped.
+    """
+    if projection_version not in PROJECTIONS:
+        raise ValueError(f"Unknown projection version: {projection_version}")
+
+    segments = ExtractionLog(log_dir).segments()
+    print(f"🔁 Reprojecting {len(segments)} segments with projection v{projection_version}")
+
+    invoices = []
+    owners = {}
+    seen = set()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        jobs = [(path, projection_version) for path in segments]
+        for segment_invoices in executor.map(project_segment, jobs):
+            for invoice_data in segment_invoices:
+                number = str(invoice_data.get("invoice_number", "") or "")
+                source = str(invoice_data.get("source_file", "") or "")
+                document = source_document(source)
+                if owners.setdefault(number, document) != document or (number, source) in seen:
+                    continue
+                seen.add((number, source))
+                invoices.append(invoice_data)
+    return invoices
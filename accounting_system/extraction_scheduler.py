@@ -0,0 +1,224 @@
+import os
+import re
+import time
+from collections import deque
+from datetime import date, datetime
+from PIL import Image
+import fitz  # PyMuPDF for PDF page sizes
+from chunked_extraction import HEADER_MAX_TOKENS
+
+# Images are downscaled by the API so the long edge is at most this many pixels
+MAX_IMAGE_EDGE = 1568
+# Roughly one input token per 750 pixels after downscaling
+PIXELS_PER_TOKEN = 750
+# Prompt text plus tool schema sent with every request
+PROMPT_OVERHEAD_TOKENS = 700
+# Typical tool_use output for a single invoice
+EXPECTED_OUTPUT_TOKENS = 600
+# Line item passes reserved for a dense document that has to be extracted in chunks
+RESERVE_LINE_ITEM_PASSES = 3
+# PDF pages are rendered at 2x zoom before extraction (see convert_pdf_to_images)
+PDF_RENDER_ZOOM = 2.0
+
+DUE_DATE_HINT = re.compile(r"(20\d{2})[-_.]?(0[1-9]|1[0-2])[-_.]?(0[1-9]|[12]\d|3[01])")
+
+
+def image_tokens(width, height):
+    """Estimate input tokens for one image of the given size"""
+    scale = min(1.0, MAX_IMAGE_EDGE / max(width, height, 1))
+    return int(width * scale * height * scale / PIXELS_PER_TOKEN) + 1
+
+
+def tier_cost(tier, input_tokens, output_tokens):
+    """USD cost of the given token counts on a model tier"""
+    return (input_tokens * tier["input_cost_per_mtok"]
+            + output_tokens * tier["output_cost_per_mtok"]) / 1_000_000
+
+
+class ExtractionScheduler:
+    """Orders extraction work by priority and enforces token, request and spend budgets.
+
+    Priority is (folder priority, due date hint from the file name, file age).
+    If a document's worst-case cost (escalation to the last tier, plus
+    chunked extraction for dense or oversized documents) could take the run
+    past its spend cap, the scheduler refuses it so the rest stay queued in
+    place for the next run. Every API call, including escalations and chunk
+    passes, first waits in pace() for room under the per-minute token and
+    request limits.
+    """
+
+    def __init__(self, model_router, tokens_per_minute=None, requests_per_minute=None,
+                 spend_cap=None, folder_priorities=None, clock=time.monotonic, sleep=time.sleep):
+        self.model_router = model_router
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.spend_cap = spend_cap
+        self.folder_priorities = folder_priorities or {}
+        self.clock = clock
+        self.sleep = sleep
+
+        # (timestamp, tokens, requests) sent within the last minute
+        self.window = deque()
+        # Job being extracted and the tokens and requests paced for it so far
+        self.current_job = None
+        self.paced_tokens = 0
+        self.paced_requests = 0
+        self.spent = 0.0
+        self.dispatched = 0
+        self.deferred = 0
+        self.paused = False
+
+    def page_sizes(self, file_path):
+        """Pixel sizes of each page the extractor will send"""
+        if file_path.lower().endswith(".pdf"):
+            with fitz.open(file_path) as doc:
+                return [(page.rect.width * PDF_RENDER_ZOOM, page.rect.height * PDF_RENDER_ZOOM)
+                        for page in doc]
+        with Image.open(file_path) as img:
+            return [img.size]
+
+    def due_date_hint(self, file_path):
+        """Due date embedded in the file name (e.g. 2025-01-31 or 20250131), if any"""
+        match = DUE_DATE_HINT.search(os.path.basename(file_path))
+        if match:
+            try:
+                return date(*(int(part) for part in match.groups()))
+            except ValueError:
+                pass
+        return date.max
+
+    def folder_priority(self, file_path):
+        """Priority of the file's folder (branch); lower runs first, unlisted folders last"""
+        folder = os.path.basename(os.path.dirname(os.path.abspath(file_path)))
+        return self.folder_priorities.get(folder, len(self.folder_priorities))
+
+    def estimate(self, file_path):
+        """Estimate tokens, requests and cost for one document"""
+        try:
+            sizes = self.page_sizes(file_path)
+        except Exception as e:
+            print(f"Could not read {os.path.basename(file_path)} for estimation: {e}")
+            sizes = [(MAX_IMAGE_EDGE, MAX_IMAGE_EDGE)]
+
+        pages = len(sizes)
+        input_tokens = sum(image_tokens(w, h) + PROMPT_OVERHEAD_TOKENS for w, h in sizes)
+        output_tokens = EXPECTED_OUTPUT_TOKENS * pages
+
+        start_index = self.model_router.initial_tier_index(file_path, pages)
+        cost = tier_cost(self.model_router.model_tiers[start_index], input_tokens, output_tokens)
+
+        return {
+            "file_path": file_path,
+            "pages": pages,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "requests": pages,
+            "cost": cost,
+            "reserve": self.worst_case_cost(input_tokens, pages, start_index),
+            "priority": (
+                self.folder_priority(file_path),
+                self.due_date_hint(file_path),
+                os.path.getmtime(file_path),
+            ),
+        }
+
+    def worst_case_cost(self, input_tokens, pages, start_index):
+        """Cost if every page escalates to the last tier; documents routed straight
+        to the last tier (dense or oversized) are also assumed to need chunking"""
+        tiers = self.model_router.model_tiers
+        last_index = len(tiers) - 1
+
+        # A truncated call uses its tier's whole output budget before escalating
+        cost = sum(tier_cost(tier, input_tokens, tier["max_tokens"] * pages)
+                   for tier in tiers[start_index:last_index])
+
+        last = tiers[last_index]
+        requests, output_tokens = 1, last["max_tokens"]
+        if start_index == last_index:
+            # Truncated full call, header pass and line item passes
+            requests += 1 + RESERVE_LINE_ITEM_PASSES
+            output_tokens += min(HEADER_MAX_TOKENS, last["max_tokens"]) \
+                + RESERVE_LINE_ITEM_PASSES * last["max_tokens"]
+        return cost + tier_cost(last, input_tokens * requests, output_tokens * pages)
+
+    def plan(self, file_paths):
+        """Estimate every document and return jobs in priority order"""
+        jobs = [self.estimate(path) for path in dict.fromkeys(file_paths)]
+        jobs.sort(key=lambda job: job["priority"])
+        return jobs
+
+    def window_usage(self):
+        """Tokens and requests sent within the last minute"""
+        cutoff = self.clock() - 60
+        while self.window and self.window[0][0] <= cutoff:
+            self.window.popleft()
+        return sum(entry[1] for entry in self.window), sum(entry[2] for entry in self.window)
+
+    def acquire(self, job):
+        """Start a job; return False if the spend cap stops the run"""
+        if self.paused:
+            self.deferred += 1
+            return False
+
+        # Reserve the worst case so escalation and chunking cannot overshoot the cap
+        if self.spend_cap is not None and self.spent + job["reserve"] > self.spend_cap:
+            self.paused = True
+            self.deferred += 1
+            print(f"⏸️  Spend cap ${self.spend_cap:.4f} reached (spent ${self.spent:.4f}, "
+                  f"next document may cost up to ${job['reserve']:.4f}); "
+                  f"remaining documents stay queued for the next run")
+            return False
+
+        self.current_job = job
+        self.paced_tokens = 0
+        self.paced_requests = 0
+        self.dispatched += 1
+        return True
+
+    def pace(self):
+        """Wait for rate-limit room for one API call of the current job and count it"""
+        job = self.current_job
+        # Every call of a job sends one page image, so spread the estimate over its pages
+        call_tokens = job["input_tokens"] // max(job["requests"], 1) if job else 0
+
+        while True:
+            tokens, requests = self.window_usage()
+            token_room = self.tokens_per_minute is None or not self.window or \
+                tokens + call_tokens <= self.tokens_per_minute
+            request_room = self.requests_per_minute is None or not self.window or \
+                requests + 1 <= self.requests_per_minute
+            if token_room and request_room:
+                break
+            # Sleep until the oldest entry leaves the window
+            wait = max(0.1, self.window[0][0] + 60 - self.clock())
+            print(f"⏳ Rate limit reached, waiting {wait:.1f}s...")
+            self.sleep(wait)
+
+        self.window.append((self.clock(), call_tokens, 1))
+        self.paced_tokens += call_tokens
+        self.paced_requests += 1
+
+    def record(self, job, totals_before):
+        """Replace the estimates paced for the job with actual usage from the model router"""
+        totals_after = self.model_router.get_totals()
+        actual_tokens = totals_after["input_tokens"] - totals_before["input_tokens"]
+        actual_requests = totals_after["requests"] - totals_before["requests"]
+        self.spent += totals_after["total_cost"] - totals_before["total_cost"]
+
+        # Correct the window so estimation error counts against the limits
+        token_delta = actual_tokens - self.paced_tokens
+        request_delta = actual_requests - self.paced_requests
+        if token_delta or request_delta:
+            self.window.append((self.clock(), token_delta, request_delta))
+        self.current_job = None
+
+    def get_report(self):
+        """Summary of the scheduled run"""
+        return {
+            "dispatched": self.dispatched,
+            "deferred": self.deferred,
+            "spent": round(self.spent, 6),
+            "spend_cap": self.spend_cap,
+            "paused": self.paused,
+            "run_at": datetime.now().isoformat(),
+        }
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Local HTTP Ingestion Service
+Accepts document uploads over HTTP and processes them with an internal worker pool
+
+Endpoints:
+    POST /documents?filename=<name>   raw file body, or multipart/form-data with one file
+    POST /documents/bulk              multipart/form-data with any number of files
+    GET  /jobs                        summary of all jobs
+    GET  /jobs/<job_id>               status and extracted results for one job
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from document_processor import DocumentProcessor
+
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024  # 50 MB per request
+# Finished jobs stay available for polling this long, and at most this many are kept
+JOB_TTL_SECONDS = 60 * 60
+MAX_FINISHED_JOBS = 1000
+
+
+class JobStore:
+    """Thread-safe in-memory registry of ingestion jobs.
+
+    Finished (completed or failed) jobs are evicted once they are older than
+    ttl seconds, and oldest first beyond max_finished, so a long-running
+    service does not grow without bound. Queued and running jobs are kept.
+    """
+
+    def __init__(self, ttl=JOB_TTL_SECONDS, max_finished=MAX_FINISHED_JOBS, clock=time.monotonic):
+        self.jobs = {}
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self.clock = clock
+        # job id -> clock time it finished, oldest first
+        self.finished = OrderedDict()
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def evict(self):
+        """Drop expired and surplus finished jobs; the caller holds the lock"""
+        cutoff = self.clock() - self.ttl
+        while self.finished:
+            job_id, finished_at = next(iter(self.finished.items()))
+            if finished_at > cutoff and len(self.finished) <= self.max_finished:
+                break
+            del self.finished[job_id]
+            self.jobs.pop(job_id, None)
+            self.evicted += 1
+
+    def create(self, filename):
+        """Register a new queued job and return its id"""
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.evict()
+            self.jobs[job_id] = {
+                "job_id": job_id,
+                "filename": filename,
+                "status": "queued",
+                "created_at": datetime.now().isoformat(),
+                "started_at": None,
+                "finished_at": None,
+                "results": [],
+                "error": None,
+            }
+        return job_id
+
+    def update(self, job_id, **fields):
+        """Update fields of an existing job"""
+        with self.lock:
+            self.jobs[job_id].update(fields)
+            if fields.get("finished_at"):
+                self.finished[job_id] = self.clock()
+                self.evict()
+
+    def get(self, job_id):
+        """Get a copy of a job, or None if unknown"""
+        with self.lock:
+            self.evict()
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def summary(self):
+        """Count jobs by status"""
+        with self.lock:
+            self.evict()
+            counts = {}
+            for job in self.jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return {"total_jobs": len(self.jobs), "by_status": counts, "evicted_jobs": self.evicted}
+
+
+class IngestionService:
+    """Wraps DocumentProcessor with a job queue and worker pool"""
+
+    def __init__(self, document_processor, upload_folder="./uploads", max_workers=4,
+                 job_ttl=JOB_TTL_SECONDS, max_finished_jobs=MAX_FINISHED_JOBS):
+        self.document_processor = document_processor
+        self.upload_folder = upload_folder
+        os.makedirs(upload_folder, exist_ok=True)
+
+        self.jobs = JobStore(job_ttl, max_finished_jobs)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        # Excel export rewrites the whole workbook, so only one job may write at a time
+        self.export_lock = threading.Lock()
+
+        self.document_processor.invoice_processor.initialize_api()
+
+    def submit(self, filename, data):
+        """Store an uploaded file and queue it for processing. Returns the job id."""
+        filename = os.path.basename(filename or "")
+        if not filename or not self.document_processor.is_supported_file(filename):
+            raise ValueError(f"Unsupported file type: {filename or '(no filename)'}")
+
+        job_id = self.jobs.create(filename)
+
+        # One folder per job keeps the original filename without collisions
+        job_folder = os.path.join(self.upload_folder, job_id)
+        os.makedirs(job_folder, exist_ok=True)
+        file_path = os.path.join(job_folder, filename)
+        with open(file_path, 'wb') as f:
+            f.write(data)
+
+        self.executor.submit(self.run_job, job_id, file_path)
+        return job_id
+
+    def run_job(self, job_id, file_path):
+        """Process one uploaded document (runs on a worker thread)"""
+        self.jobs.update(job_id, status="processing", started_at=datetime.now().isoformat())
+        try:
+            results = self.document_processor.extract_document(file_path)
+
+            if results:
+                with self.export_lock:
+                    self.document_processor.invoice_processor.excel_manager.export_to_excel(results)
+                self.document_processor.move_processed_file(
+                    file_path, success=True,
+                    invoice_numbers=[invoice.get("invoice_number") for invoice in results])
+                self.jobs.update(job_id, status="completed", results=results)
+            else:
+                self.document_processor.move_processed_file(file_path, success=False)
+                self.jobs.update(job_id, status="failed", error="No invoice data extracted")
+
+        except Exception as e:
+            print(f"Error processing job {job_id}: {e}")
+            self.jobs.update(job_id, status="failed", error=str(e))
+
+        finally:
+            self.jobs.update(job_id, finished_at=datetime.now().isoformat())
+            shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+
+    def shutdown(self, wait=True):
+        """Stop accepting work and optionally wait for running jobs"""
+        self.executor.shutdown(wait=wait)
+
+
+def parse_multipart(content_type, body):
+    """Split a multipart/form-data body into (filename, bytes) pairs"""
+    message = BytesParser(policy=default_policy).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+    )
+    files = []
+    for part in message.iter_parts():
+        filename = part.get_filename()
+        if filename:
+            files.append((filename, part.get_payload(decode=True) or b""))
+    return files
+
+
+class IngestionRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end for IngestionService"""
+
+    service = None  # set by make_server
+
+    def send_json(self, status, payload):
+        """Send a JSON response"""
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_uploads(self, query):
+        """Read the request body and return a list of (filename, bytes)"""
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_UPLOAD_BYTES:
+            raise OverflowError(f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+        body = self.rfile.read(length)
+
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            return parse_multipart(content_type, body)
+
+        filename = (query.get("filename") or [self.headers.get("X-Filename", "")])[0]
+        return [(filename, body)]
+
+    def do_POST(self):
+        """Handle document uploads"""
+        url = urlparse(self.path)
+        if url.path not in ("/documents", "/documents/bulk"):
+            self.send_json(404, {"error": "Not found"})
+            return
+
+        try:
+            uploads = self.read_uploads(parse_qs(url.query))
+        except OverflowError as e:
+            self.send_json(413, {"error": str(e)})
+            return
+
+        if not uploads:
+            self.send_json(400, {"error": "No file in request"})
+            return
+
+        if url.path == "/documents":
+            if len(uploads) != 1:
+                self.send_json(400, {"error": "Use /documents/bulk for multiple files"})
+                return
+            try:
+                job_id = self.service.submit(*uploads[0])
+            except ValueError as e:
+                self.send_json(400, {"error": str(e)})
+                return
+            self.send_json(202, {"job_id": job_id, "status": "queued"})
+            return
+
+        jobs = []
+        for filename, data in uploads:
+            try:
+                jobs.append({"filename": filename, "job_id": self.service.submit(filename, data),
+                             "status": "queued"})
+            except ValueError as e:
+                jobs.append({"filename": filename, "job_id": None, "error": str(e)})
+        self.send_json(202, {"jobs": jobs})
+
+    def do_GET(self):
+        """Handle job status queries"""
+        path = urlparse(self.path).path.rstrip("/")
+        if path == "/jobs":
+            self.send_json(200, self.service.jobs.summary())
+            return
+
+        if path.startswith("/jobs/"):
+            job = self.service.jobs.get(path[len("/jobs/"):])
+            if job is None:
+                self.send_json(404, {"error": "Unknown job"})
+            else:
+                self.send_json(200, job)
+            return
+
+        self.send_json(404, {"error": "Not found"})
+
+
+def make_server(service, host="127.0.0.1", port=8080):
+    """Create an HTTP server bound to the given service"""
+    handler = type("BoundIngestionRequestHandler", (IngestionRequestHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def start_ingestion_service(host="127.0.0.1", port=8080, output_file="invoice_data.xlsx",
+                            max_workers=4, fake_api=False, dataset_dir=None,
+                            partition_by_currency=False, archive_dir=None,
+                            extraction_log_dir=None, thresholds=None, archive_compress=True):
+    """Start the local HTTP ingestion service"""
+    client = None
+    if fake_api:
+        from fake_api_client import FakeAnthropicClient
+        client = FakeAnthropicClient()
+
+    processor = DocumentProcessor(output_file=output_file, client=client, dataset_dir=dataset_dir,
+                                  partition_by_currency=partition_by_currency,
+                                  archive_dir=archive_dir,
+                                  extraction_log_dir=extraction_log_dir,
+                                  thresholds=thresholds,
+                                  archive_compress=archive_compress)
+    service = IngestionService(processor, max_workers=max_workers)
+    server = make_server(service, host, port)
+
+    print(f"🌐 Ingestion service listening on http://{host}:{port}")
+    print(f"📊 Output file: {output_file}")
+    print(f"⚙️  Workers: {max_workers}{' (fake API)' if fake_api else ''}")
+    print("Press Ctrl+C to stop...")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Ingestion service stopping, waiting for running jobs...")
+    finally:
+        server.server_close()
+        service.shutdown(wait=True)
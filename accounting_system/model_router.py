@@ -0,0 +1,215 @@
+import time
+import threading
+from PIL import Image
+
+# Model tiers ordered from fastest/cheapest to largest. Costs are USD per
+# million tokens and are only used for reporting.
+MODEL_TIERS = [
+    {
+        "name": "fast",
+        "model": "claude-3-5-haiku-20241022",
+        "max_tokens": 2000,
+        "input_cost_per_mtok": 0.80,
+        "output_cost_per_mtok": 4.00,
+    },
+    {
+        "name": "large",
+        "model": "claude-3-5-sonnet-20241022",
+        "max_tokens": 2000,
+        "input_cost_per_mtok": 3.00,
+        "output_cost_per_mtok": 15.00,
+    },
+]
+
+# Thresholds that mark a document as complex enough to skip the fast tier
+# (or to escalate after a fast-tier result).
+DEFAULT_THRESHOLDS = {
+    "max_fast_pages": 2,              # multi-page PDFs go straight to the large model
+    "max_fast_megapixels": 12.0,      # very large scans are usually dense
+    "max_fast_line_items": 25,        # dense line items on a non-final tier are re-checked on the next one
+    "reconciliation_tolerance": 0.01, # relative tolerance for line item totals
+}
+
+
+class ModelRouter:
+    """Routes extraction requests through model tiers, escalating on failure"""
+
+    def __init__(self, model_tiers=None, thresholds=None):
+        self.model_tiers = model_tiers or MODEL_TIERS
+        self.thresholds = dict(DEFAULT_THRESHOLDS)
+        if thresholds:
+            self.thresholds.update(thresholds)
+        self.stats = {
+            tier["name"]: {
+                "calls": 0,
+                "requests": 0,
+                "accepted": 0,
+                "escalations": 0,
+                "total_latency": 0.0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "total_cost": 0.0,
+            }
+            for tier in self.model_tiers
+        }
+        # Stats are shared by concurrent extraction jobs
+        self.stats_lock = threading.Lock()
+
+    def is_last_tier(self, tier):
+        """Whether tier is the largest one, with nothing left to escalate to"""
+        return tier is self.model_tiers[-1]
+
+    def initial_tier_index(self, image_path, page_count=1):
+        """Pick the starting tier from document complexity"""
+        last_tier = len(self.model_tiers) - 1
+        if page_count > self.thresholds["max_fast_pages"]:
+            return last_tier
+
+        try:
+            with Image.open(image_path) as img:
+                megapixels = img.width * img.height / 1_000_000
+            if megapixels > self.thresholds["max_fast_megapixels"]:
+                return last_tier
+        except Exception:
+            # Unreadable dimensions are not a reason to pay for the large model
+            pass
+
+        return 0
+
+    def validate_result(self, invoice_data, check_density=True):
+        """Check an extraction result against schema and reconciliation rules.
+
+        The line item density rule only decides whether a result is worth
+        re-checking on a larger tier, so the last tier passes check_density=False.
+        Returns a reason string if the result should be escalated, otherwise None.
+        """
+        if not invoice_data:
+            return "no tool_use result"
+
+        for field in ("invoice_number", "vendor_name"):
+            if not str(invoice_data.get(field) or "").strip():
+                return f"missing {field}"
+
+        total_amount = invoice_data.get("total_amount")
+        if not isinstance(total_amount, (int, float)) or isinstance(total_amount, bool):
+            return "total_amount is not numeric"
+
+        line_items = invoice_data.get("line_items") or []
+        if check_density and len(line_items) > self.thresholds["max_fast_line_items"]:
+            return f"dense line items ({len(line_items)})"
+
+        amounts = [item.get("amount") for item in line_items
+                   if isinstance(item.get("amount"), (int, float))]
+        if amounts:
+            items_total = sum(amounts)
+            tax_amount = invoice_data.get("tax_amount") or 0
+            tolerance = max(1.0, abs(total_amount) * self.thresholds["reconciliation_tolerance"])
+            # Line items may be listed either before or after tax
+            if (abs(items_total - total_amount) > tolerance
+                    and abs(items_total + tax_amount - total_amount) > tolerance):
+                return f"line items sum {items_total} does not reconcile with total {total_amount}"
+
+        return None
+
+    def record_call(self, tier, latency, usage=None):
+        """Record latency, token usage and cost for a single model call"""
+        input_tokens = getattr(usage, "input_tokens", 0) or 0
+        output_tokens = getattr(usage, "output_tokens", 0) or 0
+
+        with self.stats_lock:
+            tier_stats = self.stats[tier["name"]]
+            tier_stats["calls"] += 1
+            # A chunked extraction is one call made of several API requests
+            tier_stats["requests"] += getattr(usage, "requests", 1) or 1
+            tier_stats["total_latency"] += latency
+            tier_stats["input_tokens"] += input_tokens
+            tier_stats["output_tokens"] += output_tokens
+            tier_stats["total_cost"] += (
+                input_tokens * tier["input_cost_per_mtok"]
+                + output_tokens * tier["output_cost_per_mtok"]
+            ) / 1_000_000
+
+    def record_outcome(self, tier, key):
+        """Increment an outcome counter ('accepted' or 'escalations') for a tier"""
+        with self.stats_lock:
+            self.stats[tier["name"]][key] += 1
+
+    def extract(self, call_model, image_path, page_count=1):
+        """Run an extraction through the tier cascade.
+
+        call_model(tier) must return (invoice_data, usage). The first result that
+        passes validation is returned; if no tier passes, the last non-empty
+        result is returned so the caller can still decide what to do with it.
+        """
+        start_index = self.initial_tier_index(image_path, page_count)
+        last_index = len(self.model_tiers) - 1
+        fallback = None
+
+        for index in range(start_index, len(self.model_tiers)):
+            tier = self.model_tiers[index]
+            started = time.monotonic()
+            try:
+                invoice_data, usage = call_model(tier)
+            except Exception as e:
+                print(f"Error calling {tier['model']}: {e}")
+                invoice_data, usage = None, None
+            self.record_call(tier, time.monotonic() - started, usage)
+
+            reason = self.validate_result(invoice_data, check_density=index < last_index)
+            if reason is None:
+                self.record_outcome(tier, "accepted")
+                invoice_data["model_tier"] = tier["name"]
+                return invoice_data
+
+            if invoice_data:
+                invoice_data["model_tier"] = tier["name"]
+                fallback = invoice_data
+
+            if index < last_index:
+                self.record_outcome(tier, "escalations")
+                print(f"↗ Escalating {tier['name']} → {self.model_tiers[index + 1]['name']}: {reason}")
+
+        # Only structurally usable results are worth keeping
+        if fallback and str(fallback.get("invoice_number") or "").strip():
+            return fallback
+        return None
+
+    def get_totals(self):
+        """Get call, request, token and cost totals across all tiers"""
+        with self.stats_lock:
+            return {
+                key: sum(tier_stats[key] for tier_stats in self.stats.values())
+                for key in ("calls", "requests", "input_tokens", "output_tokens", "total_cost")
+            }
+
+    def get_routing_report(self):
+        """Get per-tier latency, cost and escalation rate"""
+        report = {}
+        for tier in self.model_tiers:
+            tier_stats = self.stats[tier["name"]]
+            calls = tier_stats["calls"]
+            report[tier["name"]] = {
+                "model": tier["model"],
+                "calls": calls,
+                "requests": tier_stats["requests"],
+                "accepted": tier_stats["accepted"],
+                "escalations": tier_stats["escalations"],
+                "escalation_rate": tier_stats["escalations"] / calls if calls else 0.0,
+                "avg_latency": tier_stats["total_latency"] / calls if calls else 0.0,
+                "input_tokens": tier_stats["input_tokens"],
+                "output_tokens": tier_stats["output_tokens"],
+                "total_cost": round(tier_stats["total_cost"], 6),
+            }
+        return report
+
+    def print_routing_report(self):
+        """Print per-tier routing statistics"""
+        print("\n📊 Model Routing Report:")
+        for name, tier_report in self.get_routing_report().items():
+            if not tier_report["calls"]:
+                continue
+            print(f"  {name} ({tier_report['model']}): "
+                  f"{tier_report['calls']} calls, "
+                  f"avg {tier_report['avg_latency']:.2f}s, "
+                  f"${tier_report['total_cost']:.4f}, "
+                  f"escalation rate {tier_report['escalation_rate']:.0%}")
@@ -0,0 +1,373 @@
+import os
+import json
+import uuid
+import shutil
+from functools import reduce
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from currency import normalize_currency
+from payment_status import DEFAULT_PAYMENT_STATUS
+
+UNKNOWN_PARTITION = "unknown"
+
+HEADER_SCHEMA = pa.schema([
+    ("Invoice Number", pa.string()),
+    ("Vendor Name", pa.string()),
+    ("Vendor Address", pa.string()),
+    ("Vendor Phone", pa.string()),
+    ("Vendor Email", pa.string()),
+    ("Receiver Name", pa.string()),
+    ("Receiver Address", pa.string()),
+    ("Receiver Phone", pa.string()),
+    ("Receiver Email", pa.string()),
+    ("Invoice Date", pa.timestamp("ms")),
+    ("Due Date", pa.timestamp("ms")),
+    ("Tax Amount", pa.float64()),
+    ("Total Amount", pa.float64()),
+    ("Currency", pa.string()),
+    ("Category", pa.string()),
+    ("Processing Date", pa.string()),
+    ("Source File", pa.string()),
+    ("year", pa.string()),
+    ("month", pa.string()),
+])
+
+LINE_ITEM_SCHEMA = pa.schema([
+    ("Invoice Number", pa.string()),
+    ("Source File", pa.string()),
+    ("Line Number", pa.int32()),
+    ("Item Description", pa.string()),
+    ("Quantity", pa.float64()),
+    ("Unit Price", pa.float64()),
+    ("Amount", pa.float64()),
+    ("Invoice Date", pa.timestamp("ms")),
+    ("Currency", pa.string()),
+    ("year", pa.string()),
+    ("month", pa.string()),
+])
+
+PAYMENT_SCHEMA = pa.schema([
+    ("Invoice Number", pa.string()),
+    ("Source File", pa.string()),
+    ("Payment Status", pa.string()),
+    ("Payment Date", pa.string()),
+])
+
+ROWS_PER_GROUP = 64 * 1024
+# Part files a partition may collect from small appends before it is compacted
+MAX_FILES_PER_PARTITION = 8
+
+
+def date_range_bounds(date_range):
+    """Start and end timestamps of a (start, end) filter; a plain end date
+    includes that whole day"""
+    start_date, end_date = (pd.Timestamp(d) for d in date_range)
+    if end_date == end_date.normalize():
+        end_date = end_date + pd.Timedelta(days=1) - pd.Timedelta(milliseconds=1)
+    return start_date, end_date
+
+
+class ParquetInvoiceDataset:
+    """Hive-partitioned Parquet dataset with header and line item tables.
+
+    Layout:
+        <dataset_dir>/headers/year=2025/month=01[/Currency=TWD]/part-*.parquet
+        <dataset_dir>/line_items/year=2025/month=01[/Currency=TWD]/part-*.parquet
+        <dataset_dir>/payments.parquet
+
+    Each append adds one part file per touched partition; a partition that
+    collects more than MAX_FILES_PER_PARTITION files is compacted into one.
+    Payment status changes after extraction, so it is kept in a small
+    invoice-level table that is rewritten along with the workbook.
+    """
+
+    def __init__(self, dataset_dir, partition_by_currency=False):
+        self.dataset_dir = dataset_dir
+        self.headers_dir = os.path.join(dataset_dir, "headers")
+        self.line_items_dir = os.path.join(dataset_dir, "line_items")
+        self.metadata_file = os.path.join(dataset_dir, "dataset.json")
+        self.payments_file = os.path.join(dataset_dir, "payments.parquet")
+
+        # The partition layout is fixed when the dataset is first written
+        self.partition_by_currency = partition_by_currency
+        if os.path.exists(self.metadata_file):
+            with open(self.metadata_file, 'r', encoding='utf-8') as f:
+                self.partition_by_currency = json.load(f).get("partition_by_currency", False)
+
+    @property
+    def partition_fields(self):
+        fields = [pa.field("year", pa.string()), pa.field("month", pa.string())]
+        if self.partition_by_currency:
+            fields.append(pa.field("Currency", pa.string()))
+        return fields
+
+    def partitioning(self):
+        return ds.partitioning(pa.schema(self.partition_fields), flavor="hive")
+
+    def exists(self):
+        """Check if the header table has been written"""
+        return os.path.isdir(self.headers_dir) and any(os.scandir(self.headers_dir))
+
+    def clear(self):
+        """Remove all written data, keeping the partition layout"""
+        for base_dir in (self.headers_dir, self.line_items_dir):
+            if os.path.isdir(base_dir):
+                shutil.rmtree(base_dir)
+        if os.path.exists(self.payments_file):
+            os.remove(self.payments_file)
+
+    def build_tables(self, invoice_data_list):
+        """Build header and line item DataFrames from extracted invoices"""
+        headers = []
+        line_items = []
+
+        for invoice in invoice_data_list:
+            header = {
+                "Invoice Number": str(invoice.get("invoice_number", "") or ""),
+                "Vendor Name": invoice.get("vendor_name", ""),
+                "Vendor Address": invoice.get("vendor_address", ""),
+                "Vendor Phone": invoice.get("vendor_phone", ""),
+                "Vendor Email": invoice.get("vendor_email", ""),
+                "Receiver Name": invoice.get("receiver_name", ""),
+                "Receiver Address": invoice.get("receiver_address", ""),
+                "Receiver Phone": invoice.get("receiver_phone", ""),
+                "Receiver Email": invoice.get("receiver_email", ""),
+                "Invoice Date": invoice.get("invoice_date", ""),
+                "Due Date": invoice.get("due_date", ""),
+                "Tax Amount": invoice.get("tax_amount", 0),
+                "Total Amount": invoice.get("total_amount", 0),
+                "Currency": normalize_currency(invoice.get("currency")),
+                "Category": invoice.get("category", ""),
+                "Processing Date": invoice.get("processing_date", ""),
+                "Source File": invoice.get("source_file", ""),
+            }
+            headers.append(header)
+
+            for line_number, item in enumerate(invoice.get("line_items", []) or [], start=1):
+                line_items.append({
+                    "Invoice Number": header["Invoice Number"],
+                    "Source File": header["Source File"],
+                    "Line Number": line_number,
+                    "Item Description": item.get("description", ""),
+                    "Quantity": item.get("quantity", 0),
+                    "Unit Price": item.get("unit_price", 0),
+                    "Amount": item.get("amount", 0),
+                    "Invoice Date": header["Invoice Date"],
+                    "Currency": header["Currency"],
+                })
+
+        headers_df = self.normalize_frame(pd.DataFrame(headers), HEADER_SCHEMA)
+        line_items_df = self.normalize_frame(pd.DataFrame(line_items), LINE_ITEM_SCHEMA)
+        return headers_df, line_items_df
+
+    def normalize_frame(self, df, schema):
+        """Coerce a DataFrame to the table schema and add partition columns"""
+        for field in schema:
+            if field.name not in df.columns:
+                df[field.name] = None
+
+        for column in ("Invoice Date", "Due Date"):
+            if column in df.columns:
+                df[column] = pd.to_datetime(df[column], errors="coerce", format="mixed").dt.floor("ms")
+
+        for field in schema:
+            if pa.types.is_floating(field.type) or pa.types.is_integer(field.type):
+                df[field.name] = pd.to_numeric(df[field.name], errors="coerce")
+            elif pa.types.is_string(field.type) and field.name not in ("year", "month"):
+                df[field.name] = df[field.name].fillna("").astype(str)
+
+        dates = df["Invoice Date"]
+        df["year"] = dates.dt.strftime("%Y").fillna(UNKNOWN_PARTITION)
+        df["month"] = dates.dt.strftime("%m").fillna(UNKNOWN_PARTITION)
+        df["Currency"] = df["Currency"].replace("", UNKNOWN_PARTITION)
+
+        # Sorted rows give tight min/max row-group statistics on Invoice Date
+        return df[schema.names].sort_values("Invoice Date", kind="stable")
+
+    def partition_filter(self, df):
+        """Expression matching only the partitions present in df"""
+        keys = [field.name for field in self.partition_fields]
+        expressions = []
+        for values in df[keys].drop_duplicates().itertuples(index=False):
+            expressions.append(reduce(
+                lambda a, b: a & b,
+                [ds.field(key) == value for key, value in zip(keys, values)],
+            ))
+        return reduce(lambda a, b: a | b, expressions)
+
+    def append(self, invoice_data_list):
+        """Append invoices, touching only the partitions they fall into.
+
+        Invoices are keyed by (Invoice Number, Source File) like ledger rows,
+        so every page of a PDF that repeats its invoice number is kept; which
+        invoices belong in the ledger at all is decided by the caller
+        (see ExcelManager.export_to_excel). Returns the number written.
+        """
+        headers_df, line_items_df = self.build_tables(invoice_data_list)
+        headers_df = headers_df.drop_duplicates(["Invoice Number", "Source File"], keep="first")
+
+        # Deduplicate against existing invoices, reading only affected partitions
+        if self.exists() and len(headers_df) > 0:
+            existing = ds.dataset(self.headers_dir, format="parquet", partitioning=self.partitioning())
+            existing_table = existing.to_table(
+                columns=["Invoice Number", "Source File"], filter=self.partition_filter(headers_df))
+            existing_keys = set(zip(existing_table.column("Invoice Number").to_pylist(),
+                                    existing_table.column("Source File").to_pylist()))
+            headers_df = headers_df[[
+                key not in existing_keys
+                for key in zip(headers_df["Invoice Number"], headers_df["Source File"])
+            ]]
+
+        if len(headers_df) == 0:
+            return 0
+
+        # Keep line items only for the header rows actually written
+        written_keys = set(zip(headers_df["Invoice Number"], headers_df["Source File"]))
+        line_items_df = line_items_df[[
+            key in written_keys
+            for key in zip(line_items_df["Invoice Number"], line_items_df["Source File"])
+        ]]
+
+        if not os.path.exists(self.metadata_file):
+            os.makedirs(self.dataset_dir, exist_ok=True)
+            with open(self.metadata_file, 'w', encoding='utf-8') as f:
+                json.dump({"partition_by_currency": self.partition_by_currency}, f)
+
+        self.write_table(headers_df, HEADER_SCHEMA, self.headers_dir)
+        self.compact(headers_df, HEADER_SCHEMA, self.headers_dir)
+        if len(line_items_df) > 0:
+            self.write_table(line_items_df, LINE_ITEM_SCHEMA, self.line_items_dir)
+            self.compact(line_items_df, LINE_ITEM_SCHEMA, self.line_items_dir)
+
+        return len(headers_df)
+
+    def partition_dirs(self, df, base_dir):
+        """Directories of the partitions present in df"""
+        keys = [field.name for field in self.partition_fields]
+        return [
+            os.path.join(base_dir, *(f"{key}={value}" for key, value in zip(keys, values)))
+            for values in df[keys].drop_duplicates().itertuples(index=False)
+        ]
+
+    def compact(self, df, schema, base_dir, max_files=MAX_FILES_PER_PARTITION):
+        """Merge the part files of df's partitions once there are more than max_files"""
+        data_schema = pa.schema([field for field in schema if field.name not in
+                                 {field.name for field in self.partition_fields}])
+        for partition_dir in self.partition_dirs(df, base_dir):
+            files = sorted(os.path.join(partition_dir, name) for name in os.listdir(partition_dir)
+                           if name.endswith(".parquet"))
+            if len(files) <= max_files:
+                continue
+
+            table = ds.dataset(files, schema=data_schema, format="parquet").to_table()
+            table = table.sort_by([("Invoice Date", "ascending")])
+            # Written under an ignored name first so a reader never sees it half-written
+            temp_path = os.path.join(partition_dir, f"_compact-{uuid.uuid4().hex}.tmp")
+            pq.write_table(table, temp_path, row_group_size=ROWS_PER_GROUP)
+            os.replace(temp_path, os.path.join(partition_dir, f"part-{uuid.uuid4().hex}-0.parquet"))
+            for path in files:
+                os.remove(path)
+
+    def write_payments(self, ledger_df):
+        """Replace the payment status table from invoice-level ledger rows"""
+        os.makedirs(self.dataset_dir, exist_ok=True)
+        df = pd.DataFrame({
+            name: ledger_df[name].fillna("").astype(str) if name in ledger_df.columns else ""
+            for name in PAYMENT_SCHEMA.names
+        })
+        df = df.drop_duplicates(["Invoice Number", "Source File"], keep="first")
+        temp_path = self.payments_file + ".tmp"
+        pq.write_table(pa.Table.from_pandas(df, schema=PAYMENT_SCHEMA, preserve_index=False), temp_path)
+        os.replace(temp_path, self.payments_file)
+
+    def read_payments(self):
+        """Payment status table, empty if it has not been written"""
+        if not os.path.exists(self.payments_file):
+            return pd.DataFrame(columns=PAYMENT_SCHEMA.names)
+        return pq.read_table(self.payments_file, schema=PAYMENT_SCHEMA).to_pandas()
+
+    def write_table(self, df, schema, base_dir):
+        """Write new files into the affected partitions without rewriting others"""
+        table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+        ds.write_dataset(
+            table,
+            base_dir,
+            format="parquet",
+            partitioning=self.partitioning(),
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            max_rows_per_group=ROWS_PER_GROUP,
+            min_rows_per_group=min(len(df), ROWS_PER_GROUP),
+        )
+
+    def build_filter(self, filter_criteria):
+        """Translate filter criteria into a pyarrow expression.
+
+        Partition fields (year, month and optionally Currency) prune whole
+        directories; Invoice Date and Currency comparisons are also checked
+        against row-group statistics so non-matching row groups are skipped.
+        """
+        expressions = []
+
+        if "date_range" in filter_criteria:
+            start_date, end_date = date_range_bounds(filter_criteria["date_range"])
+            months = pd.period_range(start_date, end_date, freq="M")
+            month_filters = []
+            for year in sorted({period.year for period in months}):
+                year_months = [f"{period.month:02d}" for period in months if period.year == year]
+                month_filters.append((ds.field("year") == str(year)) & ds.field("month").isin(year_months))
+            if month_filters:
+                expressions.append(reduce(lambda a, b: a | b, month_filters))
+            expressions.append(
+                (ds.field("Invoice Date") >= pa.scalar(start_date.to_pydatetime(), pa.timestamp("ms")))
+                & (ds.field("Invoice Date") <= pa.scalar(end_date.to_pydatetime(), pa.timestamp("ms")))
+            )
+
+        if "currency" in filter_criteria:
+            expressions.append(ds.field("Currency") == normalize_currency(filter_criteria["currency"]))
+
+        if "invoice_numbers" in filter_criteria:
+            # Vendor filters resolved through the search index (see ExcelManager.filter_parquet_invoices)
+            numbers = pa.array(sorted(filter_criteria["invoice_numbers"]), type=pa.string())
+            expressions.append(ds.field("Invoice Number").isin(numbers))
+        elif "vendor_name" in filter_criteria:
+            # Without an index, substring matches still run inside the scan
+            expressions.append(pc.match_substring(
+                ds.field("Vendor Name"), filter_criteria["vendor_name"], ignore_case=True))
+
+        if not expressions:
+            return None
+        return reduce(lambda a, b: a & b, expressions)
+
+    def query(self, filter_criteria, columns=None):
+        """Read matching header rows as a DataFrame"""
+        dataset = ds.dataset(self.headers_dir, format="parquet", partitioning=self.partitioning())
+        table = dataset.to_table(columns=columns, filter=self.build_filter(filter_criteria))
+        return table.to_pandas()
+
+    def query_line_items(self, headers_df):
+        """Read line items for the given header rows, pruned to their partitions"""
+        if len(headers_df) == 0 or not os.path.isdir(self.line_items_dir):
+            return pd.DataFrame(columns=LINE_ITEM_SCHEMA.names)
+
+        dataset = ds.dataset(self.line_items_dir, format="parquet", partitioning=self.partitioning())
+        expression = self.partition_filter(headers_df) & ds.field("Invoice Number").isin(
+            headers_df["Invoice Number"].unique().tolist())
+        return dataset.to_table(filter=expression).to_pandas()
+
+    def query_flat(self, filter_criteria):
+        """Read matching invoices flattened to one row per line item, like the Excel sheet"""
+        headers_df = self.query(filter_criteria)
+        line_items_df = self.query_line_items(headers_df)
+        keys = ["Invoice Number", "Source File"]
+        item_columns = keys + ["Line Number", "Item Description", "Quantity", "Unit Price", "Amount"]
+        flat_df = headers_df.merge(line_items_df[item_columns], on=keys, how="left")
+        flat_df = flat_df.merge(self.read_payments(), on=keys, how="left")
+        flat_df["Payment Status"] = flat_df["Payment Status"].fillna(DEFAULT_PAYMENT_STATUS)
+        flat_df["Payment Date"] = flat_df["Payment Date"].fillna("")
+        # Line items in printed order, invoices in the order they were added
+        flat_df = flat_df.sort_values(["Processing Date", "Source File", "Line Number"], kind="stable")
+        return flat_df.drop(columns=["year", "month", "Line Number"]).reset_index(drop=True)
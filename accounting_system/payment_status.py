@@ -0,0 +1,208 @@
+import os
+import json
+import bisect
+import numpy as np
+import pandas as pd
+from extraction_log import PAGE_SUFFIX
+
+PAYMENT_STATUSES = ["Pending", "Paid", "Overdue"]
+DEFAULT_PAYMENT_STATUS = "Pending"
+
+AGING_BUCKETS = ["Current", "1-30", "31-60", "61-90", "90+"]
+
+# Column names expected in bank statement CSV exports
+DEFAULT_BANK_COLUMNS = {
+    "reference": "Reference",
+    "amount": "Amount",
+    "date": "Date",
+}
+
+
+def normalize_invoice_number(values):
+    """Vectorized invoice number normalization for matching (case and whitespace)"""
+    return values.fillna("").astype(str).str.upper().str.replace(r"\s+", "", regex=True)
+
+
+def parse_dates(values):
+    """Vectorized date parsing tolerant of mixed formats"""
+    return pd.to_datetime(values, errors="coerce", format="mixed")
+
+
+def invoice_pages(df):
+    """Collapse one-row-per-line-item sheet data to one row per invoice and source file (PDF page)"""
+    return df.drop_duplicates(subset=["Invoice Number", "Source File"], keep="first")
+
+
+def invoice_level(df):
+    """Collapse one-row-per-line-item sheet data to one row per invoice.
+
+    Pages of a PDF that repeat the invoice number are one invoice, so rows
+    are keyed on the source document rather than the page's source file.
+    """
+    documents = df["Source File"].fillna("").astype(str).str.replace(PAGE_SUFFIX, "", regex=True)
+    return df[~pd.DataFrame({"number": df["Invoice Number"], "document": documents}).duplicated()]
+
+
+def ensure_payment_columns(df):
+    """Add payment columns to sheets written before they existed"""
+    if "Payment Status" not in df.columns:
+        df["Payment Status"] = DEFAULT_PAYMENT_STATUS
+    df["Payment Status"] = df["Payment Status"].fillna(DEFAULT_PAYMENT_STATUS)
+    if "Payment Date" not in df.columns:
+        df["Payment Date"] = ""
+    return df
+
+
+def compute_aging(df, as_of=None):
+    """Compute aging buckets for unpaid invoices in one vectorized pass.
+
+    Returns invoice-level rows with Days Overdue and Aging Bucket columns.
+    """
+    as_of = pd.Timestamp(as_of or pd.Timestamp.now()).normalize()
+    invoices = invoice_level(ensure_payment_columns(df.copy()))
+    invoices = invoices[invoices["Payment Status"] != "Paid"].copy()
+
+    due = parse_dates(invoices["Due Date"])
+    days_overdue = (as_of - due).dt.days
+
+    invoices["Days Overdue"] = days_overdue
+    invoices["Aging Bucket"] = pd.cut(
+        days_overdue.fillna(0).clip(lower=0),
+        bins=[-1, 0, 30, 60, 90, np.inf],
+        labels=AGING_BUCKETS,
+    )
+    return invoices
+
+
+def aging_summary(df, as_of=None, reporting_column=None):
+    """Count and total unpaid invoices per aging bucket and currency.
+
+    If reporting_column (e.g. "Total Amount (TWD)") is present it is totalled
+    as reporting_amount alongside the original-currency total. Invoices with
+    no recorded currency are grouped under an empty currency.
+    """
+    aged = compute_aging(df, as_of)
+    aged["Total Amount"] = pd.to_numeric(aged["Total Amount"], errors="coerce").fillna(0)
+    aged["Currency"] = aged["Currency"].fillna("")
+    aggregations = {"invoices": ("Invoice Number", "count"), "total_amount": ("Total Amount", "sum")}
+    if reporting_column and reporting_column in aged.columns:
+        # NaN when any invoice in the group has no usable rate
+        aggregations["reporting_amount"] = (reporting_column, lambda values: values.sum(min_count=len(values)))
+    return (
+        aged.groupby(["Aging Bucket", "Currency"], observed=True)
+        .agg(**aggregations)
+        .reset_index()
+    )
+
+
+def match_bank_payments(df, bank_df, columns=None, amount_tolerance=0.01):
+    """Match bank statement rows to unpaid invoices by normalized invoice number.
+
+    Returns (matches, unmatched_bank_rows) where matches has Invoice Number and
+    Payment Date columns.
+    """
+    columns = {**DEFAULT_BANK_COLUMNS, **(columns or {})}
+    invoices = invoice_level(ensure_payment_columns(df.copy()))
+    invoices = invoices[invoices["Payment Status"] != "Paid"]
+
+    bank = bank_df.reset_index(drop=True)
+    bank["_row"] = bank.index
+    bank["_key"] = normalize_invoice_number(bank[columns["reference"]])
+    invoices = invoices.assign(_key=normalize_invoice_number(invoices["Invoice Number"]))
+    invoices = invoices.drop_duplicates("_key")
+
+    merged = bank.merge(invoices[["_key", "Invoice Number", "Total Amount"]], on="_key", how="left")
+
+    matched = merged["Invoice Number"].notna()
+    if columns["amount"] in merged.columns:
+        paid = pd.to_numeric(merged[columns["amount"]], errors="coerce").abs()
+        total = pd.to_numeric(merged["Total Amount"], errors="coerce").abs()
+        tolerance = np.maximum(1.0, total * amount_tolerance)
+        matched &= (paid - total).abs() <= tolerance
+
+    matches = merged[matched]
+    if columns["date"] in matches.columns:
+        payment_dates = parse_dates(matches[columns["date"]])
+    else:
+        payment_dates = pd.Series(pd.Timestamp.now().normalize(), index=matches.index)
+    matches = pd.DataFrame({
+        "Invoice Number": matches["Invoice Number"],
+        "Payment Date": payment_dates.dt.strftime("%Y-%m-%d"),
+    }).drop_duplicates("Invoice Number")
+
+    unmatched = bank_df.reset_index(drop=True)[~bank["_row"].isin(merged.loc[matched, "_row"])]
+    return matches, unmatched
+
+
+class DueDateIndex:
+    """Persistent sorted index of pending invoices by due date.
+
+    Only pending invoices with a parseable due date are indexed. Each refresh
+    pops the prefix that has fallen due since the last run via binary search,
+    so overdue transitions cost O(log n + k) instead of a full ledger scan.
+    """
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.due_dates = []
+        self.invoice_numbers = []
+        self.last_run = None
+        self.loaded = False
+
+        if os.path.exists(index_file):
+            with open(index_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.due_dates = state.get("due_dates", [])
+            self.invoice_numbers = state.get("invoice_numbers", [])
+            self.last_run = state.get("last_run")
+            self.loaded = True
+
+    def save(self):
+        """Persist the index"""
+        with open(self.index_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                "last_run": self.last_run,
+                "due_dates": self.due_dates,
+                "invoice_numbers": self.invoice_numbers,
+            }, f, ensure_ascii=False)
+        self.loaded = True
+
+    def rebuild(self, df):
+        """Rebuild the index from all pending invoices in the ledger"""
+        invoices = invoice_level(ensure_payment_columns(df.copy()))
+        invoices = invoices[invoices["Payment Status"] == "Pending"]
+        due = parse_dates(invoices["Due Date"])
+        pending = pd.DataFrame({
+            "due": due.dt.strftime("%Y-%m-%d"),
+            "number": invoices["Invoice Number"].astype(str),
+        }).dropna().sort_values("due", kind="stable")
+        self.due_dates = pending["due"].tolist()
+        self.invoice_numbers = pending["number"].tolist()
+
+    def add(self, invoice_number, due_date):
+        """Insert a pending invoice keeping the index sorted"""
+        due = parse_dates(pd.Series([due_date])).iloc[0]
+        if pd.isna(due):
+            return
+        key = due.strftime("%Y-%m-%d")
+        position = bisect.bisect_right(self.due_dates, key)
+        self.due_dates.insert(position, key)
+        self.invoice_numbers.insert(position, str(invoice_number))
+
+    def remove(self, invoice_numbers):
+        """Drop invoices that are no longer pending (e.g. paid)"""
+        remove_set = {str(number) for number in invoice_numbers}
+        if not remove_set:
+            return
+        kept = [(d, n) for d, n in zip(self.due_dates, self.invoice_numbers) if n not in remove_set]
+        self.due_dates = [d for d, _ in kept]
+        self.invoice_numbers = [n for _, n in kept]
+
+    def pop_due_before(self, as_of):
+        """Remove and return invoice numbers whose due date is before as_of"""
+        cutoff = pd.Timestamp(as_of).strftime("%Y-%m-%d")
+        position = bisect.bisect_left(self.due_dates, cutoff)
+        due_now = self.invoice_numbers[:position]
+        del self.due_dates[:position]
+        del self.invoice_numbers[:position]
+        return due_now
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Multi-Document Processing Runner
-Supports batch processing and automatic monitoring
+Supports batch processing, automatic monitoring and a local HTTP ingestion service
 """
 
 import sys
@@ -11,24 +11,108 @@ from document_processor import DocumentProcessor, start_document_watcher
 
 def main():
     parser = argparse.ArgumentParser(description='Multi-Document Invoice Processor')
-    parser.add_argument('--mode', choices=['batch', 'watch'], default='batch',
-                       help='Processing mode: batch or watch')
+    parser.add_argument('--mode', choices=['batch', 'watch', 'serve', 'aging', 'rebuild', 'consolidate'], default='batch',
+                       help='Processing mode: batch, watch, serve, aging, rebuild or consolidate')
     parser.add_argument('--watch-folder', default='./watch',
                        help='Folder to watch for new documents')
     parser.add_argument('--output', default='invoice_data.xlsx',
                        help='Output Excel file')
     parser.add_argument('--stats', action='store_true',
                        help='Show processing statistics')
+    parser.add_argument('--host', default='127.0.0.1',
+                       help='Host for the ingestion service (serve mode)')
+    parser.add_argument('--port', type=int, default=8080,
+                       help='Port for the ingestion service (serve mode)')
+    parser.add_argument('--workers', type=int, default=4,
+                       help='Worker pool size (serve, rebuild and consolidate modes)')
+    parser.add_argument('--dataset-dir', default=None,
+                       help='Also write a partitioned Parquet dataset to this folder')
+    parser.add_argument('--partition-by-currency', action='store_true',
+                       help='Partition the Parquet dataset by currency as well as year/month')
+    parser.add_argument('--archive-dir', default=None,
+                       help='Store originals in a deduplicating content-addressed archive')
+    parser.add_argument('--no-archive-compress', action='store_true',
+                       help='Store archived originals as-is instead of gzipping compressible ones')
+    parser.add_argument('--extraction-log', default=None,
+                       help='Folder holding the raw extraction log (default ../extraction_log)')
+    parser.add_argument('--projection-version', type=int, default=None,
+                       help='Projection version used to rebuild outputs (rebuild mode, default latest)')
+    parser.add_argument('--as-of', default=None,
+                       help='Date for overdue status and aging (aging mode, default today)')
+    parser.add_argument('--bank-csv', default=None,
+                       help='Bank statement CSV used to mark invoices paid (aging mode)')
+    parser.add_argument('--fx-rates', default=None,
+                       help='FX rate CSV (Date,Currency,Rate) for reporting-currency totals (aging mode, default fx_rates.csv next to the output)')
+    parser.add_argument('--reporting-currency', default='TWD',
+                       help='Currency used for converted totals (aging mode)')
+    parser.add_argument('--spend-cap', type=float, default=None,
+                       help='Maximum API spend in USD for this run; the rest stays queued (batch mode)')
+    parser.add_argument('--tokens-per-minute', type=int, default=None,
+                       help='Input token rate limit (batch mode)')
+    parser.add_argument('--requests-per-minute', type=int, default=None,
+                       help='Request rate limit (batch mode)')
+    parser.add_argument('--folder-priority', default=None,
+                       help='Comma-separated folder (branch) names, highest priority first (batch mode)')
+    parser.add_argument('--branches', nargs='+', default=None,
+                       help='Branch workbooks as name=path or path (consolidate mode; earlier branches win duplicates)')
+    parser.add_argument('--consolidated-output', default='consolidated_invoice_data.xlsx',
+                       help='Consolidated ledger written in consolidate mode')
+    parser.add_argument('--max-fast-pages', type=int, default=None,
+                       help='Documents with more pages skip the fast model (batch, watch and serve modes)')
+    parser.add_argument('--max-fast-megapixels', type=float, default=None,
+                       help='Larger scans skip the fast model (batch, watch and serve modes)')
+    parser.add_argument('--max-fast-line-items', type=int, default=None,
+                       help='Fast-model results with more line items are re-checked on the large model (batch, watch and serve modes)')
+    parser.add_argument('--reconciliation-tolerance', type=float, default=None,
+                       help='Relative tolerance when line items are reconciled with the total (batch, watch and serve modes)')
+    parser.add_argument('--fake-api', action='store_true',
+                       help='Use the fake API client instead of calling Anthropic (batch, watch and serve modes)')
     
     args = parser.parse_args()
+
+    if args.fake_api and args.mode not in ('batch', 'watch', 'serve'):
+        parser.error("--fake-api only applies to batch, watch and serve modes")
+
+    # Routing thresholds left unset keep the ModelRouter defaults
+    thresholds = {
+        name: getattr(args, name)
+        for name in ('max_fast_pages', 'max_fast_megapixels', 'max_fast_line_items',
+                     'reconciliation_tolerance')
+        if getattr(args, name) is not None
+    }
+
+    client = None
+    if args.fake_api and args.mode in ('batch', 'watch'):
+        from fake_api_client import FakeAnthropicClient
+        client = FakeAnthropicClient()
     
     if args.mode == 'batch':
         print("🔄 Starting batch processing...")
         processor = DocumentProcessor(
             watch_folder=args.watch_folder,
-            output_file=args.output
+            output_file=args.output,
+            client=client,
+            thresholds=thresholds,
+            dataset_dir=args.dataset_dir,
+            partition_by_currency=args.partition_by_currency,
+            archive_dir=args.archive_dir,
+            archive_compress=not args.no_archive_compress,
+            extraction_log_dir=args.extraction_log
         )
         
+        # Budget-aware ordering and pacing of extraction work
+        if any(value is not None for value in (args.spend_cap, args.tokens_per_minute,
+                                               args.requests_per_minute, args.folder_priority)):
+            from extraction_scheduler import ExtractionScheduler
+            folders = [name.strip() for name in (args.folder_priority or "").split(",") if name.strip()]
+            processor.scheduler = ExtractionScheduler(
+                processor.invoice_processor.model_router,
+                tokens_per_minute=args.tokens_per_minute,
+                requests_per_minute=args.requests_per_minute,
+                spend_cap=args.spend_cap,
+                folder_priorities={name: rank for rank, name in enumerate(folders)},
+            )
+        
         # Process all documents in watch folder
         processed, failed = processor.process_batch()
         
@@ -42,7 +126,66 @@ def main():
         
     elif args.mode == 'watch':
         print("👁️  Starting document watcher...")
-        start_document_watcher(args.watch_folder, args.output)
+        start_document_watcher(args.watch_folder, args.output,
+                               args.dataset_dir, args.partition_by_currency,
+                               args.archive_dir, args.extraction_log, client=client,
+                               thresholds=thresholds,
+                               archive_compress=not args.no_archive_compress)
+
+    elif args.mode == 'serve':
+        print("🌐 Starting ingestion service...")
+        from ingestion_service import start_ingestion_service
+        start_ingestion_service(args.host, args.port, args.output,
+                                max_workers=args.workers, fake_api=args.fake_api,
+                                dataset_dir=args.dataset_dir,
+                                partition_by_currency=args.partition_by_currency,
+                                archive_dir=args.archive_dir,
+                                extraction_log_dir=args.extraction_log,
+                                thresholds=thresholds,
+                                archive_compress=not args.no_archive_compress)
+
+    elif args.mode == 'aging':
+        # Meant to run on a schedule (e.g. nightly cron); only invoices that
+        # fell due since the previous run are re-examined
+        print("📅 Updating payment status and aging...")
+        from automated_invoice_processor import InvoiceProcessor
+        processor = InvoiceProcessor(output_file=args.output, fx_rates_file=args.fx_rates,
+                                     reporting_currency=args.reporting_currency)
+
+        if args.bank_csv:
+            processor.mark_paid_from_bank_csv(args.bank_csv)
+        processor.refresh_overdue_status(args.as_of)
+
+        report = processor.get_aging_report(args.as_of)
+        if report is not None:
+            print("\n📊 Payables Aging:")
+            print(report.to_string(index=False))
+
+    elif args.mode == 'rebuild':
+        # Reprojects the raw extraction log; no documents are read and no API calls are made
+        print("🔁 Rebuilding outputs from the extraction log...")
+        from automated_invoice_processor import InvoiceProcessor
+        from extraction_log import CURRENT_PROJECTION_VERSION
+        processor = InvoiceProcessor(output_file=args.output,
+                                     dataset_dir=args.dataset_dir,
+                                     partition_by_currency=args.partition_by_currency,
+                                     extraction_log_dir=args.extraction_log)
+        processor.rebuild_outputs(args.projection_version or CURRENT_PROJECTION_VERSION,
+                                  max_workers=args.workers)
+
+    elif args.mode == 'consolidate':
+        # Meant to run nightly at head office; unchanged branch files are not re-read
+        print("🏢 Consolidating branch workbooks...")
+        if not args.branches:
+            parser.error("--branches is required in consolidate mode")
+        from branch_consolidation import BranchConsolidator, parse_branch_args
+        parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        consolidator = BranchConsolidator(os.path.join(parent_dir, args.consolidated_output))
+        report = consolidator.consolidate(parse_branch_args(args.branches), max_workers=args.workers)
+        if report and args.stats:
+            print("\n📊 Consolidation Statistics:")
+            for key, value in report.items():
+                print(f"  {key}: {value}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
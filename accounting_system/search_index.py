@@ -0,0 +1,387 @@
+import re
+import math
+import sqlite3
+import threading
+import unicodedata
+
+# Traditional character variants folded to one form before indexing
+VARIANT_MAP = str.maketrans({
+    "臺": "台",
+    "峯": "峰",
+    "裏": "裡",
+    "着": "著",
+    "爲": "為",
+    "綫": "線",
+    "衞": "衛",
+    "啓": "啟",
+    "羣": "群",
+    "眞": "真",
+    "麪": "麵",
+    "鷄": "雞",
+})
+
+# Company suffixes stripped from vendor names, longest first
+COMPANY_SUFFIXES = [
+    "股份有限公司", "企業有限公司", "實業有限公司", "有限公司", "企業社",
+    "分公司", "公司", "商行", "商號", "工作室",
+    "company limited", "co ltd", "corporation", "limited", "company",
+    "corp", "inc", "ltd", "llc", "co",
+]
+
+TOKEN_PATTERN = re.compile(r"[㐀-䶿一-鿿豈-﫿぀-ヿ가-힯]+|[a-z0-9]+")
+CJK_PATTERN = re.compile(r"[㐀-䶿一-鿿豈-﫿぀-ヿ가-힯]")
+
+# Bound parameters per IN (...) query, under SQLite's limit
+SQL_BATCH_SIZE = 500
+
+# Query tokens found in more than this share of documents are only scored for
+# documents that match a rarer query token, when that cannot change the result
+COMMON_TOKEN_SHARE = 0.05
+
+# Field weights used when ranking matches
+FIELD_WEIGHTS = {
+    "vendor": 3.0,
+    "address": 1.0,
+    "item": 1.0,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    invoice_number TEXT NOT NULL,
+    source_file TEXT NOT NULL,
+    vendor_name TEXT,
+    vendor_key TEXT,
+    UNIQUE (invoice_number, source_file)
+);
+CREATE TABLE IF NOT EXISTS postings (
+    token TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    PRIMARY KEY (token, field, doc_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS token_df (
+    token TEXT PRIMARY KEY,
+    df INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS vendors (
+    vendor_key TEXT PRIMARY KEY,
+    canonical_name TEXT NOT NULL,
+    invoice_count INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS vendor_postings (
+    token TEXT NOT NULL,
+    vendor_key TEXT NOT NULL,
+    PRIMARY KEY (token, vendor_key)
+) WITHOUT ROWID;
+"""
+
+
+def normalize_text(text):
+    """Fold width (full-width → half-width), case, character variants and punctuation"""
+    text = unicodedata.normalize("NFKC", str(text or "")).lower().translate(VARIANT_MAP)
+    text = "".join(
+        " " if unicodedata.category(ch)[0] in ("P", "S", "Z") else ch
+        for ch in text
+    )
+    return " ".join(text.split())
+
+
+def strip_company_suffix(normalized):
+    """Remove trailing company-form suffixes from a normalized name"""
+    changed = True
+    while changed and normalized:
+        changed = False
+        for suffix in COMPANY_SUFFIXES:
+            if normalized.endswith(suffix) and len(normalized) > len(suffix):
+                # Latin suffixes must be whole words
+                if not CJK_PATTERN.match(suffix) and normalized[-len(suffix) - 1] != " ":
+                    continue
+                normalized = normalized[:-len(suffix)].rstrip()
+                changed = True
+                break
+    return normalized
+
+
+def vendor_key(name):
+    """Canonical vendor key: normalized, suffix-stripped, without spaces"""
+    return strip_company_suffix(normalize_text(name)).replace(" ", "")
+
+
+def gram_length(run):
+    """N-gram length used for a run of CJK or Latin characters"""
+    return 2 if CJK_PATTERN.match(run) else 3
+
+
+def shorter_than_gram(text):
+    """Whether normalized text is too short to form a single n-gram (e.g. one CJK character)"""
+    runs = TOKEN_PATTERN.findall(text)
+    return bool(runs) and all(len(run) < gram_length(run) for run in runs)
+
+
+def tokenize(text):
+    """CJK bigram / Latin trigram tokenization of already-normalized text"""
+    tokens = []
+    for run in TOKEN_PATTERN.findall(text):
+        gram = gram_length(run)
+        if len(run) <= gram:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + gram] for i in range(len(run) - gram + 1))
+    return tokens
+
+
+class InvoiceSearchIndex:
+    """Persistent inverted index over vendor names, addresses and line items.
+
+    Each invoice is one document. Vendor names are indexed without their
+    company suffix, so "臺灣電力股份有限公司" and "台灣電力公司" share tokens.
+    Vendors are also grouped under a canonical key for name canonicalization.
+    """
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(index_file, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+
+    def document_count(self):
+        """Number of indexed invoices"""
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def add_invoices(self, invoice_data_list):
+        """Index extracted invoices; already indexed invoices are skipped. Returns count added."""
+        added = 0
+        with self.lock:
+            cursor = self.connection.cursor()
+            for invoice in invoice_data_list:
+                invoice_number = str(invoice.get("invoice_number", "") or "")
+                source_file = str(invoice.get("source_file", "") or "")
+                vendor_name = str(invoice.get("vendor_name", "") or "")
+                key = vendor_key(vendor_name)
+
+                cursor.execute(
+                    "INSERT OR IGNORE INTO docs (invoice_number, source_file, vendor_name, vendor_key) "
+                    "VALUES (?, ?, ?, ?)",
+                    (invoice_number, source_file, vendor_name, key),
+                )
+                if cursor.rowcount == 0:
+                    continue
+                doc_id = cursor.lastrowid
+                added += 1
+
+                fields = {
+                    "vendor": set(tokenize(strip_company_suffix(normalize_text(vendor_name)))),
+                    "address": set(tokenize(normalize_text(invoice.get("vendor_address", "")))),
+                    "item": set(),
+                }
+                for item in invoice.get("line_items", []) or []:
+                    fields["item"].update(tokenize(normalize_text(item.get("description", ""))))
+
+                new_tokens = set()
+                for field, tokens in fields.items():
+                    cursor.executemany(
+                        "INSERT OR IGNORE INTO postings (token, doc_id, field) VALUES (?, ?, ?)",
+                        [(token, doc_id, field) for token in tokens],
+                    )
+                    new_tokens.update(tokens)
+                cursor.executemany(
+                    "INSERT INTO token_df (token, df) VALUES (?, 1) "
+                    "ON CONFLICT(token) DO UPDATE SET df = df + 1",
+                    [(token,) for token in new_tokens],
+                )
+
+                if key:
+                    cursor.execute(
+                        "INSERT INTO vendors (vendor_key, canonical_name, invoice_count) VALUES (?, ?, 1) "
+                        "ON CONFLICT(vendor_key) DO UPDATE SET invoice_count = invoice_count + 1",
+                        (key, vendor_name.strip()),
+                    )
+                    cursor.executemany(
+                        "INSERT OR IGNORE INTO vendor_postings (token, vendor_key) VALUES (?, ?)",
+                        [(token, key) for token in set(tokenize(key))],
+                    )
+            self.connection.commit()
+        return added
+
+    def add_dataframe(self, df):
+        """Backfill the index from flattened Excel rows (one row per line item)"""
+        invoices = {}
+        for row in df.fillna("").to_dict("records"):
+            key = (str(row.get("Invoice Number", "")), str(row.get("Source File", "")))
+            invoice = invoices.setdefault(key, {
+                "invoice_number": key[0],
+                "source_file": key[1],
+                "vendor_name": row.get("Vendor Name", ""),
+                "vendor_address": row.get("Vendor Address", ""),
+                "line_items": [],
+            })
+            if row.get("Item Description"):
+                invoice["line_items"].append({"description": row["Item Description"]})
+        return self.add_invoices(list(invoices.values()))
+
+    def idf_weights(self, tokens):
+        """Inverse document frequency per query token, and the share of documents holding it"""
+        if not tokens:
+            return {}, {}
+        total = self.connection.execute("SELECT COUNT(*) FROM docs").fetchone()[0] or 1
+        placeholders = ",".join("?" * len(tokens))
+        df = dict(self.connection.execute(
+            f"SELECT token, df FROM token_df WHERE token IN ({placeholders})", list(tokens)
+        ).fetchall())
+        idf = {token: math.log(1 + total / df.get(token, 1)) for token in tokens}
+        return idf, {token: df.get(token, 0) / total for token in tokens}
+
+    def rank_documents(self, idf, fields, min_match, limit, common=()):
+        """Score and rank documents in SQLite; returns (score, match, doc_id) rows, best first.
+
+        Tokens in common are only scored for documents that match one of the
+        other tokens, found by seeking their postings rather than scanning them.
+        """
+        terms = ",".join(["(?, ?, ?, ?, ?)"] * (len(idf) * len(fields)))
+        hits = ("SELECT p.doc_id, p.token, t.idf, t.weight FROM terms t CROSS JOIN postings p "
+                "ON p.token = t.token AND p.field = t.field WHERE NOT t.common")
+        if common:
+            hits = (f"WITH candidates AS (SELECT DISTINCT doc_id FROM ({hits})) {hits} UNION ALL "
+                    f"SELECT p.doc_id, p.token, t.idf, t.weight FROM candidates c CROSS JOIN terms t "
+                    f"CROSS JOIN postings p ON p.token = t.token AND p.field = t.field "
+                    f"AND p.doc_id = c.doc_id WHERE t.common")
+        sql = (
+            f"WITH terms(token, field, idf, weight, common) AS (VALUES {terms}), "
+            f"hits AS ({hits}), "
+            # One row per matched token, so a token found in two fields counts once towards match
+            f"token_hits AS (SELECT doc_id, SUM(weight) AS weight, MAX(idf) AS idf FROM hits "
+            f"GROUP BY doc_id, token) "
+            f"SELECT SUM(weight) AS score, SUM(idf) / ? AS match, doc_id FROM token_hits "
+            f"GROUP BY doc_id HAVING match >= ? ORDER BY score DESC, match DESC, doc_id DESC LIMIT ?"
+        )
+        params = [
+            value for token, weight in idf.items() for field in fields
+            for value in (token, field, weight, weight * FIELD_WEIGHTS[field], token in common)
+        ]
+        params += [sum(idf.values()), min_match, -1 if limit is None else limit]
+        return self.connection.execute(sql, params).fetchall()
+
+    def search(self, query, fields=None, limit=20, min_match=0.0):
+        """Ranked search over indexed invoices (limit=None returns every match).
+
+        Returns dicts with invoice_number, source_file, vendor_name, score and
+        match (fraction of the query's idf weight that matched, 0..1). Queries
+        too short to form an n-gram (e.g. "電") match vendor names by substring.
+        """
+        fields = fields or list(FIELD_WEIGHTS)
+        normalized = normalize_text(query)
+        # Vendor tokens are indexed without the company suffix; strip it from the query too
+        if "vendor" in fields:
+            normalized = strip_company_suffix(normalized)
+        if "vendor" in fields and shorter_than_gram(normalized):
+            return self.search_vendor_substring(normalized.replace(" ", ""), limit)
+        tokens = set(tokenize(normalized))
+        if not tokens:
+            return []
+
+        with self.lock:
+            idf, shares = self.idf_weights(tokens)
+            common = {token for token in tokens if shares[token] > COMMON_TOKEN_SHARE}
+            ranked = None
+            if common and len(common) < len(tokens):
+                # Documents holding only common tokens are skipped; that is exact when
+                # they cannot reach min_match or outscore the last ranked document
+                ranked = self.rank_documents(idf, fields, min_match, limit, common)
+                common_weight = sum(idf[token] for token in common)
+                best_common_score = common_weight * sum(FIELD_WEIGHTS[field] for field in fields)
+                if not (common_weight / sum(idf.values()) < min_match or (
+                        limit is not None and len(ranked) == limit and ranked[-1][0] > best_common_score)):
+                    ranked = None
+            if ranked is None:
+                ranked = self.rank_documents(idf, fields, min_match, limit)
+
+            docs = self.fetch_docs([doc_id for _, _, doc_id in ranked])
+
+        results = []
+        for score, match, doc_id in ranked:
+            invoice_number, source_file, vendor_name = docs[doc_id]
+            results.append({
+                "invoice_number": invoice_number,
+                "source_file": source_file,
+                "vendor_name": vendor_name,
+                "score": round(score, 4),
+                "match": round(match, 4),
+            })
+        return results
+
+    def fetch_docs(self, doc_ids):
+        """Map doc_id -> (invoice_number, source_file, vendor_name) in one query per batch"""
+        docs = {}
+        for start in range(0, len(doc_ids), SQL_BATCH_SIZE):
+            batch = doc_ids[start:start + SQL_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            for doc_id, *fields in self.connection.execute(
+                f"SELECT doc_id, invoice_number, source_file, vendor_name FROM docs "
+                f"WHERE doc_id IN ({placeholders})", batch
+            ).fetchall():
+                docs[doc_id] = tuple(fields)
+        return docs
+
+    def search_vendor_substring(self, text, limit=20):
+        """Vendors whose key contains text; used for queries shorter than an n-gram"""
+        query = ("SELECT invoice_number, source_file, vendor_name FROM docs "
+                 "WHERE instr(vendor_key, ?) > 0 ORDER BY doc_id")
+        params = [text]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return [
+            {"invoice_number": invoice_number, "source_file": source_file, "vendor_name": vendor_name,
+             "score": FIELD_WEIGHTS["vendor"], "match": 1.0}
+            for invoice_number, source_file, vendor_name in rows
+        ]
+
+    def match_vendors(self, name, limit=10):
+        """Rank known vendors by similarity (Dice coefficient over tokens)"""
+        key = vendor_key(name)
+        tokens = set(tokenize(key))
+        if not tokens:
+            return []
+
+        with self.lock:
+            exact = self.connection.execute(
+                "SELECT canonical_name, invoice_count FROM vendors WHERE vendor_key = ?", (key,)
+            ).fetchone()
+            if exact:
+                return [{"vendor_key": key, "canonical_name": exact[0],
+                         "invoice_count": exact[1], "similarity": 1.0}]
+
+            placeholders = ",".join("?" * len(tokens))
+            overlap = self.connection.execute(
+                f"SELECT vendor_key, COUNT(*) FROM vendor_postings "
+                f"WHERE token IN ({placeholders}) GROUP BY vendor_key",
+                list(tokens),
+            ).fetchall()
+
+            candidates = []
+            for candidate_key, shared in overlap:
+                similarity = 2 * shared / (len(tokens) + len(set(tokenize(candidate_key))))
+                candidates.append((similarity, candidate_key))
+            candidates.sort(reverse=True)
+
+            results = []
+            for similarity, candidate_key in candidates[:limit]:
+                canonical_name, invoice_count = self.connection.execute(
+                    "SELECT canonical_name, invoice_count FROM vendors WHERE vendor_key = ?",
+                    (candidate_key,),
+                ).fetchone()
+                results.append({"vendor_key": candidate_key, "canonical_name": canonical_name,
+                                "invoice_count": invoice_count, "similarity": round(similarity, 4)})
+        return results
+
+    def canonicalize_vendor(self, name, min_similarity=0.75):
+        """Return the canonical spelling of a vendor name, or None if unknown"""
+        matches = self.match_vendors(name, limit=1)
+        if matches and matches[0]["similarity"] >= min_similarity:
+            return matches[0]["canonical_name"]
+        return None
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for the content-addressed archive of processed originals
+"""
+
+import os
+from archive_store import ArchiveStore
+
+
+def write_file(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    archive = ArchiveStore(str(tmp_path / "archive"))
+    data = os.urandom(4096)
+    first = archive.store(write_file(tmp_path / "a.png", data), "analyzed", ["AB-0001"])
+    copy = write_file(tmp_path / "copy.png", data)
+
+    assert archive.store(copy, "processed", ["AB-0002"]) == first
+    assert not os.path.exists(copy)
+
+    stats = archive.get_stats()
+    assert stats["unique_objects"] == 1
+    assert stats["duplicates_skipped"] == 1
+    assert stats["original_bytes"] == 4096
+    assert len(os.listdir(os.path.dirname(archive.object_path(first)))) == 1
+
+
+def test_raw_file_is_moved_not_copied(tmp_path):
+    archive = ArchiveStore(str(tmp_path / "archive"))
+    path = write_file(tmp_path / "scan.jpg", os.urandom(4096))
+    inode = os.stat(path).st_ino
+
+    file_hash = archive.store(path, "analyzed")
+
+    assert archive.describe(file_hash)["compression"] == "none"
+    assert os.stat(archive.object_path(file_hash)).st_ino == inode
+
+    # Keeping the original needs a copy
+    kept = write_file(tmp_path / "kept.jpg", os.urandom(4096))
+    kept_hash = archive.store(kept, "analyzed", remove_original=False)
+    assert os.path.exists(kept)
+    assert os.stat(archive.object_path(kept_hash)).st_ino != os.stat(kept).st_ino
+
+
+def test_compressible_file_round_trips_through_gzip(tmp_path):
+    archive = ArchiveStore(str(tmp_path / "archive"))
+    data = "發票號碼 AB-0001 台灣電力股份有限公司\n".encode("utf-8") * 2000
+
+    file_hash = archive.store(write_file(tmp_path / "invoice.txt", data), "analyzed")
+
+    info = archive.describe(file_hash)
+    assert info["compression"] == "gzip"
+    assert info["stored_size"] < info["size"] == len(data)
+    restored = archive.retrieve(file_hash, str(tmp_path / "restored.txt"))
+    assert open(restored, "rb").read() == data
+
+    # Compression can be turned off
+    raw_archive = ArchiveStore(str(tmp_path / "raw_archive"), compress=False)
+    raw_hash = raw_archive.store(write_file(tmp_path / "invoice.txt", data), "analyzed")
+    assert raw_hash == file_hash
+    assert raw_archive.describe(raw_hash)["compression"] == "none"
+
+
+def test_index_lookups(tmp_path):
+    archive = ArchiveStore(str(tmp_path / "archive"))
+    data = os.urandom(1024)
+    file_hash = archive.store(write_file(tmp_path / "a.png", data), "analyzed", ["AB-0001"])
+    archive.store(write_file(tmp_path / "a.png", data), "failed")
+    archive.link_invoices(file_hash, ["AB-0002", ""])
+
+    assert [entry["category"] for entry in archive.find_by_name("a.png")] == ["analyzed", "failed"]
+    assert {entry["hash"] for entry in archive.find_by_name("a.png")} == {file_hash}
+    assert archive.find_by_invoice("AB-0002") == [file_hash]
+    assert archive.find_by_invoice("XX-1") == []
+    assert sorted(archive.describe(file_hash)["invoice_numbers"]) == ["AB-0001", "AB-0002"]
+    assert archive.describe("0" * 64) is None
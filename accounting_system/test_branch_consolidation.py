@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Tests for branch workbook consolidation and its change tracking
+"""
+
+import os
+import pandas as pd
+from branch_consolidation import BranchConsolidator, parse_branch_args
+
+
+def write_branch(path, invoices):
+    """Branch ledger from (invoice number, vendor, total) tuples, one line item each"""
+    pd.DataFrame([
+        {"Invoice Number": number, "Vendor Name": vendor, "Total Amount": total,
+         "Invoice Date": "2025-01-15", "Currency": "TWD", "Source File": f"{number}.png",
+         "Item Description": "影印紙", "Amount": total}
+        for number, vendor, total in invoices
+    ]).to_excel(path, index=False)
+    return str(path)
+
+
+def make_branches(tmp_path):
+    return {
+        "taipei": write_branch(tmp_path / "taipei.xlsx", [("T-1", "台灣電力股份有限公司", 1050),
+                                                          ("S-1", "中華電信", 300)]),
+        "kaohsiung": write_branch(tmp_path / "kaohsiung.xlsx", [("K-1", "高雄商行", 500),
+                                                                ("S-1", "中華電信股份有限公司", 300)]),
+    }
+
+
+def test_consolidates_and_drops_cross_branch_duplicates(tmp_path):
+    output = str(tmp_path / "consolidated.xlsx")
+    report = BranchConsolidator(output).consolidate(make_branches(tmp_path), max_workers=2)
+
+    assert report["written"]
+    assert report["rows"] == 3
+    assert report["duplicates_dropped"] == 1
+    consolidated = pd.read_excel(output)
+    assert list(consolidated["Branch"]) == ["taipei", "taipei", "kaohsiung"]
+    assert "Payment Status" in consolidated.columns
+
+
+def test_skips_rewrite_when_nothing_changed(tmp_path):
+    output = str(tmp_path / "consolidated.xlsx")
+    branches = make_branches(tmp_path)
+    BranchConsolidator(output).consolidate(branches, max_workers=2)
+    written_at = os.stat(output).st_mtime_ns
+
+    report = BranchConsolidator(output).consolidate(branches, max_workers=2)
+    assert not report["written"]
+    assert report["read"] == []
+    assert report["rows"] == 3
+    assert os.stat(output).st_mtime_ns == written_at
+
+    # Reordering branches changes which copy of a duplicate wins
+    report = BranchConsolidator(output).consolidate(dict(reversed(list(branches.items()))), max_workers=2)
+    assert report["written"]
+    assert report["read"] == []
+    assert list(pd.read_excel(output)["Branch"])[0] == "kaohsiung"
+
+
+def test_rewrites_when_output_or_branch_changed(tmp_path):
+    output = str(tmp_path / "consolidated.xlsx")
+    branches = make_branches(tmp_path)
+    BranchConsolidator(output).consolidate(branches, max_workers=2)
+
+    os.remove(output)
+    report = BranchConsolidator(output).consolidate(branches, max_workers=2)
+    assert report["written"] and report["read"] == []
+
+    write_branch(branches["kaohsiung"], [("K-1", "高雄商行", 500), ("K-2", "高雄商行", 800)])
+    report = BranchConsolidator(output).consolidate(branches, max_workers=2)
+    assert report["written"]
+    assert report["read"] == ["kaohsiung"]
+    assert report["rows"] == 4
+
+
+def test_keeps_every_page_of_a_document_in_its_branch(tmp_path):
+    pages = pd.DataFrame([
+        {"Invoice Number": "INV-7", "Vendor Name": "台灣電力股份有限公司", "Total Amount": 1050,
+         "Invoice Date": "2025-01-15", "Currency": "TWD", "Source File": f"scan.pdf_page_{page}",
+         "Item Description": f"項目 {page}", "Amount": 350}
+        for page in (1, 2, 3)
+    ])
+    pages.to_excel(tmp_path / "taipei.xlsx", index=False)
+    branches = {
+        "taipei": str(tmp_path / "taipei.xlsx"),
+        "kaohsiung": write_branch(tmp_path / "kaohsiung.xlsx", [("INV-7", "台灣電力公司", 1050),
+                                                                ("K-1", "高雄商行", 500)]),
+    }
+    output = str(tmp_path / "consolidated.xlsx")
+
+    report = BranchConsolidator(output).consolidate(branches, max_workers=2)
+
+    assert report["duplicates_dropped"] == 1
+    consolidated = pd.read_excel(output)
+    assert list(consolidated["Source File"]) == ["scan.pdf_page_1", "scan.pdf_page_2", "scan.pdf_page_3",
+                                                 "K-1.png"]
+
+
+def test_parse_branch_args():
+    assert parse_branch_args(["north=/data/n.xlsx", "/data/south/invoice_data.xlsx", "east.xlsx"]) == {
+        "north": "/data/n.xlsx",
+        "south": "/data/south/invoice_data.xlsx",
+        "east": "east.xlsx",
+    }
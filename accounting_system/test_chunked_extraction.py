@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Tests for model routing and chunked extraction of dense invoices, using the fake API client
+"""
+
+from PIL import Image
+from automated_invoice_processor import InvoiceProcessor
+from fake_api_client import FakeAnthropicClient
+
+
+def dense_template(item_count):
+    """Fake invoice whose line items reconcile with its total"""
+    return {
+        "vendor_name": "測試供應商股份有限公司",
+        "invoice_date": "2025-01-15",
+        "due_date": "2025-02-14",
+        "tax_amount": 0,
+        "total_amount": 10 * item_count,
+        "currency": "TWD",
+        "category": "Office Supplies",
+        "line_items": [
+            {"description": f"項目 {i}", "quantity": 1, "unit_price": 10, "amount": 10}
+            for i in range(1, item_count + 1)
+        ],
+    }
+
+
+def make_processor(tmp_path, item_count, thresholds=None):
+    client = FakeAnthropicClient(dense_template(item_count))
+    processor = InvoiceProcessor(input_folder=str(tmp_path / "invoice"),
+                                 output_file=str(tmp_path / "invoice_data.xlsx"),
+                                 client=client,
+                                 extraction_log_dir=str(tmp_path / "extraction_log"),
+                                 thresholds=thresholds)
+    image_path = tmp_path / "dense.png"
+    Image.new("RGB", (32, 32), "white").save(image_path)
+    return processor, client, str(image_path)
+
+
+def test_dense_invoice_escalates_then_chunks_on_last_tier(tmp_path):
+    processor, client, image_path = make_processor(tmp_path, 80)
+
+    invoice_data = processor.extract_invoice_data(image_path)
+
+    assert invoice_data["model_tier"] == "large"
+    assert len(invoice_data["line_items"]) == 80
+    assert [item["description"] for item in invoice_data["line_items"]][:2] == ["項目 1", "項目 2"]
+
+    models = [call["model"] for call in client.messages.calls]
+    # One truncated fast call, then the large tier's truncated call, header and line item passes
+    assert models.count(processor.model_router.model_tiers[0]["model"]) == 1
+    assert len(client.messages.calls) <= 6
+
+    report = processor.model_router.get_routing_report()
+    assert report["fast"]["escalations"] == 1
+    assert report["large"]["accepted"] == 1
+    assert report["large"]["requests"] == len(client.messages.calls) - 1
+
+
+def test_dense_result_is_accepted_on_last_tier(tmp_path):
+    # 30 items fit in one response but exceed max_fast_line_items
+    processor, client, image_path = make_processor(tmp_path, 30)
+
+    invoice_data = processor.extract_invoice_data(image_path)
+
+    assert invoice_data["model_tier"] == "large"
+    assert len(invoice_data["line_items"]) == 30
+    assert len(client.messages.calls) == 2
+    assert processor.model_router.get_routing_report()["large"]["accepted"] == 1
+
+
+def test_thresholds_are_passed_to_the_router(tmp_path):
+    processor, client, image_path = make_processor(tmp_path, 30, thresholds={"max_fast_line_items": 40})
+
+    invoice_data = processor.extract_invoice_data(image_path)
+
+    assert processor.model_router.thresholds["max_fast_line_items"] == 40
+    assert processor.model_router.thresholds["max_fast_pages"] == 2
+    assert invoice_data["model_tier"] == "fast"
+    assert len(client.messages.calls) == 1
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Tests for currency normalization and FX rate lookups
+"""
+
+import numpy as np
+import pandas as pd
+from currency import FXRateTable, load_fx_rates, normalize_currency
+
+
+def write_rates(path, rows):
+    pd.DataFrame(rows, columns=["Date", "Currency", "Rate"]).to_csv(path, index=False)
+    return str(path)
+
+
+def make_table(tmp_path):
+    return FXRateTable(write_rates(tmp_path / "fx_rates.csv", [
+        ("2025-01-02", "USD", 32.8),
+        ("2025-01-15", "US$", 33.0),
+        ("2025/02/03", "JPY", 0.21),
+        ("2025-01-15", "USD", 33.1),  # later row for the same date wins
+        ("2025-01-20", "EUR", -1),    # unusable rate
+    ]))
+
+
+def test_normalize_currency():
+    assert normalize_currency("NT$") == "TWD"
+    assert normalize_currency("新臺幣") == "TWD"
+    assert normalize_currency(" usd ") == "USD"
+    assert normalize_currency("rmb") == "CNY"
+    assert normalize_currency("chf") == "CHF"
+    assert normalize_currency(None) == ""
+    assert normalize_currency(float("nan")) == ""
+
+
+def test_base_rates_as_of_lookup(tmp_path):
+    table = make_table(tmp_path)
+    assert table.currencies == ["JPY", "TWD", "USD"]
+
+    rates = table.base_rates(
+        ["USD", "USD", "USD", "USD", "JPY", "TWD", "EUR"],
+        np.array(["2025-01-01", "2025-01-02", "2025-01-14", "2025-01-15", "2025-03-01", "2024-01-01",
+                  "2025-02-01"], dtype="datetime64[D]"),
+    )
+    # Before the first rate there is none; on and after a rate date that rate applies
+    assert np.isnan(rates[0])
+    assert list(rates[1:6]) == [32.8, 32.8, 33.1, 0.21, 1.0]
+    assert np.isnan(rates[6])
+
+    # A missing date uses the latest rate
+    assert table.base_rates(["USD"], np.array(["NaT"], dtype="datetime64[D]"))[0] == 33.1
+
+
+def test_convert_frame(tmp_path):
+    table = make_table(tmp_path)
+    df = pd.DataFrame({
+        "Invoice Number": ["A", "B", "C", "D"],
+        "Currency": ["US$", "TWD", "CHF", "USD"],
+        "Invoice Date": ["2025-01-20", "2025-01-20", "2025-01-20", "2024-12-31"],
+        "Total Amount": [100, 3310, 50, 10],
+        "Tax Amount": [5, 0, 0, 0],
+    }, index=[10, 11, 12, 13])
+
+    converted = table.convert_frame(df, "USD")
+
+    assert list(converted.index) == [10, 11, 12, 13]
+    assert set(converted["Reporting Currency"]) == {"USD"}
+    # Same currency converts at exactly 1
+    assert converted.loc[10, "FX Rate"] == 1.0
+    assert converted.loc[10, "Total Amount (USD)"] == 100
+    assert converted.loc[10, "Tax Amount (USD)"] == 5
+    assert converted.loc[11, "Total Amount (USD)"] == 100
+    # Unknown currency and dates before the first rate get no rate
+    assert converted.loc[[12, 13], "Total Amount (USD)"].isna().all()
+
+    identity = table.convert_frame(df.iloc[[1]], "NT$")
+    assert identity["FX Rate"].iloc[0] == 1.0
+    assert identity["Total Amount (TWD)"].iloc[0] == 3310
+
+
+def test_load_fx_rates(tmp_path, capsys):
+    assert load_fx_rates(None) is None
+    assert load_fx_rates(str(tmp_path / "missing.csv")) is None
+
+    bad = tmp_path / "bad.csv"
+    bad.write_text("Day,Code,Value\n2025-01-02,USD,32.8\n")
+    assert load_fx_rates(str(bad)) is None
+    assert "Error loading FX rates" in capsys.readouterr().out
+
+    table = load_fx_rates(write_rates(tmp_path / "fx_rates.csv", [("2025-01-02", "USD", 32.8)]))
+    assert table.rate("USD", "TWD", "2025-01-10") == 32.8
+    assert table.rate("TWD", "USD", "2025-01-10") == 1 / 32.8
+    # The version changes with the file contents
+    other = load_fx_rates(write_rates(tmp_path / "fx_rates.csv", [("2025-01-02", "USD", 32.9)]))
+    assert other.version != table.version
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Tests for ledger-wide duplicate invoice detection
+"""
+
+import pandas as pd
+from duplicate_detector import DuplicateDetector, normalize_number_key
+
+
+def ledger_rows(*invoices):
+    """Sheet rows from (invoice number, source file, vendor, total, invoice date) tuples"""
+    return pd.DataFrame([
+        {"Invoice Number": number, "Source File": source, "Vendor Name": vendor,
+         "Total Amount": total, "Currency": "TWD", "Invoice Date": invoice_date}
+        for number, source, vendor, total, invoice_date in invoices
+    ])
+
+
+def test_normalize_number_key():
+    keys = normalize_number_key(pd.Series(["AB-0001", "ab 0001", "AB-OOO1", None]))
+    assert list(keys) == ["AB0001", "AB0001", "AB0001", ""]
+
+
+def test_flags_reformatted_number_and_same_amount_within_window(tmp_path):
+    detector = DuplicateDetector(str(tmp_path / "duplicates.sqlite"))
+    try:
+        assert detector.check_batch(ledger_rows(
+            ("AB-0001", "a.png", "台灣電力股份有限公司", 1050, "2025-01-15"),
+        )) == []
+
+        pairs = detector.check_batch(ledger_rows(
+            ("ab 0001", "b.png", "中華電信", 300, "2025-03-01"),
+            ("ZZ-9", "c.png", "臺灣電力公司", 1050, "2025-01-17"),
+            ("ZZ-10", "d.png", "臺灣電力公司", 1050, "2025-02-20"),
+        ))
+        assert sorted(pairs) == [
+            ("ZZ-9", "c.png", "AB-0001", "a.png", "vendor/amount/date"),
+            ("ab 0001", "b.png", "AB-0001", "a.png", "invoice number"),
+        ]
+
+        # Invoices already indexed are not flagged again
+        assert detector.check_batch(ledger_rows(
+            ("ab 0001", "b.png", "中華電信", 300, "2025-03-01"),
+        )) == []
+    finally:
+        detector.close()
+
+
+def test_pages_of_one_document_are_not_duplicates(tmp_path):
+    detector = DuplicateDetector(str(tmp_path / "duplicates.sqlite"))
+    try:
+        pages = [("INV-7", f"scan.pdf_page_{page}", "台灣電力", 1050, "2025-01-15") for page in (1, 2, 3)]
+        assert detector.check_batch(ledger_rows(*pages)) == []
+
+        # The same invoice from another document still is
+        pairs = detector.check_batch(ledger_rows(("INV-7", "copy.pdf_page_1", "台灣電力", 1050, "2025-01-15")))
+        assert {match_source for _, _, _, match_source, _ in pairs} == {
+            "scan.pdf_page_1", "scan.pdf_page_2", "scan.pdf_page_3"}
+    finally:
+        detector.close()
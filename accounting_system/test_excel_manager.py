@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Tests for ExcelManager filtering, with and without the Parquet dataset
+"""
+
+from excel_manager import ExcelManager
+
+
+def make_invoice(number, vendor, total, invoice_date="2025-01-15", due_date="2025-02-14",
+                 currency="TWD", source_file=None):
+    """Invoice dict shaped like an extraction result"""
+    return {
+        "invoice_number": number,
+        "vendor_name": vendor,
+        "invoice_date": invoice_date,
+        "due_date": due_date,
+        "tax_amount": round(total * 0.05, 2),
+        "total_amount": total,
+        "currency": currency,
+        "source_file": source_file or f"{number}.png",
+        "line_items": [{"description": "影印紙", "quantity": 1, "unit_price": total, "amount": total}],
+    }
+
+
+INVOICES = [
+    make_invoice("AB-0001", "台灣電力股份有限公司", 1050),
+    make_invoice("AB-0002", "中華電信股份有限公司", 2100),
+    make_invoice("AB-0003", "台灣電力公司", 315),
+]
+
+
+def make_manager(tmp_path, with_dataset):
+    manager = ExcelManager(str(tmp_path / "invoice_data.xlsx"),
+                           dataset_dir=str(tmp_path / "dataset") if with_dataset else None)
+    manager.export_to_excel(INVOICES)
+    return manager
+
+
+def test_payment_status_filter_with_dataset(tmp_path):
+    manager = make_manager(tmp_path, with_dataset=True)
+    assert manager.update_payment_status("AB-0002", "Paid", "2025-02-01")
+
+    paid = manager.filter_invoices({"payment_status": "Paid"})
+    assert set(paid["Invoice Number"]) == {"AB-0002"}
+
+    pending = manager.filter_invoices({"payment_status": "Pending", "currency": "TWD"})
+    assert set(pending["Invoice Number"]) == {"AB-0001", "AB-0003"}
+
+
+def test_payment_status_filter_without_dataset(tmp_path):
+    manager = make_manager(tmp_path, with_dataset=False)
+    assert manager.update_payment_status("AB-0001", "Paid", "2025-02-01")
+
+    paid = manager.filter_invoices({"payment_status": "Paid"})
+    assert set(paid["Invoice Number"]) == {"AB-0001"}
+
+
+def test_vendor_filter_uses_index_on_both_paths(tmp_path):
+    for with_dataset in (True, False):
+        folder = tmp_path / ("dataset" if with_dataset else "workbook")
+        folder.mkdir()
+        manager = make_manager(folder, with_dataset)
+
+        # Variant character and company suffix differ from the stored names
+        filtered = manager.filter_invoices({"vendor_name": "臺灣電力股份有限公司"})
+        assert set(filtered["Invoice Number"]) == {"AB-0001", "AB-0003"}
+
+        # Shorter than a bigram: falls back to substring matching
+        filtered = manager.filter_invoices({"vendor_name": "電"})
+        assert set(filtered["Invoice Number"]) == {"AB-0001", "AB-0002", "AB-0003"}
+
+        filtered = manager.filter_invoices({"vendor_name": "不存在的廠商"})
+        assert len(filtered) == 0
+
+
+def test_date_range_and_payment_columns_match_on_both_paths(tmp_path):
+    results = {}
+    for with_dataset in (True, False):
+        folder = tmp_path / ("dataset" if with_dataset else "workbook")
+        folder.mkdir()
+        manager = make_manager(folder, with_dataset)
+        manager.export_to_excel([make_invoice("AB-0004", "台灣電力公司", 420, invoice_date="2025/01/31")])
+        manager.update_payment_status("AB-0004", "Paid", "2025-02-20")
+
+        # Mixed date formats, with the end day inclusive
+        filtered = manager.filter_invoices({"date_range": ("2025/01/16", "2025-01-31")})
+        results[with_dataset] = filtered
+        assert list(filtered["Invoice Number"]) == ["AB-0004"]
+        assert list(filtered["Payment Status"]) == ["Paid"]
+        assert list(filtered["Payment Date"].astype(str)) == ["2025-02-20"]
+
+    assert set(results[True].columns) == set(results[False].columns)
+
+
+def test_dataset_keeps_every_page_written_to_the_workbook(tmp_path):
+    manager = ExcelManager(str(tmp_path / "invoice_data.xlsx"), dataset_dir=str(tmp_path / "dataset"))
+    pages = [make_invoice("INV-7", "台灣電力", 100, source_file=f"scan.pdf_page_{page}") for page in (1, 2, 3)]
+    manager.export_to_excel(pages[:1])
+    # Later pages of an invoice number already in the workbook are not written anywhere
+    manager.export_to_excel(pages[1:])
+    assert len(manager.filter_invoices({})) == len(manager.read_excel_data()) == 1
+
+    manager.rebuild_from_invoices(pages)
+    assert list(manager.filter_invoices({})["Source File"]) == list(manager.read_excel_data()["Source File"])
+    assert len(manager.read_excel_data()) == 3
+
+
+def test_only_written_invoices_are_indexed(tmp_path):
+    manager = make_manager(tmp_path, with_dataset=True)
+    # Same invoice number as a ledger row, so the workbook skips it
+    manager.export_to_excel([make_invoice("AB-0001", "遠東百貨股份有限公司", 999, source_file="resend.png")])
+
+    assert manager.get_search_index().document_count() == 3
+    assert manager.search_invoices("遠東百貨") == []
+    assert len(manager.dataset.query({})) == 3
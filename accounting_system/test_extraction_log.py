@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests for the extraction log and zero-API rebuilds
+"""
+
+import pandas as pd
+from PIL import Image
+from automated_invoice_processor import EXTRACTION_PROMPT, TOOLS, InvoiceProcessor
+from chunked_extraction import HEADER_PROMPT, HEADER_TOOLS, LINE_ITEM_TOOLS, line_items_prompt
+from extraction_log import ExtractionLog, prompt_hash, read_segment, reproject_history, source_document
+from fake_api_client import FakeAnthropicClient
+from test_chunked_extraction import make_processor
+
+
+def logged_record(number, source_file, total=1050):
+    """Extraction log record for one accepted fast-tier extraction"""
+    return {
+        "source_file": source_file,
+        "result_tier": "fast",
+        "attempts": [{
+            "tier": "fast",
+            "pass": "full",
+            "stop_reason": "tool_use",
+            "tool_input": {"invoice_data": {"invoice_number": number, "vendor_name": "測試供應商",
+                                            "total_amount": total, "line_items": []}},
+        }],
+        "metadata": {"source_file": source_file},
+    }
+
+
+def test_source_document_strips_page_suffix():
+    assert source_document("scan.pdf_page_3") == "scan.pdf"
+    assert source_document("receipt.png") == "receipt.png"
+    assert source_document("page_1.png") == "page_1.png"
+
+
+def test_reproject_keeps_every_page_of_a_document(tmp_path):
+    log = ExtractionLog(str(tmp_path / "log"))
+    for page in (1, 2, 3):
+        log.append(logged_record("INV-100", f"scan.pdf_page_{page}"))
+    # Same invoice number from another document, and a page extracted again
+    log.append(logged_record("INV-100", "copy.png"))
+    log.append(logged_record("INV-100", "scan.pdf_page_1"))
+    log.append(logged_record("INV-200", "other.png"))
+
+    invoices = reproject_history(str(tmp_path / "log"), max_workers=1)
+
+    assert [(i["invoice_number"], i["source_file"]) for i in invoices] == [
+        ("INV-100", "scan.pdf_page_1"),
+        ("INV-100", "scan.pdf_page_2"),
+        ("INV-100", "scan.pdf_page_3"),
+        ("INV-200", "other.png"),
+    ]
+
+
+def test_rebuild_matches_incremental_export_without_api_calls(tmp_path):
+    client = FakeAnthropicClient()
+    processor = InvoiceProcessor(input_folder=str(tmp_path / "invoice"),
+                                 output_file=str(tmp_path / "invoice_data.xlsx"),
+                                 client=client,
+                                 extraction_log_dir=str(tmp_path / "extraction_log"))
+    invoices = []
+    for color in ("red", "green", "blue"):
+        image_path = tmp_path / f"{color}.png"
+        Image.new("RGB", (32, 32), color).save(image_path)
+        invoices.append(processor.extract_invoice_data(str(image_path)))
+    processor.excel_manager.export_to_excel(invoices)
+    incremental = pd.read_excel(tmp_path / "invoice_data.xlsx")
+    calls = len(client.messages.calls)
+
+    assert processor.rebuild_outputs(max_workers=1) == 3
+
+    rebuilt = pd.read_excel(tmp_path / "invoice_data.xlsx")
+    assert len(client.messages.calls) == calls
+    assert list(rebuilt["Invoice Number"]) == list(incremental["Invoice Number"])
+    assert list(rebuilt["Source File"]) == list(incremental["Source File"])
+
+
+def test_each_attempt_records_the_prompt_it_used(tmp_path):
+    processor, client, image_path = make_processor(tmp_path, 80)
+    processor.extract_invoice_data(image_path)
+
+    [record] = [record for segment in processor.extraction_log.segments() for record in read_segment(segment)]
+    hashes = {attempt["pass"]: attempt["prompt_hash"] for attempt in record["attempts"]}
+    assert hashes["full"] == prompt_hash(EXTRACTION_PROMPT, TOOLS)
+    assert hashes["header"] == prompt_hash(HEADER_PROMPT, HEADER_TOOLS)
+
+    line_item_passes = [attempt for attempt in record["attempts"] if attempt["pass"] == "line_items"]
+    assert line_item_passes
+    for attempt in line_item_passes:
+        assert attempt["prompt_hash"] == prompt_hash(line_items_prompt(*attempt["range"]), LINE_ITEM_TOOLS)
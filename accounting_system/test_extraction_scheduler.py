@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Tests for the budget-aware extraction scheduler
+"""
+
+import os
+import fitz  # PyMuPDF for building test PDFs
+from PIL import Image
+from extraction_scheduler import ExtractionScheduler, RESERVE_LINE_ITEM_PASSES, tier_cost
+from model_router import ModelRouter
+
+
+def make_image(tmp_path, name="receipt.png"):
+    path = tmp_path / name
+    Image.new("RGB", (800, 1000), "white").save(path)
+    return str(path)
+
+
+def make_pdf(tmp_path, pages, name="statement.pdf"):
+    path = tmp_path / name
+    doc = fitz.open()
+    for _ in range(pages):
+        doc.new_page()
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def test_reserve_covers_escalation_to_last_tier(tmp_path):
+    router = ModelRouter()
+    fast, large = router.model_tiers
+    job = ExtractionScheduler(router).estimate(make_image(tmp_path))
+
+    expected = (tier_cost(fast, job["input_tokens"], fast["max_tokens"])
+                + tier_cost(large, job["input_tokens"], large["max_tokens"]))
+    assert job["reserve"] == expected
+    assert job["reserve"] > job["cost"]
+
+
+def test_reserve_covers_chunking_for_documents_sent_to_last_tier(tmp_path):
+    router = ModelRouter()
+    large = router.model_tiers[-1]
+    # More pages than max_fast_pages go straight to the large model
+    job = ExtractionScheduler(router).estimate(make_pdf(tmp_path, 3))
+
+    single_call = tier_cost(large, job["input_tokens"], large["max_tokens"] * 3)
+    assert job["reserve"] > single_call * (1 + RESERVE_LINE_ITEM_PASSES)
+
+
+def test_spend_cap_stops_before_worst_case_overshoots(tmp_path):
+    router = ModelRouter()
+    scheduler = ExtractionScheduler(router, spend_cap=0.02)
+    job = scheduler.estimate(make_image(tmp_path))
+
+    # Expected cost fits under the cap, the worst case does not
+    scheduler.spent = scheduler.spend_cap - (job["cost"] + job["reserve"]) / 2
+    assert not scheduler.acquire(job)
+    assert scheduler.paused
+    assert scheduler.get_report()["deferred"] == 1
+
+    scheduler = ExtractionScheduler(router, spend_cap=0.02)
+    scheduler.spent = scheduler.spend_cap - job["reserve"]
+    assert scheduler.acquire(job)
+
+
+class FakeClock:
+    """Monotonic clock that only moves when the scheduler sleeps"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_rate_limit_window():
+    clock = FakeClock()
+    scheduler = ExtractionScheduler(ModelRouter(), tokens_per_minute=2500, requests_per_minute=3,
+                                    clock=clock, sleep=clock.sleep)
+    assert scheduler.acquire({"input_tokens": 1000, "requests": 1, "reserve": 0})
+
+    scheduler.pace()
+    clock.now += 20
+    scheduler.pace()
+    assert clock.sleeps == []
+    # A third call would exceed the token limit until the first leaves the window
+    scheduler.pace()
+    assert clock.sleeps == [40]
+    assert scheduler.window_usage() == (2000, 2)
+
+    scheduler.tokens_per_minute = None
+    scheduler.pace()
+    scheduler.pace()
+    # Request limit: wait for the call made at t+20
+    assert clock.sleeps == [40, 20]
+
+
+def test_every_api_call_is_paced(tmp_path):
+    from test_chunked_extraction import make_processor
+
+    processor, client, image_path = make_processor(tmp_path, 80)
+    clock = FakeClock()
+    scheduler = ExtractionScheduler(processor.model_router, requests_per_minute=2,
+                                    clock=clock, sleep=clock.sleep)
+    processor.scheduler = scheduler
+    job = scheduler.estimate(image_path)
+    assert scheduler.acquire(job)
+
+    usage_before = processor.model_router.get_totals()
+    processor.extract_invoice_data(image_path)
+    scheduler.record(job, usage_before)
+
+    calls = len(client.messages.calls)
+    # Escalation and chunk passes each count as a request
+    assert calls > 2
+    assert scheduler.paced_requests == calls
+    assert len(clock.sleeps) == (calls - 1) // 2
+    assert scheduler.window_usage()[1] <= 2
+
+
+def test_plan_orders_by_folder_then_due_date_then_age(tmp_path):
+    for folder in ("north", "south", "east"):
+        (tmp_path / folder).mkdir()
+    paths = {
+        "north_old": make_image(tmp_path / "north", "receipt.png"),
+        "north_due": make_image(tmp_path / "north", "invoice_2025-02-01.png"),
+        "south_late": make_image(tmp_path / "south", "invoice_20250301.png"),
+        "south_early": make_image(tmp_path / "south", "invoice_2025_01_15.png"),
+        "south_new": make_image(tmp_path / "south", "scan_b.png"),
+        "south_old": make_image(tmp_path / "south", "scan_a.png"),
+        "east": make_image(tmp_path / "east", "invoice_2024-12-01.png"),
+    }
+    for age, name in enumerate(["south_new", "north_old", "south_old"]):
+        os.utime(paths[name], (1_700_000_000 - age * 100, 1_700_000_000 - age * 100))
+
+    scheduler = ExtractionScheduler(ModelRouter(), folder_priorities={"south": 0, "north": 1})
+    jobs = scheduler.plan(list(paths.values()) + [paths["east"]])
+
+    order = {path: name for name, path in paths.items()}
+    # Files without a due date hint come after dated ones, oldest first; unlisted folders last
+    assert [order[job["file_path"]] for job in jobs] == [
+        "south_early", "south_late", "south_old", "south_new", "north_due", "north_old", "east"]
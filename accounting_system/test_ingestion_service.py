@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Tests for the HTTP ingestion service, run end to end against the fake API client
+"""
+
+import io
+import json
+import time
+import threading
+import urllib.request
+import urllib.error
+import pandas as pd
+from PIL import Image
+from document_processor import DocumentProcessor
+from fake_api_client import FakeAnthropicClient
+from ingestion_service import IngestionService, JobStore, make_server
+
+
+def png_bytes(color):
+    """A small PNG image; different colors give different fake invoice numbers"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def start_service(tmp_path):
+    """Start an ingestion service on a free port; returns (service, server, base_url)"""
+    processor = DocumentProcessor(watch_folder=str(tmp_path / "watch"),
+                                  processed_folder=str(tmp_path / "processed"),
+                                  failed_folder=str(tmp_path / "failed"),
+                                  output_file=str(tmp_path / "invoice_data.xlsx"),
+                                  client=FakeAnthropicClient(),
+                                  extraction_log_dir=str(tmp_path / "extraction_log"))
+    service = IngestionService(processor, upload_folder=str(tmp_path / "uploads"), max_workers=2)
+    server = make_server(service, "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return service, server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def request_json(url, data=None):
+    """Send a GET (or POST with data) and return (status, json body)"""
+    request = urllib.request.Request(url, data=data, method="POST" if data is not None else "GET")
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def wait_for_job(base_url, job_id, timeout=30):
+    """Poll a job until it leaves the queued/processing states"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        _, job = request_json(f"{base_url}/jobs/{job_id}")
+        if job["status"] not in ("queued", "processing"):
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+def test_upload_and_job_status(tmp_path):
+    service, server, base_url = start_service(tmp_path)
+    try:
+        status, body = request_json(f"{base_url}/documents?filename=invoice_a.png", png_bytes("red"))
+        assert status == 202
+        job = wait_for_job(base_url, body["job_id"])
+
+        assert job["status"] == "completed"
+        assert job["results"][0]["invoice_number"].startswith("FAKE-")
+
+        ledger = pd.read_excel(tmp_path / "invoice_data.xlsx")
+        assert job["results"][0]["invoice_number"] in set(ledger["Invoice Number"])
+
+        status, summary = request_json(f"{base_url}/jobs")
+        assert status == 200
+        assert summary["by_status"] == {"completed": 1}
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.shutdown(wait=True)
+
+
+def test_rejects_unsupported_and_unknown(tmp_path):
+    service, server, base_url = start_service(tmp_path)
+    try:
+        status, body = request_json(f"{base_url}/documents?filename=notes.txt", b"hello")
+        assert status == 400
+        assert "Unsupported" in body["error"]
+
+        status, _ = request_json(f"{base_url}/jobs/does-not-exist")
+        assert status == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.shutdown(wait=True)
+
+
+def test_finished_jobs_are_evicted():
+    now = [0.0]
+    jobs = JobStore(ttl=60, max_finished=2, clock=lambda: now[0])
+    running = jobs.create("running.png")
+    jobs.update(running, status="processing")
+    finished = []
+    for name in ("a.png", "b.png", "c.png"):
+        job_id = jobs.create(name)
+        jobs.update(job_id, status="completed", finished_at="2025-01-15T10:00:00")
+        finished.append(job_id)
+        now[0] += 10
+
+    # Beyond max_finished the oldest finished job goes; running jobs stay
+    assert jobs.get(finished[0]) is None
+    assert jobs.get(finished[1])["status"] == "completed"
+    assert jobs.get(running)["status"] == "processing"
+
+    now[0] = 75
+    assert jobs.get(finished[1]) is None
+    assert jobs.get(finished[2]) is not None
+    assert jobs.summary() == {"total_jobs": 2, "by_status": {"processing": 1, "completed": 1},
+                              "evicted_jobs": 2}
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Tests for model tier routing and escalation
+"""
+
+from types import SimpleNamespace
+from PIL import Image
+from model_router import ModelRouter
+
+
+def make_image(tmp_path, size=(100, 100)):
+    path = tmp_path / "invoice.png"
+    Image.new("RGB", size, "white").save(path)
+    return str(path)
+
+
+def invoice(total=300, amounts=(100, 200), tax=0):
+    return {
+        "invoice_number": "AB-0001",
+        "vendor_name": "台灣電力股份有限公司",
+        "total_amount": total,
+        "tax_amount": tax,
+        "line_items": [{"description": f"項目 {i}", "amount": amount} for i, amount in enumerate(amounts)],
+    }
+
+
+def scripted(results):
+    """call_model returning one result per tier name, recording the tiers called"""
+    called = []
+
+    def call_model(tier):
+        called.append(tier["name"])
+        return results[tier["name"]](), SimpleNamespace(input_tokens=100, output_tokens=50)
+
+    return call_model, called
+
+
+def test_reconciliation_failure_escalates(tmp_path):
+    router = ModelRouter()
+    call_model, called = scripted({"fast": lambda: invoice(total=999), "large": invoice})
+
+    result = router.extract(call_model, make_image(tmp_path))
+
+    assert called == ["fast", "large"]
+    assert result["model_tier"] == "large"
+    report = router.get_routing_report()
+    assert report["fast"]["escalations"] == 1
+    assert report["large"]["accepted"] == 1
+
+    # Items listed before tax still reconcile, within the tolerance
+    assert router.validate_result(invoice(total=315, tax=15)) is None
+    assert router.validate_result(invoice(total=301)) is None
+    assert "does not reconcile" in router.validate_result(invoice(total=310))
+    assert ModelRouter(thresholds={"reconciliation_tolerance": 0.05}).validate_result(invoice(total=310)) is None
+
+
+def test_page_count_and_megapixels_route_to_large_tier(tmp_path):
+    router = ModelRouter(thresholds={"max_fast_megapixels": 0.5})
+    small = make_image(tmp_path, (400, 400))
+
+    assert router.initial_tier_index(small, page_count=2) == 0
+    assert router.initial_tier_index(small, page_count=3) == 1
+    (tmp_path / "large").mkdir()
+    assert router.initial_tier_index(make_image(tmp_path / "large", (1000, 600)), page_count=1) == 1
+    # Unreadable dimensions do not force the large tier
+    assert router.initial_tier_index(str(tmp_path / "missing.png")) == 0
+    # The default threshold is 12 MP
+    assert ModelRouter().initial_tier_index(make_image(tmp_path / "large", (4000, 3200))) == 1
+    assert ModelRouter().initial_tier_index(make_image(tmp_path / "large", (4000, 3000))) == 0
+
+    call_model, called = scripted({"fast": invoice, "large": invoice})
+    assert router.extract(call_model, small, page_count=3)["model_tier"] == "large"
+    assert called == ["large"]
+
+
+def test_last_tier_does_not_check_density(tmp_path):
+    router = ModelRouter(thresholds={"max_fast_line_items": 2})
+    dense = lambda: invoice(total=600, amounts=(100, 200, 300))
+    assert router.validate_result(dense()).startswith("dense line items")
+    assert router.validate_result(dense(), check_density=False) is None
+
+    call_model, called = scripted({"fast": dense, "large": dense})
+    result = router.extract(call_model, make_image(tmp_path))
+
+    # Dense on the fast tier escalates; the same result is accepted on the last tier
+    assert called == ["fast", "large"]
+    assert result["model_tier"] == "large"
+    assert router.get_routing_report()["large"]["accepted"] == 1
+
+
+def test_unusable_results_fall_back_or_fail(tmp_path):
+    router = ModelRouter()
+    call_model, called = scripted({"fast": lambda: None,
+                                   "large": lambda: dict(invoice(), total_amount="n/a")})
+    fallback = router.extract(call_model, make_image(tmp_path))
+    assert fallback["model_tier"] == "large"
+
+    call_model, called = scripted({"fast": lambda: None, "large": lambda: None})
+    assert router.extract(call_model, make_image(tmp_path)) is None
+    assert router.get_totals()["calls"] == 4
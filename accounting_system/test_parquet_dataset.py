@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Tests for the partitioned Parquet invoice dataset
+"""
+
+import os
+import pyarrow.dataset as ds
+from parquet_dataset import MAX_FILES_PER_PARTITION, ParquetInvoiceDataset
+from test_excel_manager import make_invoice
+
+
+def part_files(base_dir):
+    return sorted(os.path.relpath(os.path.join(root, name), base_dir)
+                  for root, _, names in os.walk(base_dir) for name in names if name.endswith(".parquet"))
+
+
+def test_pages_of_one_pdf_are_all_kept(tmp_path):
+    dataset = ParquetInvoiceDataset(str(tmp_path / "dataset"))
+    pages = [make_invoice("INV-7", "台灣電力", 100 * page, source_file=f"scan.pdf_page_{page}")
+             for page in (1, 2, 3)]
+
+    assert dataset.append(pages) == 3
+    # Re-appending the same pages, or a subset, adds nothing
+    assert dataset.append(pages[1:]) == 0
+
+    flat = dataset.query_flat({})
+    assert list(flat["Source File"]) == ["scan.pdf_page_1", "scan.pdf_page_2", "scan.pdf_page_3"]
+    assert list(flat["Amount"]) == [100, 200, 300]
+
+
+def test_date_range_prunes_partitions(tmp_path):
+    dataset = ParquetInvoiceDataset(str(tmp_path / "dataset"))
+    dataset.append([
+        make_invoice("JAN-1", "台灣電力", 100, invoice_date="2025-01-31"),
+        make_invoice("FEB-1", "台灣電力", 200, invoice_date="2025-02-01"),
+        make_invoice("MAR-1", "台灣電力", 300, invoice_date="2025/03/05"),
+    ])
+
+    headers = ds.dataset(dataset.headers_dir, format="parquet", partitioning=dataset.partitioning())
+    expression = dataset.build_filter({"date_range": ("2025-01-01", "2025/01/31")})
+    scanned = [os.path.relpath(fragment.path, dataset.headers_dir)
+               for fragment in headers.get_fragments(filter=expression)]
+    assert scanned and all(path.startswith(os.path.join("year=2025", "month=01")) for path in scanned)
+
+    # A plain end date includes the whole day; the start date is inclusive too
+    assert list(dataset.query({"date_range": ("2025-01-01", "2025/01/31")})["Invoice Number"]) == ["JAN-1"]
+    assert list(dataset.query({"date_range": ("2025-02-01", "2025-03-05")})["Invoice Number"]) == [
+        "FEB-1", "MAR-1"]
+    assert len(dataset.query({"date_range": ("2024-01-01", "2024-12-31")})) == 0
+
+
+def test_small_appends_are_compacted(tmp_path):
+    dataset = ParquetInvoiceDataset(str(tmp_path / "dataset"))
+    count = MAX_FILES_PER_PARTITION + 3
+    for number in range(count):
+        dataset.append([make_invoice(f"AB-{number:04d}", "台灣電力", 100 + number)])
+
+    assert len(part_files(dataset.headers_dir)) <= MAX_FILES_PER_PARTITION
+    assert len(part_files(dataset.line_items_dir)) <= MAX_FILES_PER_PARTITION
+    assert not [name for name in os.listdir(os.path.dirname(os.path.join(
+        dataset.headers_dir, part_files(dataset.headers_dir)[0]))) if not name.endswith(".parquet")]
+
+    flat = dataset.query_flat({})
+    assert len(flat) == count
+    assert set(flat["Invoice Number"]) == {f"AB-{number:04d}" for number in range(count)}
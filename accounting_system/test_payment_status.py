@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Tests for payment status tracking, bank statement matching and payables aging
+"""
+
+import pandas as pd
+from excel_manager import ExcelManager
+from test_excel_manager import make_invoice, make_manager
+
+
+def write_bank_csv(path, rows, columns=("Reference", "Amount", "Date")):
+    pd.DataFrame(rows, columns=list(columns)).to_csv(path, index=False)
+    return str(path)
+
+
+def ledger_statuses(manager):
+    df = manager.read_excel_data()
+    return dict(zip(df["Invoice Number"], df["Payment Status"]))
+
+
+def test_bank_csv_marks_matching_invoices_paid(tmp_path):
+    manager = make_manager(tmp_path, with_dataset=False)
+    csv_path = write_bank_csv(tmp_path / "bank.csv", [
+        (" ab-0001", "1050", "2025-02-03"),  # case and spacing differ, amount matches
+        ("AB-0002", "999", "2025-02-03"),    # amount does not match
+        ("XX-1", "100", "2025-02-03"),
+    ])
+
+    result = manager.mark_paid_from_bank_csv(csv_path)
+
+    assert result["matched"] == 1
+    assert len(result["unmatched"]) == 2
+    assert ledger_statuses(manager) == {"AB-0001": "Paid", "AB-0002": "Pending", "AB-0003": "Pending"}
+
+
+def test_bank_csv_without_reference_column_is_rejected(tmp_path, capsys):
+    manager = make_manager(tmp_path, with_dataset=False)
+    csv_path = write_bank_csv(tmp_path / "bank.csv", [("AB-0001", "1050", "2025-02-03")],
+                              columns=("Memo", "Amount", "Date"))
+
+    assert manager.mark_paid_from_bank_csv(csv_path) is None
+    assert "no 'Reference' column" in capsys.readouterr().out
+    assert set(ledger_statuses(manager).values()) == {"Pending"}
+
+    # A custom column mapping makes the same file usable
+    result = manager.mark_paid_from_bank_csv(csv_path, columns={"reference": "Memo"})
+    assert result["matched"] == 1
+
+
+def test_overdue_refresh_and_aging_report(tmp_path):
+    manager = make_manager(tmp_path, with_dataset=False)
+    manager.update_payment_status("AB-0002", "Paid", "2025-02-01")
+
+    assert manager.refresh_overdue_status("2025-03-20") == 2
+    assert ledger_statuses(manager) == {"AB-0001": "Overdue", "AB-0002": "Paid", "AB-0003": "Overdue"}
+
+    report = manager.get_aging_report("2025-03-20")
+    assert list(report["Aging Bucket"]) == ["31-60"]
+    assert report["invoices"].sum() == 2
+    assert report["total_amount"].sum() == 1050 + 315
+
+    # Nothing new falls due on a second run for the same day
+    assert manager.refresh_overdue_status("2025-03-20") == 0
+
+
+def test_pages_of_one_pdf_count_as_one_invoice(tmp_path):
+    manager = ExcelManager(str(tmp_path / "invoice_data.xlsx"))
+    manager.export_to_excel([
+        make_invoice("INV-7", "台灣電力股份有限公司", 300, source_file=f"scan.pdf_page_{page}")
+        for page in (1, 2, 3)
+    ] + [make_invoice("AB-0002", "中華電信股份有限公司", 2100)])
+
+    summary = manager.get_invoice_summary()
+    assert summary["total_invoices"] == 2
+    assert summary["total_amount"] == 300 + 2100
+
+    assert manager.refresh_overdue_status("2025-03-20") == 2
+    report = manager.get_aging_report("2025-03-20")
+    assert report["invoices"].sum() == 2
+    assert report["total_amount"].sum() == 300 + 2100
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Tests for the CJK-aware invoice search index
+"""
+
+from search_index import InvoiceSearchIndex, shorter_than_gram, tokenize, vendor_key
+
+
+def make_index(tmp_path):
+    index = InvoiceSearchIndex(str(tmp_path / "search.sqlite"))
+    index.add_invoices([
+        {"invoice_number": "A1", "source_file": "a.png", "vendor_name": "臺灣電力股份有限公司",
+         "line_items": [{"description": "電費"}]},
+        {"invoice_number": "A2", "source_file": "b.png", "vendor_name": "中華電信股份有限公司",
+         "line_items": [{"description": "網路月租費"}]},
+        {"invoice_number": "A3", "source_file": "c.png", "vendor_name": "ＡＢＣ Trading Co., Ltd.",
+         "line_items": [{"description": "Printer paper"}]},
+    ])
+    return index
+
+
+def test_tokenize_and_keys():
+    assert tokenize("台灣電力") == ["台灣", "灣電", "電力"]
+    assert tokenize("paper") == ["pap", "ape", "per"]
+    assert vendor_key("臺灣電力股份有限公司") == vendor_key("台灣電力公司")
+    assert shorter_than_gram("電")
+    assert shorter_than_gram("ab")
+    assert not shorter_than_gram("電力")
+
+
+def test_search_ranks_and_returns_doc_details(tmp_path):
+    index = make_index(tmp_path)
+
+    hits = index.search("台灣電力公司", fields=["vendor"])
+    assert hits[0]["invoice_number"] == "A1"
+    assert hits[0]["vendor_name"] == "臺灣電力股份有限公司"
+    assert hits[0]["match"] == 1.0
+
+    hits = index.search("abc trading", limit=None)
+    assert [hit["source_file"] for hit in hits] == ["c.png"]
+
+
+def test_short_vendor_query_matches_by_substring(tmp_path):
+    index = make_index(tmp_path)
+
+    hits = index.search("電", fields=["vendor"], limit=None)
+    assert {hit["invoice_number"] for hit in hits} == {"A1", "A2"}
+
+    assert len(index.search("電", fields=["vendor"], limit=1)) == 1
+
+
+def test_common_tokens_do_not_change_results(tmp_path, monkeypatch):
+    index = InvoiceSearchIndex(str(tmp_path / "search.sqlite"))
+    index.add_invoices([
+        {"invoice_number": f"N{i}", "source_file": f"{i}.png",
+         "vendor_name": "台灣電力股份有限公司" if i % 10 == 0 else f"測試商行{i}",
+         "vendor_address": "台北市中正區", "line_items": [{"description": "影印紙" if i % 3 else "電費"}]}
+        for i in range(60)
+    ])
+    queries = [("台北市 台灣電力", 5, 0.0), ("台北市 台灣電力", None, 0.0), ("台灣電力", None, 0.75),
+               ("台北市 電費", 3, 0.0), ("台北市影印紙", 10, 0.0)]
+
+    results = [index.search(query, limit=limit, min_match=min_match) for query, limit, min_match in queries]
+    # Score every token fully, as if none were common
+    monkeypatch.setattr("search_index.COMMON_TOKEN_SHARE", 1.0)
+    assert results == [index.search(query, limit=limit, min_match=min_match)
+                       for query, limit, min_match in queries]
+    assert [hit["invoice_number"] for hit in results[2]] == [f"N{i}" for i in range(50, -1, -10)]